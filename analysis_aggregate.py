@@ -0,0 +1,92 @@
+import os
+import argparse
+import numpy
+import gazeplotter_core
+import pandas as pd
+from fixation_store import load_condition
+
+from PIL import Image
+from reflacx_paths import PathResolver
+from heatmap_aggregate import MODES, aggregate_reads
+
+XAMI_MIMIC_PATH = r"D:\XAMI-MIMIC"
+
+# All conditions
+CONDITIONS = ['abnmc', 'afr', 'awt', 'ate', 'cns', 'epy', 'ecs', 'ehi', 'fbr', 'frc',
+'gop', 'hhe', 'hlv', 'ild', 'lnm', 'mss', 'nod', 'pab', 'pef', 'pti', 'pne', 'ped', 'wmd']
+
+
+def run_condition(condition, resolver, outdir, mode='mean', limit=None):
+    print(condition)
+
+    # Read fixations data (from the fixation store, if the condition was
+    # converted to one)
+    data = load_condition(condition)
+
+    # Get the amount of trials in this dataset
+    ntrials = len(data)
+    if limit is not None:
+        ntrials = min(ntrials, limit)
+
+    # Reads of every image, and the path to the image
+    reads = []
+    images = {}
+    for trialnr in range(ntrials):
+
+        paths = resolver.lookup(data[trialnr]['study_id'], data[trialnr]['id'], data[trialnr]['image_name'])
+
+        if paths is None:
+            print('no paths')
+            continue
+
+        DISPSIZE = (int(paths['image_size_x']), int(paths['image_size_y']))
+        reads.append((paths['dicom_id'], DISPSIZE, trialnr))
+        images[paths['dicom_id']] = resolver.resolve(paths['image_path'])
+
+    # Stream the reads image by image, so that only the aggregate of one
+    # image is in memory; fixations without the first fixation
+    reads.sort(key=lambda read: read[0])
+    stream = ((dicom_id, DISPSIZE, data[trialnr]['events']['Efix'][1:]) for dicom_id, DISPSIZE, trialnr in reads)
+
+    os.makedirs(outdir, exist_ok=True)
+    written = []
+    for dicom_id, heatmap, count in aggregate_reads(stream, mode=mode):
+        savepath = os.path.join(outdir, dicom_id + '.jpg')
+
+        # Draw over the image if it is there
+        background = 'white'
+        if os.path.isfile(images[dicom_id]):
+            background = numpy.asarray(Image.open(images[dicom_id]).convert('L'))
+
+        gazeplotter_core.save_heatmap(heatmap, savepath, background=background)
+        print(savepath + ' (' + str(count) + ' reads)')
+        written.append({'condition': condition, 'dicom_id': dicom_id, 'reads': count, 'path': savepath})
+
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export one heatmap per image, aggregated over all reads of the image.')
+    parser.add_argument('conditions', nargs='*', default=CONDITIONS,
+                        help='conditions to export (default: all conditions)')
+    parser.add_argument('--output-root', default=XAMI_MIMIC_PATH,
+                        help='folder that replaces {XAMI_MIMIC_PATH} in the paths, and in which aggregate_<mode> is written (default: %(default)s)')
+    parser.add_argument('--mode', choices=MODES, default='mean',
+                        help='how the reads of an image are combined (default: %(default)s)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only use the first LIMIT trials of every condition')
+    args = parser.parse_args(argv)
+
+    # Master with paths, indexed once
+    resolver = PathResolver(args.output_root, 'reflacx_with_fixations.csv')
+
+    written = []
+    for condition in args.conditions:
+        outdir = os.path.join(args.output_root, 'aggregate_' + args.mode, condition)
+        written.extend(run_condition(condition, resolver, outdir, mode=args.mode, limit=args.limit))
+
+    pd.DataFrame(written).to_csv('aggregate_paths.csv')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,15 @@
 import os
-import pickle
 import gazeplotter_ellipses
 import gazeplotter_normal
+import instrumentation
 import pandas as pd
+from fixation_store import load_condition
+from export_manifest import ExportManifest, MANIFEST_NAME, render_hash
 
-from matplotlib.pyplot import close
+from gazeplotter_core import close_figure, use_batch_backend
+
+# Figures are only saved, so draw them off-screen
+use_batch_backend()
 
 XAMI_MIMIC_PATH = "D:\XAMI-MIMIC"
 
@@ -43,16 +48,21 @@ for condition in conditions:
         # If the output directory does not exist yet, make it
         os.mkdir(OUTPUTDIR)
 
-    # Read fixations data
-    file_name = 'fixations/fixations_'+condition+'.pkl'
-    with open(file_name, 'rb') as f:
-        data = pickle.load(f)
+    # Heatmaps rendered by earlier runs, which are skipped when their input
+    # did not change
+    manifest = ExportManifest(os.path.join(OUTPUTDIR, MANIFEST_NAME))
+
+    # Read fixations data (from the fixation store, if the condition was
+    # converted to one)
+    with instrumentation.stage('load', condition=condition):
+        data = load_condition(condition)
 
     print(data[0].keys())
 
     # Read bbox data
     bbox_filename = 'bboxes/bboxes_'+condition+'.csv'
-    bbox = pd.read_csv(bbox_filename)
+    with instrumentation.stage('read_bboxes'):
+        bbox = pd.read_csv(bbox_filename)
 
     # Get the amount of trials in this dataset
     ntrials = len(data)
@@ -82,7 +92,8 @@ for condition in conditions:
 
         print(id_trial)
 
-        bbox_new = bbox.loc[bbox['patient_id'].astype(int)==id_trial]
+        with instrumentation.stage('filter'):
+            bbox_new = bbox.loc[bbox['patient_id'].astype(int)==id_trial]
         # print(id_trial) 
 
         for study in bbox_new['study_id'].unique(): 
@@ -90,26 +101,30 @@ for condition in conditions:
             id_study = study
             print(id_study)
 
-            bbox_new = bbox.loc[(bbox['patient_id'].astype(int)==id_trial) & (bbox['study_id']==id_study)]
+            with instrumentation.stage('filter'):
+                bbox_new = bbox.loc[(bbox['patient_id'].astype(int)==id_trial) & (bbox['study_id']==id_study)]
 
             # patients with condition
             if bbox_new.shape[0]>0 and imgname in os.listdir(IMGDIR):
 
                 DISPSIZE = (bbox_new['img_width'].tolist()[0], bbox_new['img_height'].tolist()[0])
 
-                # Plot a duration heatmap
-                savename_h = 'heatmap_%s_%s_%s' % (id_trial, id_study, imgname)
-                savepath = os.path.join(OUTPUTDIR, savename_h)
-                fig = gazeplotter_ellipses.draw_heatmap(fixations, bbox_new, DISPSIZE, \
-                    imagefile=imgpath, savefilename=savepath)
-                close(fig)
-
-                # Plot a pupil heatmap
-                savename_h = 'pupil_heatmap_%s_%s_%s' % (id_trial, id_study, imgname)
-                savepath = os.path.join(OUTPUTDIR, savename_h)
-                fig = gazeplotter_ellipses.draw_heatmap(fixations, bbox_new, DISPSIZE, \
-                    imagefile=imgpath, savefilename=savepath, pupil=True)
-                close(fig)
+                # Plot the duration and pupil heatmaps that are out of date,
+                # from one pass over the fixations
+                stale = {}
+                for channel, prefix in (('dur', 'heatmap'), ('pupil', 'pupil_heatmap')):
+                    savename_h = '%s_%s_%s_%s' % (prefix, id_trial, id_study, imgname)
+                    savepath = os.path.join(OUTPUTDIR, savename_h)
+                    digest = render_hash(fixations, DISPSIZE, plot='gazeplotter_ellipses.draw_heatmap', pupil=channel=='pupil')
+                    if not manifest.is_current(savepath, digest):
+                        stale[channel] = (savepath, digest)
+                if stale:
+                    fig = gazeplotter_ellipses.draw_heatmaps(fixations, bbox_new, DISPSIZE, \
+                        dict((channel, savepath) for channel, (savepath, digest) in stale.items()), \
+                        imagefile=imgpath)
+                    close_figure(fig)
+                    for savepath, digest in stale.values():
+                        manifest.record(savepath, digest)
                 
                 # # Plot the fixations
                 # savename_f = 'fixations_%s_%s_%s' % (id_trial, id_study, imgname)
@@ -117,14 +132,14 @@ for condition in conditions:
                 # fig = gazeplotter_ellipses.draw_fixations(fixations, bbox_new, DISPSIZE, \
                 #     durationsize=True, durationcolour=True, \
                 #     imagefile=imgpath, savefilename=savepath)
-                # close(fig)
+                # close_figure(fig)
 
                 # #Plot raw gaze data
                 # savename = 'gaze_%s_%s_%s' % (id_trial, id_study, imgname)
                 # savepath = os.path.join(OUTPUTDIR, savename)
                 # fig = gazeplotter_ellipses.draw_raw(x, y, bbox_new, DISPSIZE, 
                 #                 imagefile=imgpath, savefilename=savepath)
-                # close(fig)
+                # close_figure(fig)
 
                 
                 if count==11:
@@ -143,19 +158,22 @@ for condition in conditions:
 
                 DISPSIZE = (img_width, img_height)
 
-                # Plot a duration heatmap
-                savename_h = 'heatmap_%s_%s_%s' % (id_trial, id_study, imgname)
-                savepath = os.path.join(OUTPUTDIR, savename_h)
-                fig = gazeplotter_normal.draw_heatmap(fixations, DISPSIZE, \
-                    imagefile=imgpath, savefilename=savepath)
-                close(fig)
-
-                # Plot a pupil heatmap
-                savename_h = 'pupil_heatmap_%s_%s_%s' % (id_trial, id_study, imgname)
-                savepath = os.path.join(OUTPUTDIR, savename_h)
-                fig = gazeplotter_normal.draw_heatmap(fixations, DISPSIZE, \
-                    imagefile=imgpath, savefilename=savepath, pupil=True)
-                close(fig)
+                # Plot the duration and pupil heatmaps that are out of date,
+                # from one pass over the fixations
+                stale = {}
+                for channel, prefix in (('dur', 'heatmap'), ('pupil', 'pupil_heatmap')):
+                    savename_h = '%s_%s_%s_%s' % (prefix, id_trial, id_study, imgname)
+                    savepath = os.path.join(OUTPUTDIR, savename_h)
+                    digest = render_hash(fixations, DISPSIZE, plot='gazeplotter_normal.draw_heatmap', pupil=channel=='pupil')
+                    if not manifest.is_current(savepath, digest):
+                        stale[channel] = (savepath, digest)
+                if stale:
+                    fig = gazeplotter_normal.draw_heatmaps(fixations, DISPSIZE, \
+                        dict((channel, savepath) for channel, (savepath, digest) in stale.items()), \
+                        imagefile=imgpath)
+                    close_figure(fig)
+                    for savepath, digest in stale.values():
+                        manifest.record(savepath, digest)
                 
                 # # Plot the fixations
                 # savename_f = 'fixations_%s_%s_%s' % (id_trial, id_study, imgname)
@@ -163,14 +181,14 @@ for condition in conditions:
                 # fig = gazeplotter_normal.draw_fixations(fixations, DISPSIZE, \
                 #     durationsize=True, durationcolour=True, \
                 #     imagefile=imgpath, savefilename=savepath)
-                # close(fig)
+                # close_figure(fig)
 
                 # #Plot raw gaze data
                 # savename = 'gaze_%s_%s_%s' % (id_trial, id_study, imgname)
                 # savepath = os.path.join(OUTPUTDIR, savename)
                 # fig = gazeplotter_normal.draw_raw(x, y, DISPSIZE, 
                 #                 imagefile=imgpath, savefilename=savepath)
-                close(fig)
+                # close_figure(fig)
 
 
 
@@ -1,91 +1,172 @@
 import os
-import pickle
+import argparse
+import gazeplotter_core
 import gazeplotter_ellipses
+import instrumentation
 import pandas as pd
+from fixation_store import load_condition
 
-from matplotlib.pyplot import close
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from reflacx_paths import PathResolver
+from export_manifest import ExportManifest, MANIFEST_NAME, render_hash
+from heatmap_tensors import HeatmapShardWriter, normalize_heatmap
 
-XAMI_MIMIC_PATH = "D:\XAMI-MIMIC"
+XAMI_MIMIC_PATH = r"D:\XAMI-MIMIC"
 
-# Top 3 conditions
-conditions = ['pab', 'ate', 'cns']
-# conditions = ['ate']
+# All conditions
+CONDITIONS = ['abnmc', 'afr', 'awt', 'ate', 'cns', 'epy', 'ecs', 'ehi', 'fbr', 'frc',
+'gop', 'hhe', 'hlv', 'ild', 'lnm', 'mss', 'nod', 'pab', 'pef', 'pti', 'pne', 'ped', 'wmd']
 
-# Test with 2 patients
-# conditions = ['15752803', '19565653']
 
-# conditions = ['13977589']
+def init_worker():
+    # Workers only write files, so render off-screen
+    gazeplotter_core.use_batch_backend()
 
-# All conditions
-# conditions = ['abnmc', 'afr', 'awt', 'ate', 'cns', 'epy', 'ecs', 'ehi', 'fbr', 'frc', 
-# 'gop', 'hhe', 'hlv', 'ild', 'lnm', 'mss', 'nod', 'pab', 'pef', 'pti', 'pne', 'ped', 'wmd']
 
-# Master with paths
-reflacx_with_fixations_df = pd.read_csv('reflacx_with_fixations.csv')
+def render_trial(task):
+    fixations, DISPSIZE, imgpath, savepath = task
 
-df = pd.DataFrame()
+    # Make the output folder if it does not exist yet
+    os.makedirs(os.path.dirname(savepath), exist_ok=True)
 
-for condition in conditions:
-    print(condition)
+    # Plot a duration heatmap
+    with instrumentation.stage('trial', path=savepath):
+        fig = gazeplotter_ellipses.draw_heatmap(fixations, None, DISPSIZE, \
+            imagefile=imgpath, savefilename=savepath)
+        gazeplotter_core.close_figure(fig)
 
-    # Read fixations data
-    file_name = 'fixations/fixations_'+condition+'.pkl'
-    with open(file_name, 'rb') as f:
-        data = pickle.load(f)
+    # # Plot a pupil heatmap
+    # fig = gazeplotter_ellipses.draw_heatmap(fixations, None, DISPSIZE, \
+    #     imagefile=imgpath, savefilename=savepath, pupil=True)
+    # gazeplotter_core.close_figure(fig)
 
-    # Get the amount of trials in this dataset
-    ntrials = len(data)
+    # Timings of this trial go back to the parent with the result
+    return savepath, instrumentation.collect()
 
-    count=0
 
-    # Loop through all trials
-    for trialnr in range(ntrials):
+def tensor_trial(task):
+    fixations, DISPSIZE = task
 
-        print('Patient '+str(data[trialnr]['id'])+', study '+str(data[trialnr]['study_id']))
+    # Normalised duration heatmap, sent back to be added to a shard
+    with instrumentation.stage('trial'):
+        heatmap = gazeplotter_core.render_heatmap_array(fixations, DISPSIZE, mask=False)
 
-        paths = reflacx_with_fixations_df.loc[(reflacx_with_fixations_df['id']==data[trialnr]['study_id']) &
-                                      (reflacx_with_fixations_df['subject_id']==data[trialnr]['id']) &
-                                      (reflacx_with_fixations_df['dicom_id']==data[trialnr]['image_name'])]
+    return normalize_heatmap(heatmap, 'float16'), instrumentation.collect()
 
-        # Get the path to the image
-        imgpath = paths['image_path']
 
-        # Get output path
-        savepath = "D:\XAMI-MIMIC" + paths['fixations_path'].values[0][17:]
+def run_condition(condition, resolver, executor, manifest, limit=None, force=False, tensors=None):
+    print(condition)
 
-        # Get the fixations in this trial
-        fixations = data[trialnr]['events']['Efix']
+    # Read fixations data (from the fixation store, if the condition was
+    # converted to one)
+    with instrumentation.stage('load', condition=condition):
+        data = load_condition(condition)
 
-        # Delete the first fixation
-        fixations.pop(0)
+    # Get the amount of trials in this dataset
+    ntrials = len(data)
+    if limit is not None:
+        ntrials = min(ntrials, limit)
 
-        id_trial = int(data[trialnr]['id'])
+    # Rows of the master of every printed trial
+    printed = []
+    futures = {}
 
-        # print(id_trial)
+    # One shard writer per split, when exporting tensors instead of images
+    writers = {}
 
-        DISPSIZE = (int(paths['image_size_x']), int(paths['image_size_y']))
+    # Loop through all trials
+    for trialnr in range(ntrials):
 
-        # Plot a duration heatmap
-        savename_h = 'time_heatmap'
-        fig = gazeplotter_ellipses.draw_heatmap(fixations, None, DISPSIZE, \
-            imagefile=imgpath, savefilename=savepath)
-        close(fig)
+        print('Patient '+str(data[trialnr]['id'])+', study '+str(data[trialnr]['study_id']))
 
-        # # Plot a pupil heatmap
-        # savename_h = 'pupil_heatmap'
-        # savepath = os.path.join(OUTPUTDIR, savename_h)
-        # fig = gazeplotter_ellipses.draw_heatmap(fixations, None, DISPSIZE, \
-        #     imagefile=imgpath, savefilename=savepath, pupil=True)
-        # close(fig)
+        with instrumentation.stage('lookup'):
+            paths = resolver.lookup(data[trialnr]['study_id'], data[trialnr]['id'], data[trialnr]['image_name'])
 
+        if paths is None:
+            print('no paths')
+            continue
 
-        df = df.append(paths)
+        # Get the path to the image
+        imgpath = resolver.resolve(paths['image_path'])
 
-        count+=1
-        if count==11:
-            break
+        # Get output path
+        savepath = resolver.resolve(paths['fixations_path'])
 
-    df.to_csv('printed_paths.csv') 
-    
+        # Get the fixations in this trial, without the first fixation
+        fixations = data[trialnr]['events']['Efix'][1:]
 
+        DISPSIZE = (int(paths['image_size_x']), int(paths['image_size_y']))
 
+        printed.append(paths)
+
+        if tensors is not None:
+            futures[executor.submit(tensor_trial, (fixations, DISPSIZE))] = (paths['id'], paths['split'])
+            continue
+
+        # Skip heatmaps that were already rendered from the same input
+        with instrumentation.stage('hash'):
+            digest = render_hash(fixations, DISPSIZE, plot='draw_heatmap', pupil=False)
+        if not force and manifest.is_current(savepath, digest):
+            print('up to date: '+savepath)
+            continue
+
+        # Render on a worker
+        futures[executor.submit(render_trial, (fixations, DISPSIZE, imgpath, savepath))] = (savepath, digest)
+
+    # Record every heatmap as soon as it is written, so that an interrupted
+    # run resumes from there; the shards are finished and indexed even if a
+    # worker fails, so that the heatmaps written so far can be read
+    try:
+        for future in as_completed(futures):
+            result, events = future.result()
+            instrumentation.merge(events)
+            if tensors is not None:
+                id, split = futures[future]
+                if split not in writers:
+                    writers[split] = HeatmapShardWriter(os.path.join(tensors, condition), split)
+                with instrumentation.stage('write_tensor'):
+                    writers[split].add(id, result)
+                continue
+            print(result)
+            manifest.record(*futures[future])
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return printed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the heatmap of every REFLACX trial of the given conditions.')
+    parser.add_argument('conditions', nargs='*', default=CONDITIONS,
+                        help='conditions to export (default: all conditions)')
+    parser.add_argument('--output-root', default=XAMI_MIMIC_PATH,
+                        help='folder that replaces {XAMI_MIMIC_PATH} in the output paths (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of cores)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only export the first LIMIT trials of every condition')
+    parser.add_argument('--force', action='store_true',
+                        help='render every heatmap, also those that are up to date')
+    parser.add_argument('--tensors', default=None, metavar='FOLDER',
+                        help='write normalised heatmaps as .npy shards per condition and split to FOLDER, instead of images')
+    args = parser.parse_args(argv)
+
+    # Master with paths, indexed once
+    resolver = PathResolver(args.output_root, 'reflacx_with_fixations.csv')
+
+    printed = []
+
+    # Heatmaps rendered by earlier runs
+    manifest = ExportManifest(os.path.join(args.output_root, MANIFEST_NAME))
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        for condition in args.conditions:
+            printed.extend(run_condition(condition, resolver, executor, manifest, limit=args.limit, force=args.force,
+                                          tensors=args.tensors))
+
+    pd.DataFrame(printed).to_csv('printed_paths.csv')
+
+
+if __name__ == '__main__':
+    main()
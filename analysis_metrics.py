@@ -1,9 +1,22 @@
 import os
-import pickle
 import gazeplotter_ellipses
 import gazeplotter_normal
+import instrumentation
+import numpy
 import pandas as pd
+from fixation_store import load_condition
 from metrics import *
+from ellipse_index import EllipseIndex
+from gazeplotter_core import fixation_array
+
+# Columns written by metrics_batch, in order
+METRICS = ['diag_duration', 'percentage_gaze_inside_el',
+    'percentage_initial_inside_ellipse', 'percentage_middle_inside_ellipse',
+    'percentage_end_inside_ellipse', 'avg_pupil_inside_el', 'avg_pupil_initial_inside_el',
+    'avg_pupil_middle_inside_el', 'avg_pupil_end_inside_el']
+
+# Summed duration (ms) of the fixations inside every ellipse
+DWELL = 'fixation_dwell_inside_el'
 
 conditions = ['afr']
 
@@ -16,14 +29,26 @@ conditions = ['afr']
 for condition in conditions:
     print(condition)
 
-    # Read fixations data
-    file_name = 'fixations/fixations_'+condition+'.pkl'
-    with open(file_name, 'rb') as f:
-        data = pickle.load(f)
+    # Read fixations data (from the fixation store, if the condition was
+    # converted to one)
+    with instrumentation.stage('load', condition=condition):
+        data = load_condition(condition)
 
     # Read bbox data
     bbox_filename = 'bboxes/bboxes_'+condition+'.csv'
-    bbox = pd.read_csv(bbox_filename)
+    with instrumentation.stage('read_bboxes'):
+        bbox = pd.read_csv(bbox_filename)
+
+    # Positions of the bbox rows of every (patient, study), built once
+    with instrumentation.stage('index'):
+        trials = bbox.groupby([bbox['patient_id'].astype(int), 'study_id']).indices
+        ellipses = bbox[['h', 'k', 'a', 'b']].to_numpy(dtype=float)
+        # Ellipses of every trial, to find the ones each fixation falls in
+        index = EllipseIndex.from_bboxes(bbox)
+
+    # Metrics of every bbox row, assigned to bbox in one go at the end
+    results = numpy.full((bbox.shape[0], len(METRICS)), numpy.nan)
+    dwell = numpy.full(bbox.shape[0], numpy.nan)
 
     # Get the amount of trials in this dataset
     ntrials = len(data)
@@ -46,44 +71,32 @@ for condition in conditions:
         id_trial = int(data[trialnr]['id'])
         id_study = data[trialnr]['study_id']
 
-        bbox_new = bbox.loc[(bbox['patient_id'].astype(int)==id_trial) & (bbox['study_id']==id_study)]   
+        rows = trials.get((id_trial, id_study))
 
         print(id_trial)
 
-        if bbox_new.shape[0]>0:
-
-            for index, row in bbox_new.iterrows():
-
-                diag_duration, \
-                percentage_gaze_inside_ellipse, \
-                percentage_initial_inside_ellipse, \
-                percentage_middle_inside_ellipse,\
-                percentage_end_inside_ellipse, \
-                avg_pupil_inside_el, \
-                avg_pupil_initial_inside_el, \
-                avg_pupil_middle_inside_el, \
-                avg_pupil_end_inside_el = metrics(x, y, pupil, row, id_trial)
-
-                index = bbox[(bbox['patient_id']==id_trial) & (bbox['h']==row['h'])].index[0]
-
-                # print(index)
-                bbox.at[index, 'diag_duration'] = diag_duration
-                bbox.at[index, 'percentage_gaze_inside_el'] = percentage_gaze_inside_ellipse
-                bbox.at[index, 'percentage_initial_inside_ellipse'] = percentage_initial_inside_ellipse          
-                bbox.at[index, 'percentage_middle_inside_ellipse'] = percentage_middle_inside_ellipse     
-                bbox.at[index, 'percentage_end_inside_ellipse'] = percentage_end_inside_ellipse  
-                bbox.at[index, 'avg_pupil_inside_el'] = avg_pupil_inside_el
-                bbox.at[index, 'avg_pupil_initial_inside_el'] = avg_pupil_initial_inside_el
-                bbox.at[index, 'avg_pupil_middle_inside_el'] = avg_pupil_middle_inside_el
-                bbox.at[index, 'avg_pupil_end_inside_el'] = avg_pupil_end_inside_el
+        if rows is not None:
+
+            with instrumentation.stage('metrics', trial=id_trial):
+                results[rows] = metrics_batch(x, y, pupil, ellipses[rows])
+
+            # Fixations without the first one, as in the heatmaps
+            with instrumentation.stage('dwell', trial=id_trial):
+                fix = fixation_array(data[trialnr]['events']['Efix'][1:])
+                dwell[rows] = index.dwell(fix['x'], fix['y'], fix['dur'], group=(id_trial, id_study))[rows]
+
+            for no_gaze in numpy.isneginf(results[rows, 1:5]).any(axis=1):
+                if no_gaze:
+                    print(f'TRIAL WITH NO GAZE INSIDE ELLIPSE {id_trial}')
 
         else:
             print('no bboxes')
+
+    bbox[METRICS] = results
+    bbox[DWELL] = dwell
                 
-                
-    bbox[['patient_id','study_id','image_id','certainty','diag_duration', 'percentage_gaze_inside_el',\
-        'percentage_initial_inside_ellipse', 'percentage_middle_inside_ellipse',\
-        'percentage_end_inside_ellipse',   'avg_pupil_inside_el', 'avg_pupil_initial_inside_el', \
-		   'avg_pupil_middle_inside_el', 'avg_pupil_end_inside_el']].to_csv('output/metrics_%s.csv' % condition)
+    with instrumentation.stage('write_csv'):
+        bbox[['patient_id','study_id','image_id','certainty'] + METRICS + [DWELL]].to_csv('output/metrics_%s.csv' % condition)
+    instrumentation.bytes_written('output/metrics_%s.csv' % condition)
 
 
@@ -0,0 +1,95 @@
+import os
+import argparse
+import instrumentation
+import pandas as pd
+from fixation_store import load_condition
+
+from gazeplotter_core import parse_fixations
+from reflacx_paths import PathResolver
+from heatmap_tensors import HeatmapTensors
+from saliency_metrics import CHUNK_BYTES, evaluate
+
+XAMI_MIMIC_PATH = r"D:\XAMI-MIMIC"
+
+# All conditions
+CONDITIONS = ['abnmc', 'afr', 'awt', 'ate', 'cns', 'epy', 'ecs', 'ehi', 'fbr', 'frc',
+'gop', 'hhe', 'hlv', 'ild', 'lnm', 'mss', 'nod', 'pab', 'pef', 'pti', 'pne', 'ped', 'wmd']
+
+
+def read_fixations(condition, resolver):
+    # Fixations of every REFLACX id of the condition, without the first
+    # fixation, as in the heatmaps
+    data = load_condition(condition)
+    fixations = {}
+    for trialnr in range(len(data)):
+        paths = resolver.lookup(data[trialnr]['study_id'], data[trialnr]['id'], data[trialnr]['image_name'])
+        if paths is not None:
+            fixations[paths['id']] = parse_fixations(data[trialnr]['events']['Efix'][1:])
+
+    return fixations
+
+
+def run_condition(condition, predicted, reference, split, resolver=None, chunkbytes=CHUNK_BYTES):
+    print(condition)
+
+    # Heatmaps of both folders, memory-mapped; only the ids in both are scored
+    with instrumentation.stage('load', condition=condition):
+        pred = HeatmapTensors(os.path.join(predicted, condition), split)
+        ref = HeatmapTensors(os.path.join(reference, condition), split)
+    found = set(pred.ids)
+    ids = [id for id in ref.ids if id in found]
+    if len(ids) < len(ref):
+        print('%d of %d reference heatmaps have no prediction' % (len(ref) - len(ids), len(ref)))
+
+    fixations = None
+    if resolver is not None:
+        with instrumentation.stage('read_fixations', condition=condition):
+            byid = read_fixations(condition, resolver)
+        fixations = [byid.get(id) for id in ids]
+
+    # Read chunk by chunk, so that a split may be larger than memory
+    result = evaluate([pred[id] for id in ids], [ref[id] for id in ids], fixations=fixations, chunkbytes=chunkbytes)
+
+    scores = pd.DataFrame(result)
+    scores.insert(0, 'id', ids)
+    scores.insert(0, 'condition', condition)
+
+    return scores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score predicted heatmaps against the gaze heatmaps of the same reads, with NSS, AUC-Judd, CC, KLD and SIM.')
+    parser.add_argument('predicted',
+                        help='folder with a folder of predicted heatmap shards per condition')
+    parser.add_argument('reference',
+                        help='folder with a folder of reference heatmap shards per condition, as written by analysis_images_to_folders.py --tensors')
+    parser.add_argument('conditions', nargs='*', default=CONDITIONS,
+                        help='conditions to score (default: all conditions)')
+    parser.add_argument('--split', default='test',
+                        help='split to score (default: %(default)s)')
+    parser.add_argument('--fixations', action='store_true',
+                        help='also score NSS and AUC-Judd against the fixations of every read')
+    parser.add_argument('--output-root', default=XAMI_MIMIC_PATH,
+                        help='folder that replaces {XAMI_MIMIC_PATH} in the paths (default: %(default)s)')
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES // 2**20,
+                        help='megabytes of heatmaps scored at a time (default: %(default)s)')
+    parser.add_argument('--output', default=None,
+                        help='csv to write the scores to (default: saliency_<split>.csv)')
+    args = parser.parse_args(argv)
+
+    # Master with paths, indexed once, to find the reads of the fixations
+    resolver = PathResolver(args.output_root, 'reflacx_with_fixations.csv') if args.fixations else None
+
+    scores = []
+    for condition in args.conditions:
+        scores.append(run_condition(condition, args.predicted, args.reference, args.split, resolver=resolver,
+                                    chunkbytes=args.chunk_mb * 2**20))
+    scores = pd.concat(scores, ignore_index=True)
+
+    output = args.output if args.output is not None else 'saliency_%s.csv' % args.split
+    scores.to_csv(output)
+    print(scores.drop(columns=['condition', 'id']).groupby(scores['condition']).mean())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# Benchmark of the heatmap and metrics code on synthetic data shaped like
+# REFLACX reads: display sizes are drawn from reflacx_with_fixations.csv,
+# and every trial gets Efix events and a 1 kHz gaze trace. Every benchmark
+# runs in a fresh process, so that its peak RSS is its own.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak RSS is then not reported
+    resource = None
+
+BENCHMARKS = ['gaussian', 'parse_fixations', 'draw_display', 'draw_heatmap_ellipses',
+              'draw_heatmap_normal', 'draw_heatmaps_normal', 'render_heatmap_array',
+              'render_gaze_heatmap', 'metrics', 'saliency_metrics', 'saliency_batch']
+
+
+def synthetic_trial(rng, dispsize, nfixations, seconds):
+    # Fixations spread over the display, with durations like those of reading
+    # an X-ray, and a gaze trace that dwells around every fixation
+    w, h = dispsize
+    dur = numpy.clip(rng.gamma(2.0, 125.0, nfixations), 50, 2000)
+    dur = numpy.round(dur * (seconds * 1000 / dur.sum() * 0.9))
+    gap = numpy.round(rng.uniform(20, 80, nfixations))
+    stime = numpy.cumsum(numpy.concatenate(([0], dur[:-1] + gap[:-1])))
+    etime = stime + dur
+    x = rng.uniform(0.05 * w, 0.95 * w, nfixations)
+    y = rng.uniform(0.05 * h, 0.95 * h, nfixations)
+    pupil = rng.normal(1.0, 0.15, nfixations)
+    fixations = list(zip(stime, etime, dur, pupil, x, y))
+
+    # 1 kHz samples: the position of the current fixation plus noise
+    nsamples = int(seconds * 1000)
+    current = numpy.clip(numpy.searchsorted(stime, numpy.arange(nsamples), side='right') - 1, 0, nfixations - 1)
+    gx = x[current] + rng.normal(0, 15, nsamples)
+    gy = y[current] + rng.normal(0, 15, nsamples)
+    gpupil = pupil[current] + rng.normal(0, 0.02, nsamples)
+
+    # An anomaly ellipse around one of the fixations
+    i = rng.integers(nfixations)
+    bbox = {'h': x[i], 'k': y[i], 'a': rng.uniform(0.05, 0.2) * w, 'b': rng.uniform(0.05, 0.2) * h,
+            'certainty': int(rng.integers(1, 6))}
+
+    return {'dispsize': dispsize, 'fixations': fixations, 'x': gx, 'y': gy, 'pupil': gpupil, 'bbox': bbox}
+
+
+def make_trials(args):
+    rng = numpy.random.default_rng(args.seed)
+    sizes = pd.read_csv(args.csv, usecols=['image_size_x', 'image_size_y']).to_numpy()
+    picked = sizes[rng.integers(len(sizes), size=args.trials)]
+
+    return [synthetic_trial(rng, (int(w), int(h)), args.fixations, args.seconds) for w, h in picked]
+
+
+def run_benchmark(name, args, tmpdir):
+    import gazeplotter_core
+    gazeplotter_core.use_batch_backend()
+    import gazeplotter_ellipses
+    import gazeplotter_normal
+    import metrics
+
+    trials = make_trials(args)
+
+    # Images the normal plotter draws the heatmap over, one per display size
+    images = {}
+    for trial in trials:
+        if trial['dispsize'] not in images:
+            w, h = trial['dispsize']
+            path = os.path.join(tmpdir, 'image_%dx%d.png' % (w, h))
+            Image.fromarray(numpy.full((h, w), 128, dtype=numpy.uint8)).save(path)
+            images[trial['dispsize']] = path
+
+    savepath = os.path.join(tmpdir, name + '.jpg')
+
+    def each_trial(function):
+        for trial in trials:
+            function(trial)
+        return len(trials)
+
+    if name == 'gaussian':
+        def work():
+            for i in range(args.trials):
+                gazeplotter_core.gaussian(gazeplotter_core.GAUSSIAN_WIDTH, gazeplotter_core.GAUSSIAN_WIDTH/6)
+            return args.trials
+    elif name == 'parse_fixations':
+        work = lambda: each_trial(lambda t: gazeplotter_ellipses.parse_fixations(t['fixations']))
+    elif name == 'draw_display':
+        work = lambda: each_trial(lambda t: gazeplotter_core.close_figure(
+            gazeplotter_normal.draw_display(t['dispsize'], imagefile=images[t['dispsize']])[0]))
+    elif name == 'draw_heatmap_ellipses':
+        work = lambda: each_trial(lambda t: gazeplotter_core.close_figure(
+            gazeplotter_ellipses.draw_heatmap(t['fixations'], None, t['dispsize'], savefilename=savepath)))
+    elif name == 'draw_heatmap_normal':
+        work = lambda: each_trial(lambda t: gazeplotter_core.close_figure(
+            gazeplotter_normal.draw_heatmap(t['fixations'], t['dispsize'], imagefile=images[t['dispsize']],
+                                            savefilename=savepath)))
+    elif name == 'draw_heatmaps_normal':
+        # the duration and pupil heatmaps of every trial, from one pass
+        savepaths = {'dur': savepath, 'pupil': os.path.join(tmpdir, name + '_pupil.jpg')}
+        work = lambda: each_trial(lambda t: gazeplotter_core.close_figure(
+            gazeplotter_normal.draw_heatmaps(t['fixations'], t['dispsize'], savepaths,
+                                             imagefile=images[t['dispsize']])))
+    elif name == 'render_heatmap_array':
+        work = lambda: each_trial(lambda t: gazeplotter_core.save_heatmap(
+            gazeplotter_core.render_heatmap_array(t['fixations'], t['dispsize']), savepath))
+    elif name == 'render_gaze_heatmap':
+        work = lambda: each_trial(lambda t: gazeplotter_core.save_heatmap(
+            gazeplotter_core.render_gaze_heatmap(gazeplotter_core.sample_chunks(t['x'], t['y']), t['dispsize']),
+            savepath))
+    elif name == 'metrics':
+        work = lambda: each_trial(lambda t: metrics.metrics(t['x'], t['y'], t['pupil'], t['bbox'], 0))
+    elif name == 'saliency_metrics':
+        # Heatmaps are rendered before the clock starts; only the comparison
+        # with the ellipse of every trial is timed
+        import saliency_metrics
+        heatmaps = [gazeplotter_core.render_heatmap_array(t['fixations'], t['dispsize']) for t in trials]
+
+        def work():
+            for i, (t, heatmap) in enumerate(zip(trials, heatmaps)):
+                b = t['bbox']
+                saliency_metrics.trial_metrics(heatmap, i, [[b['h'], b['k'], b['a'], b['b']]], t['dispsize'])
+            return len(trials)
+    elif name == 'saliency_batch':
+        # NSS, AUC-Judd, CC, KLD and SIM of the fixation heatmaps against the
+        # gaze heatmaps of the same trials, rendered before the clock starts
+        import saliency_metrics
+        predicted = [gazeplotter_core.render_heatmap_array(t['fixations'], t['dispsize']) for t in trials]
+        reference = [gazeplotter_core.render_gaze_heatmap(gazeplotter_core.sample_chunks(t['x'], t['y']), t['dispsize'])
+                     for t in trials]
+        fixations = [gazeplotter_core.parse_fixations(t['fixations']) for t in trials]
+        work = lambda: len(saliency_metrics.evaluate(predicted, reference, fixations)['nss'])
+    else:
+        raise Exception("ERROR in run_benchmark: unknown benchmark '%s'" % name)
+
+    start = time.perf_counter()
+    items = work()
+    wall = time.perf_counter() - start
+
+    result = {'benchmark': name, 'items': items, 'wall_s': round(wall, 4),
+              'per_item_ms': round(1000 * wall / items, 3), 'items_per_s': round(items / wall, 2)}
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_mb'] = round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark heatmap rendering and ellipse metrics on synthetic REFLACX-shaped data.')
+    parser.add_argument('benchmarks', nargs='*', default=BENCHMARKS,
+                        help='benchmarks to run (default: all of %s)' % ', '.join(BENCHMARKS))
+    parser.add_argument('--trials', type=int, default=20,
+                        help='number of synthetic trials (default: %(default)s)')
+    parser.add_argument('--fixations', type=int, default=150,
+                        help='fixations per trial (default: %(default)s)')
+    parser.add_argument('--seconds', type=float, default=40.0,
+                        help='length of the 1 kHz gaze trace of a trial (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic data (default: %(default)s)')
+    parser.add_argument('--csv', default='reflacx_with_fixations.csv',
+                        help='csv to take display sizes from (default: %(default)s)')
+    parser.add_argument('--output', default=None,
+                        help='file to write the JSON report to (default: print it)')
+    args = parser.parse_args(argv)
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark '%s'" % name)
+
+    report = {'python': platform.python_version(), 'numpy': numpy.__version__, 'platform': platform.platform(),
+              'config': vars(args), 'results': []}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in args.benchmarks:
+            # A fresh process per benchmark, for its own peak RSS
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_benchmark, name, args, tmpdir).result()
+            print('%-24s %8.3f ms/item' % (name, result['per_item_ms']), file=sys.stderr)
+            report['results'].append(result)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
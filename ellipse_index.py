@@ -0,0 +1,223 @@
+# Ellipse index
+#
+# Spatial index of anomaly ellipses, e.g. all rows of a
+# bboxes_<condition>.csv, to find the ellipses that every fixation (or gaze
+# sample) of a trial falls in. The bounding box of every ellipse is spread
+# over a uniform grid of cells, which is kept as a sorted array of
+# (trial, cell) keys with the ellipses of every key stored after each other;
+# a batch of points then only looks up the cell of every point and tests the
+# few ellipses of that cell with metrics.checkpoint. Ellipses that would
+# cover more than MAX_CELLS cells (e.g. one that spans the whole image,
+# among many small ones) are kept apart and tested against every point of
+# their trial, so that a single one cannot blow up the grid.
+
+import numpy
+
+from metrics import checkpoint
+
+# most cells that the bounding box of one ellipse is spread over
+MAX_CELLS = 256
+
+
+class EllipseIndex:
+
+	"""Answers point-in-ellipse queries for whole arrays of points
+
+	arguments
+
+	ellipses		-	(m, 4) array of axis-aligned ellipses, one
+					(h, k, a, b) per row, as in bboxes_<condition>.csv
+
+	keyword arguments
+
+	groups		-	sequence with a hashable key per ellipse, e.g. the
+					(patient_id, study_id) of its trial, so that the
+					points of a trial are only tested against the
+					ellipses of that trial; None puts all ellipses in
+					one group (default = None)
+	labels		-	label of every ellipse, returned by labels(); None
+					labels every ellipse with its row (default = None)
+	cellsize		-	width of the grid cells, in pixels; None uses the
+					median ellipse width (default = None)
+	maxcells		-	most cells one ellipse is spread over; larger
+					ellipses are tested against every point of their
+					group instead (default = MAX_CELLS)
+	"""
+
+	def __init__(self, ellipses, groups=None, labels=None, cellsize=None, maxcells=MAX_CELLS):
+
+		self.ellipses = numpy.asarray(ellipses, dtype=float).reshape(-1, 4)
+		m = self.ellipses.shape[0]
+		self.labels = numpy.arange(m) if labels is None else numpy.asarray(labels)
+		if self.labels.shape[0] != m:
+			raise Exception("ERROR in EllipseIndex: %d labels for %d ellipses" % (self.labels.shape[0], m))
+
+		# an integer code per group
+		if groups is None:
+			groups = [None] * m
+		self._codes = {}
+		code = numpy.array([self._codes.setdefault(group, len(self._codes)) for group in groups], dtype=numpy.int64)
+		if code.shape[0] != m:
+			raise Exception("ERROR in EllipseIndex: %d groups for %d ellipses" % (code.shape[0], m))
+
+		# ellipses with missing values are never hit
+		valid = numpy.flatnonzero(numpy.isfinite(self.ellipses).all(axis=1))
+		h, k, a, b = self.ellipses[valid].T
+		a = numpy.abs(a)
+		b = numpy.abs(b)
+		if cellsize is None:
+			cellsize = numpy.median(2 * a) if valid.shape[0] > 0 else 1.0
+		self.cellsize = max(float(cellsize), 1.0)
+
+		# cells covered by the bounding box of every ellipse (as floats
+		# first, so that the count of a huge ellipse cannot overflow)
+		c0 = numpy.floor((h - a) / self.cellsize)
+		c1 = numpy.floor((h + a) / self.cellsize)
+		r0 = numpy.floor((k - b) / self.cellsize)
+		r1 = numpy.floor((k + b) / self.cellsize)
+
+		# ellipses over too many cells are not put in the grid
+		large = (c1 - c0 + 1) * (r1 - r0 + 1) > max(int(maxcells), 1)
+		self._large = valid[large]
+		self._large_codes = code[self._large]
+		valid = valid[~large]
+		c0, c1, r0, r1 = [c[~large].astype(numpy.int64) for c in (c0, c1, r0, r1)]
+		if valid.shape[0] > 0:
+			self._origin = (c0.min(), r0.min())
+			self._size = (c1.max() - c0.min() + 1, r1.max() - r0.min() + 1)
+		else:
+			self._origin = (0, 0)
+			self._size = (1, 1)
+		ncols = c1 - c0 + 1
+		ncells = ncols * (r1 - r0 + 1)
+
+		# one entry per (ellipse, cell), sorted by key
+		owner = numpy.repeat(numpy.arange(valid.shape[0]), ncells)
+		within = numpy.arange(owner.shape[0]) - numpy.repeat(numpy.cumsum(ncells) - ncells, ncells)
+		col = c0[owner] + within % ncols[owner] - self._origin[0]
+		row = r0[owner] + within // ncols[owner] - self._origin[1]
+		key = self._key(code[valid][owner], row, col)
+		order = numpy.argsort(key, kind='stable')
+		self._keys, starts = numpy.unique(key[order], return_index=True)
+		self._starts = numpy.append(starts, order.shape[0])
+		self._members = valid[owner[order]]
+
+	def __len__(self):
+
+		return self.ellipses.shape[0]
+
+	def _key(self, code, row, col):
+
+		# position of a cell of a group in the grid of all groups
+		return (code * self._size[1] + row) * self._size[0] + col
+
+	def query(self, x, y, group=None):
+
+		"""Returns every hit of a batch of points, as two int arrays of the
+		same length: the position of the point and the row of the ellipse it
+		falls in, sorted by point; a point on the outline is inside, as in
+		metrics.metrics_batch, and a point in overlapping ellipses is a hit
+		of each
+
+		arguments
+
+		x			-	numpy array of x coordinates, e.g. of fixations
+		y			-	numpy array of y coordinates
+
+		keyword arguments
+
+		group		-	key of the group of the points, as passed to the
+						constructor (default = None)
+
+		returns
+
+		point, ellipse	-	numpy arrays of point positions and ellipse rows
+		"""
+
+		x = numpy.asarray(x, dtype=float).ravel()
+		y = numpy.asarray(y, dtype=float).ravel()
+		none = numpy.zeros(0, dtype=numpy.int64)
+		code = self._codes.get(group)
+		if code is None:
+			return none, none
+
+		# every candidate ellipse of every point from the grid, then the
+		# large ellipses of the group for every point, then the exact test
+		point, ellipse = self._candidates(x, y, code)
+		large = self._large[self._large_codes == code]
+		if large.shape[0] > 0:
+			point = numpy.concatenate([point, numpy.repeat(numpy.arange(x.shape[0]), large.shape[0])])
+			ellipse = numpy.concatenate([ellipse, numpy.tile(large, x.shape[0])])
+		h, k, a, b = self.ellipses[ellipse].T
+		inside = checkpoint(h, k, x[point], y[point], a, b) <= 1
+		point = point[inside]
+		ellipse = ellipse[inside]
+		if large.shape[0] > 0:
+			order = numpy.lexsort((ellipse, point))
+			point = point[order]
+			ellipse = ellipse[order]
+
+		return point, ellipse
+
+	def _candidates(self, x, y, code):
+
+		# the point and ellipse of every ellipse in the grid cell of every
+		# point, sorted by point
+		none = numpy.zeros(0, dtype=numpy.int64)
+		if self._keys.shape[0] == 0:
+			return none, none
+
+		# cell of every point, of which those inside the grid are looked up
+		# (comparisons with NaN are False, so those points drop out)
+		col = numpy.floor(x / self.cellsize) - self._origin[0]
+		row = numpy.floor(y / self.cellsize) - self._origin[1]
+		points = numpy.flatnonzero((0 <= col) & (col < self._size[0]) & (0 <= row) & (row < self._size[1]))
+		key = self._key(code, row[points].astype(numpy.int64), col[points].astype(numpy.int64))
+		pos = numpy.minimum(numpy.searchsorted(self._keys, key), self._keys.shape[0] - 1)
+		found = self._keys[pos] == key
+		points = points[found]
+		pos = pos[found]
+
+		counts = self._starts[pos+1] - self._starts[pos]
+		point = numpy.repeat(points, counts)
+		first = numpy.repeat(self._starts[pos] - (numpy.cumsum(counts) - counts), counts)
+
+		return point, self._members[first + numpy.arange(point.shape[0])]
+
+	def labels_of(self, x, y, group=None):
+
+		"""Returns a list per point with the labels of the ellipses it falls
+		in (an empty list for none); see query
+		"""
+
+		point, ellipse = self.query(x, y, group=group)
+		bounds = numpy.searchsorted(point, numpy.arange(numpy.size(x) + 1))
+		labels = self.labels[ellipse].tolist()
+
+		return [labels[bounds[i]:bounds[i+1]] for i in range(numpy.size(x))]
+
+	def dwell(self, x, y, weights, group=None):
+
+		"""Returns the summed weights of the points in every ellipse, e.g.
+		the dwell time when weights are fixation durations, as a numpy array
+		with a value per ellipse row (zero for those of other groups); see
+		query
+		"""
+
+		point, ellipse = self.query(x, y, group=group)
+		weights = numpy.asarray(weights, dtype=float).ravel()
+
+		return numpy.bincount(ellipse, weights=weights[point], minlength=len(self))
+
+	@classmethod
+	def from_bboxes(cls, bbox, cellsize=None, maxcells=MAX_CELLS):
+
+		"""Returns the index of a bboxes_<condition>.csv DataFrame, with the
+		ellipses grouped by (patient_id, study_id) (patient_id as int, as the
+		analysis scripts look trials up) and labelled by the DataFrame index
+		"""
+
+		groups = list(zip(bbox['patient_id'].astype(int), bbox['study_id']))
+
+		return cls(bbox[['h', 'k', 'a', 'b']].to_numpy(dtype=float), groups=groups, \
+			labels=bbox.index.to_numpy(), cellsize=cellsize, maxcells=maxcells)
@@ -0,0 +1,91 @@
+# Export manifest
+#
+# Keeps track of which heatmaps were already exported, and from what: for
+# every output path, a hash of the trial's fixations, the display size and
+# the render parameters. Reruns of the export drivers skip outputs whose
+# hash did not change, and an interrupted run resumes where it stopped,
+# since every finished output is recorded as soon as it is written.
+
+import os
+import json
+import hashlib
+import numpy
+from gazeplotter_core import fixation_array
+
+# name of the manifest file in an output folder
+MANIFEST_NAME = 'export_manifest.jsonl'
+# bump to invalidate all manifests when the rendering itself changes
+RENDER_VERSION = 1
+
+
+def render_hash(fixations, dispsize, **params):
+
+	"""Returns a hex digest of everything a heatmap is rendered from
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					or an array accepted by gazeplotter_core.fixation_array
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	params		-	render parameters, e.g. pupil=True; their values
+					must be JSON serialisable
+	"""
+
+	fix = fixation_array(fixations)
+	h = hashlib.sha1()
+	h.update(json.dumps({'version': RENDER_VERSION, 'dispsize': [int(d) for d in dispsize], \
+		'params': params}, sort_keys=True).encode('utf-8'))
+	for name in fix.dtype.names[:6]:
+		h.update(numpy.ascontiguousarray(fix[name], dtype='<f8').tobytes())
+
+	return h.hexdigest()
+
+
+class ExportManifest:
+
+	"""Append-only record of exported files and the hashes they were
+	rendered from, stored as one JSON object per line; when a path is
+	recorded more than once, the last record counts
+
+	arguments
+
+	manifestfile	-	path of the manifest file; it is created when the
+					first output is recorded
+	"""
+
+	def __init__(self, manifestfile):
+
+		self.manifestfile = manifestfile
+		self.entries = {}
+		if os.path.isfile(manifestfile):
+			with open(manifestfile, 'r') as f:
+				lines = f.read().split('\n')
+			for line in lines:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# empty, or cut off by an interrupted run
+					continue
+				self.entries[entry['path']] = entry['hash']
+			# start new records on a line of their own
+			if lines[-1] != '':
+				with open(manifestfile, 'a') as f:
+					f.write('\n')
+
+	def is_current(self, savepath, digest):
+
+		"""Returns True if savepath exists and was rendered from digest"""
+
+		return self.entries.get(savepath) == digest and os.path.isfile(savepath)
+
+	def record(self, savepath, digest):
+
+		"""Records that savepath was written from digest"""
+
+		self.entries[savepath] = digest
+		with open(self.manifestfile, 'a') as f:
+			f.write(json.dumps({'path': savepath, 'hash': digest}) + '\n')
@@ -0,0 +1,246 @@
+# Fixation store
+#
+# Columnar on-disk format for the fixations_<condition>.pkl files: one file
+# per condition, in which the raw gaze samples and the Efix events of all
+# trials are stored as contiguous float32 arrays, with per-trial offset
+# tables. The arrays are read through numpy.memmap, so a single trial can be
+# read without loading the whole condition, and processes that read the
+# same file share its pages.
+#
+# Layout: an 8 byte magic, the offset and length of a JSON header (two
+# little-endian uint64), then the arrays, each aligned to ALIGN bytes, and
+# finally the JSON header describing them.
+
+import os
+import sys
+import json
+import pickle
+import struct
+import numpy
+
+MAGIC = b'FIXSTORE'
+# extension of store files, next to the .pkl files they are converted from
+EXTENSION = '.fxs'
+# alignment of every array in the file, in bytes
+ALIGN = 64
+# fields of an Efix event that are stored as numbers; the 7th field (the
+# word, if any) is stored in the header
+EFIX_FIELDS = ['stime', 'etime', 'dur', 'pupil', 'x', 'y']
+
+
+# # # # #
+# WRITING
+
+def convert(picklefile, storefile=None):
+
+	"""Converts a fixations_<condition>.pkl file to a store file, and
+	returns the path of the store file
+
+	Per trial, all 1D numpy arrays with as many samples as 'x' (e.g. 'x',
+	'y' and 'pupil_area_normalized') and the Efix events are stored as
+	arrays, and all str, int, float and bool values as metadata; other
+	values (e.g. other event lists) are not stored.
+
+	arguments
+
+	picklefile	-	path to a fixations_<condition>.pkl file
+
+	keyword arguments
+
+	storefile		-	path of the store file, or None to replace the
+					extension of picklefile by EXTENSION (default = None)
+	"""
+
+	if storefile == None:
+		storefile = os.path.splitext(picklefile)[0] + EXTENSION
+
+	with open(picklefile, 'rb') as f:
+		data = pickle.load(f)
+
+	write_store(data, storefile)
+
+	return storefile
+
+
+def write_store(data, storefile):
+
+	"""Writes a list of trials, as loaded from a fixations_<condition>.pkl
+	file, to a store file
+
+	arguments
+
+	data			-	list of trial dicts
+	storefile		-	path of the store file
+	"""
+
+	# gaze columns: the 1D arrays that have a value for every sample
+	gazekeys = []
+	if len(data) > 0:
+		nsamples = len(data[0]['x'])
+		gazekeys = [key for key, value in data[0].items() \
+			if isinstance(value, numpy.ndarray) and value.ndim == 1 and len(value) == nsamples]
+
+	trials = []
+	words = []
+	gazeoffsets = numpy.zeros(len(data)+1, dtype=numpy.int64)
+	efixoffsets = numpy.zeros(len(data)+1, dtype=numpy.int64)
+	for trialnr, trial in enumerate(data):
+		trials.append({key: value for key, value in trial.items() \
+			if isinstance(value, (str, int, float, bool, numpy.integer, numpy.floating))})
+		efix = trial['events']['Efix']
+		words.append([fix[6] if len(fix) > 6 else None for fix in efix])
+		gazeoffsets[trialnr+1] = gazeoffsets[trialnr] + len(trial['x'])
+		efixoffsets[trialnr+1] = efixoffsets[trialnr] + len(efix)
+
+	header = {'gazekeys': gazekeys, 'trials': trials, 'words': words, 'arrays': {}}
+
+	with open(storefile, 'wb') as f:
+		f.write(MAGIC + struct.pack('<QQ', 0, 0))
+
+		def add(name, chunks, dtype, shape):
+			# pad to the next aligned offset, and write the chunks after it
+			f.write(b'\0' * (-f.tell() % ALIGN))
+			header['arrays'][name] = {'offset': f.tell(), 'dtype': numpy.dtype(dtype).str, 'shape': shape}
+			for chunk in chunks:
+				f.write(numpy.ascontiguousarray(chunk, dtype=dtype).tobytes())
+
+		add('gazeoffsets', [gazeoffsets], numpy.int64, [len(gazeoffsets)])
+		add('efixoffsets', [efixoffsets], numpy.int64, [len(efixoffsets)])
+		for key in gazekeys:
+			add(key, (trial[key] for trial in data), numpy.float32, [int(gazeoffsets[-1])])
+		add('efix', (numpy.array([fix[:6] for fix in trial['events']['Efix']], dtype=float).reshape(-1, 6) \
+			for trial in data), numpy.float32, [int(efixoffsets[-1]), len(EFIX_FIELDS)])
+
+		# header at the end, now that all offsets are known
+		blob = json.dumps(header, default=_jsonable).encode('utf-8')
+		offset = f.tell()
+		f.write(blob)
+		f.seek(len(MAGIC))
+		f.write(struct.pack('<QQ', offset, len(blob)))
+
+
+def _jsonable(value):
+
+	# numpy scalars in the trial metadata
+	if isinstance(value, numpy.generic):
+		return value.item()
+	raise TypeError("ERROR in write_store: cannot store %r" % (value,))
+
+
+# # # # #
+# READING
+
+class FixationStore:
+
+	"""Read-only view of a store file, that behaves like the list of trials
+	in a fixations_<condition>.pkl file: len(store) is the number of trials,
+	and store[trialnr] a trial dict in which the gaze columns are memory-
+	mapped and 'events' holds the 'Efix' list
+
+	arguments
+
+	storefile		-	path of the store file
+	"""
+
+	def __init__(self, storefile):
+
+		self.storefile = storefile
+		with open(storefile, 'rb') as f:
+			magic = f.read(len(MAGIC))
+			if magic != MAGIC:
+				raise Exception("ERROR in FixationStore: '%s' is not a fixation store" % storefile)
+			offset, length = struct.unpack('<QQ', f.read(16))
+			f.seek(offset)
+			self.header = json.loads(f.read(length).decode('utf-8'))
+		self.gazekeys = self.header['gazekeys']
+		self._arrays = {}
+
+	def array(self, name):
+
+		"""Returns a whole stored array (memory-mapped), e.g. 'x' or 'efix'"""
+
+		if name not in self._arrays:
+			info = self.header['arrays'][name]
+			if numpy.prod(info['shape']) == 0:
+				self._arrays[name] = numpy.zeros(info['shape'], dtype=info['dtype'])
+			else:
+				self._arrays[name] = numpy.memmap(self.storefile, dtype=info['dtype'], mode='r', \
+					offset=info['offset'], shape=tuple(info['shape']))
+
+		return self._arrays[name]
+
+	def __len__(self):
+
+		return len(self.header['trials'])
+
+	def __getitem__(self, trialnr):
+
+		if trialnr < 0:
+			trialnr += len(self)
+		trial = dict(self.header['trials'][trialnr])
+		for key in self.gazekeys:
+			trial[key] = self.gaze(trialnr, key)
+		trial['events'] = {'Efix': self.efix(trialnr)}
+
+		return trial
+
+	def gaze(self, trialnr, key='x'):
+
+		"""Returns one gaze column (e.g. 'x', 'y' or 'pupil_area_normalized')
+		of a trial, as a memory-mapped float32 array
+		"""
+
+		offsets = self.array('gazeoffsets')
+
+		return self.array(key)[offsets[trialnr]:offsets[trialnr+1]]
+
+	def fixations(self, trialnr):
+
+		"""Returns the Efix events of a trial as a memory-mapped (n, 6)
+		float32 array, with the columns in EFIX_FIELDS
+		"""
+
+		offsets = self.array('efixoffsets')
+
+		return self.array('efix')[offsets[trialnr]:offsets[trialnr+1]]
+
+	def efix(self, trialnr):
+
+		"""Returns the Efix events of a trial as a list of tuples, as in
+		the fixations_<condition>.pkl files
+		"""
+
+		fix = self.fixations(trialnr).tolist()
+		words = self.header['words'][trialnr]
+
+		return [tuple(f) + ((w,) if w is not None else ()) for f, w in zip(fix, words)]
+
+
+def load_condition(condition, folder='fixations'):
+
+	"""Returns the trials of a condition: a FixationStore if the condition
+	was converted to a store file, or else the list of trials in its
+	pickle file
+
+	arguments
+
+	condition		-	name of the condition, e.g. 'ate'
+
+	keyword arguments
+
+	folder		-	folder with the fixations_<condition> files
+					(default = 'fixations')
+	"""
+
+	name = os.path.join(folder, 'fixations_'+condition)
+	if os.path.isfile(name + EXTENSION):
+		return FixationStore(name + EXTENSION)
+
+	with open(name + '.pkl', 'rb') as f:
+		return pickle.load(f)
+
+
+if __name__ == '__main__':
+	# convert every pickle file that is passed
+	for picklefile in sys.argv[1:]:
+		print(convert(picklefile))
@@ -0,0 +1,1698 @@
+# Gaze Plotter core
+#
+# Rendering engine behind gazeplotter_ellipses and gazeplotter_normal: the
+# heatmap primitives, the fixation parsers and the plots of both plotters,
+# with the anomaly ellipses as an optional overlay. The two plotter modules
+# only keep their own display and function signatures.
+
+# matplotlib is only imported by the functions that need it, so that
+# processes that only compute heatmaps start fast; pyplot is only imported
+# when a Figure is made
+
+import os
+import functools
+import numpy
+import instrumentation
+from PIL import Image
+
+# maximum number of distinct Gaussian kernels kept alive per process
+KERNEL_CACHE_SIZE = 32
+# width of the Gaussian that is laid over every fixation, in pixels
+GAUSSIAN_WIDTH = 200
+# number of raw gaze samples that are binned at a time
+SAMPLE_CHUNK = 2**16
+# fields of a fixation ending event, in the order of the Efix tuples; the
+# word is only present in some recordings
+FIXATION_DTYPE = numpy.dtype([('stime', float), ('etime', float), ('dur', float),
+	('pupil', float), ('x', float), ('y', float), ('word', object)])
+# font of the plots; matplotlib's default font is used if it is not installed
+FONT = {	'family': 'Ubuntu',
+		'size': 12}
+# weights of the heatmaps of render_heatmap_channels: the duration and the
+# pupil size of every fixation, and 1 per fixation
+CHANNELS = ('dur', 'pupil', 'count')
+# non-interactive matplotlib backend for processes that only write files
+BATCH_BACKEND = 'Agg'
+# COLOURS
+# all colours are from the Tango colourmap, see:
+# http://tango.freedesktop.org/Tango_Icon_Theme_Guidelines#Color_Palette
+COLS = {	"butter": [	'#fce94f',
+					'#edd400',
+					'#c4a000'],
+		"orange": [	'#fcaf3e',
+					'#f57900',
+					'#ce5c00'],
+		"chocolate": [	'#e9b96e',
+					'#c17d11',
+					'#8f5902'],
+		"chameleon": [	'#8ae234',
+					'#73d216',
+					'#4e9a06'],
+		"skyblue": [	'#729fcf',
+					'#3465a4',
+					'#204a87'],
+		"plum": 	[	'#ad7fa8',
+					'#75507b',
+					'#5c3566'],
+		"scarletred":[	'#ef2929',
+					'#cc0000',
+					'#a40000'],
+		"aluminium": [	'#eeeeec',
+					'#d3d7cf',
+					'#babdb6',
+					'#888a85',
+					'#555753',
+					'#2e3436'],
+		}
+
+
+# # # # #
+# KERNELS
+
+def gaussian(x, sx, y=None, sy=None, dtype=float):
+
+	"""Returns an array of numpy arrays (a matrix) containing values between
+	1 and 0 in a 2D Gaussian distribution
+
+	arguments
+	x		-- width in pixels
+	sx		-- width standard deviation
+
+	keyword argments
+	y		-- height in pixels (default = x)
+	sy		-- height standard deviation (default = sx)
+	dtype	-- numpy dtype of the returned matrix (default = float)
+	"""
+
+	# square Gaussian if only x values are passed
+	if y == None:
+		y = x
+	if sy == None:
+		sy = sx
+	# centers
+	xo = x/2
+	yo = y/2
+	# squared distances to the centre, one row and one column
+	dx = (numpy.arange(x, dtype=float) - xo)**2 / (2*sx*sx)
+	dy = (numpy.arange(y, dtype=float) - yo)**2 / (2*sy*sy)
+	# gaussian matrix, broadcasted over rows and columns
+	M = numpy.exp(-1.0 * (dx[numpy.newaxis,:] + dy[:,numpy.newaxis]))
+
+	return M.astype(dtype, copy=False)
+
+
+@functools.lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _cached_gaussian(x, y, sx, sy, dtype):
+
+	with instrumentation.stage('kernel', size=x):
+		M = gaussian(x, sx, y=y, sy=sy, dtype=dtype)
+	# the same array is handed to every caller, so it must not be modified
+	M.flags.writeable = False
+
+	return M
+
+
+def cached_gaussian(x, sx, y=None, sy=None, dtype=float):
+
+	"""Returns the same matrix as gaussian, but builds it only once per
+	process; kernels are kept in a least-recently-used cache keyed on
+	(width, height, sx, sy, dtype) that holds at most KERNEL_CACHE_SIZE
+	entries. The returned matrix is read-only.
+
+	arguments
+	x		-- width in pixels
+	sx		-- width standard deviation
+
+	keyword argments
+	y		-- height in pixels (default = x)
+	sy		-- height standard deviation (default = sx)
+	dtype	-- numpy dtype of the returned matrix (default = float)
+	"""
+
+	if y == None:
+		y = x
+	if sy == None:
+		sy = sx
+
+	return _cached_gaussian(int(x), int(y), float(sx), float(sy), numpy.dtype(dtype))
+
+
+# # # # #
+# FIXATIONS
+
+def fixation_array(fixations):
+
+	"""Returns the fixation ending events of a trial as a numpy structured
+	array with FIXATION_DTYPE, i.e. with the fields 'stime', 'etime', 'dur',
+	'pupil', 'x', 'y' and 'word' (None if the events have no word)
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']; an (n, 6) array
+					as returned by FixationStore.fixations, or an array
+					returned by this function (which is returned as is)
+	"""
+
+	if isinstance(fixations, numpy.ndarray) and fixations.dtype == FIXATION_DTYPE:
+		return fixations
+
+	fix = numpy.zeros(len(fixations), dtype=FIXATION_DTYPE)
+	if len(fixations) == 0:
+		return fix
+
+	# one conversion of all events to a 2D array, instead of unpacking
+	# them one by one
+	rows = numpy.asarray(fixations) if isinstance(fixations, numpy.ndarray) \
+		else numpy.array(fixations, dtype=object)
+	if rows.ndim != 2:
+		# events with and without word
+		rows = numpy.array([tuple(f[:6]) + (f[6] if len(f) > 6 else None,) \
+			for f in fixations], dtype=object)
+	for i, name in enumerate(FIXATION_DTYPE.names[:6]):
+		fix[name] = rows[:,i]
+	if rows.shape[1] > 6:
+		fix['word'] = rows[:,6]
+
+	return fix
+
+
+def fixation_phases(fix, phases):
+
+	"""Returns the phase of every fixation, from 0 to phases-1: the read,
+	from the start of its first fixation to the end of its last, is split
+	into phases equally long parts, and every fixation belongs to the part
+	in which it starts
+
+	arguments
+
+	fix			-	structured numpy array of FIXATION_DTYPE, see
+					fixation_array
+	phases		-	number of parts, e.g. 3 for the initial, middle and
+					end third of a read
+
+	returns
+
+	phase		-	numpy array of ints, one per fixation
+	"""
+
+	if len(fix) == 0:
+		return numpy.zeros(0, dtype=int)
+	edges = numpy.linspace(numpy.min(fix['stime']), numpy.max(fix['etime']), int(phases)+1)
+
+	return numpy.searchsorted(edges[1:-1], fix['stime'], side='right')
+
+
+def parse_fixations(fixations):
+	
+	"""Returns all relevant data from a list of fixation ending events
+	
+	arguments
+	
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+
+	returns
+	
+	fix		-	a dict with four keys: 'x', 'y', 'dur' (each contain a
+				numpy array) and 'word' (a list) for the x and y
+				coordinates, duration and word of each fixation
+	"""
+
+	fix = fixation_array(fixations)
+
+	return {	'x':fix['x'],
+			'y':fix['y'],
+			'dur':fix['dur'],
+			'word':fix['word'].tolist()}
+
+
+def parse_pupil(fixations):
+	
+	"""Returns all relevant data from a list of fixation ending events
+	
+	arguments
+	
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+
+	returns
+	
+	fix		-	a dict with three keys: 'x', 'y', and 'pupil' (each
+				contain a numpy array) for the x and y coordinates and
+				pupil size of each fixation
+	"""
+
+	fix = fixation_array(fixations)
+
+	return {	'x':fix['x'],
+			'y':fix['y'],
+			'pupil':fix['pupil']}
+
+
+def parse_fixations_words(fixations):
+
+	"""Returns the coordinates and words of the fixations with a pupil size
+	above the 75th percentile of the trial, and 0 for the other fixations
+	"""
+
+	fix = fixation_array(fixations)
+
+	# filter fixatons with higher pupil (none in a trial without fixations,
+	# which has no quantile)
+	high = numpy.zeros(len(fix), dtype=bool)
+	if len(fix) > 0:
+		high = fix['pupil'] > numpy.quantile(fix['pupil'], 0.75)
+
+	return {	'x':numpy.where(high, fix['x'], 0),
+			'y':numpy.where(high, fix['y'], 0),
+			'pupil':fix['pupil'],
+			'word':numpy.where(high, fix['word'], 0)}
+
+
+# # # # #
+# HEATMAPS
+
+def accumulate_heatmap(x, y, weights, dispsize, gwh=GAUSSIAN_WIDTH, gsdwh=None, method='loop', scale=1):
+
+	"""Returns a heatmap with a size of dispsize, in which a Gaussian is
+	added for every fixation, scaled by that fixation's weight
+
+	arguments
+
+	x			-	numpy array of fixation x coordinates
+	y			-	numpy array of fixation y coordinates
+	weights		-	numpy array of fixation weights, e.g. durations or
+					pupil sizes; or a (C, n) array with C sets of weights,
+					to get C heatmaps from a single pass
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	gwh			-	width and height of the Gaussian in pixels
+					(default = GAUSSIAN_WIDTH)
+	gsdwh		-	standard deviation of the Gaussian, or None for a
+					sixth of its width (default = None)
+	method		-	'loop' to add a Gaussian for every fixation in turn,
+					or 'convolve' to bin all fixations first and smooth
+					the binned weights once, which scales with the
+					display size instead of the number of fixations;
+					both give the same heatmap (default = 'loop')
+	scale		-	integer factor by which the heatmap is accumulated at
+					a lower resolution (e.g. 4 or 8), with the Gaussian
+					shrunk by the same factor, and then bilinearly
+					upsampled to the size of the display (as float32);
+					1 accumulates at full resolution (default = 1)
+
+	returns
+
+	heatmap		-	numpy array of shape (dispsize[1], dispsize[0]), or
+					(C, dispsize[1], dispsize[0]) for (C, n) weights
+	"""
+
+	if gsdwh == None:
+		gsdwh = gwh/6
+	x = numpy.asarray(x, dtype=float)
+	y = numpy.asarray(y, dtype=float)
+	if scale != 1:
+		gridsize, gwh, gsdwh = _scaled_grid(dispsize, gwh, gsdwh, scale)
+		heatmap = accumulate_heatmap(x / scale, y / scale, weights, gridsize, \
+			gwh=gwh, gsdwh=gsdwh, method=method)
+		shape = (int(dispsize[1]), int(dispsize[0]))
+		if heatmap.ndim == 3:
+			return numpy.stack([upsample_bilinear(h, scale, shape) for h in heatmap])
+		return upsample_bilinear(heatmap, scale, shape)
+	if method == 'convolve':
+		return _convolve_heatmap(x, y, weights, dispsize, gwh, gsdwh)
+	elif method != 'loop':
+		raise Exception("ERROR in accumulate_heatmap: unknown method '%s'" % method)
+
+	return _loop_heatmap(x, y, weights, dispsize, gwh, gsdwh)
+
+
+def _scaled_grid(dispsize, gwh, gsdwh, scale):
+
+	# size of the grid of scale x scale pixel cells that a heatmap is
+	# accumulated on at a lower resolution, whose centres are at
+	# (cell + 0.5) * scale in display pixels, and the width and standard
+	# deviation of the Gaussian on that grid. The width is kept even (and
+	# rounded up, so that the Gaussian is not cut off earlier than at full
+	# resolution): the peak of a Gaussian of odd width falls between two
+	# cells, which would move every fixation half a cell down and right
+	gridsize = (-(-int(dispsize[0]) // scale), -(-int(dispsize[1]) // scale))
+
+	return gridsize, 2 * max(1, int(numpy.ceil(gwh / (2.0 * scale)))), gsdwh / scale
+
+
+def _padded_size(dispsize, gwh):
+
+	# size of the canvas of the loop, padded by half a Gaussian on every side
+	strt = gwh/2
+
+	return (int(dispsize[1] + 2*strt), int(dispsize[0] + 2*strt))
+
+
+def _canvas_corners(x, y, dispsize, gwh):
+
+	# top-left corner of the Gaussian of every fixation on the padded canvas
+	# of the loop, and which fixations the loop adds: only those that fall
+	# inside the display (its clipping branch is never reached with float
+	# coordinates, and comparisons with NaN are False), each at its
+	# truncated corner
+	strt = gwh/2
+	xx = strt + x - int(gwh/2)
+	yy = strt + y - int(gwh/2)
+	inside = (0 < xx) & (xx < dispsize[0]) & (0 < yy) & (yy < dispsize[1])
+
+	return xx, yy, inside
+
+
+def _loop_heatmap(x, y, weights, dispsize, gwh, gsdwh, heatmap=None):
+
+	# adds a Gaussian for every fixation to heatmap, a zeroed canvas of
+	# _padded_size (allocated if None), and returns the display part of it;
+	# with (C, n) weights, the canvas has C channels, which are all added to
+	# in the same pass over the fixations; a weight that is not finite
+	# (e.g. a missing pupil size) drops the fixation from its heatmap
+	weights = numpy.asarray(weights, dtype=float)
+	weights = numpy.where(numpy.isfinite(weights), weights, 0.0)
+	channels = weights.shape[:-1]
+	if channels:
+		weights = weights.T[:,:,numpy.newaxis,numpy.newaxis]
+	# Gaussian
+	gaus = cached_gaussian(gwh,gsdwh)
+	# matrix of zeroes
+	strt = gwh/2
+	if heatmap is None:
+		heatmap = numpy.zeros(channels + _padded_size(dispsize, gwh), dtype=float)
+	# create heatmap
+	for i in range(0,len(x)):
+		# get x and y coordinates
+		xx = strt + x[i] - int(gwh/2)
+		yy = strt + y[i] - int(gwh/2)
+		# correct Gaussian size if either coordinate falls outside of
+		# display boundaries
+		if (not 0 < xx < dispsize[0]) or (not 0 < yy < dispsize[1]):
+			hadj=[0,gwh];vadj=[0,gwh]
+			if 0 > xx:
+				hadj[0] = abs(xx)
+				xx = 0
+			elif dispsize[0] < xx:
+				hadj[1] = gwh - int(xx-dispsize[0])
+			if 0 > yy:
+				vadj[0] = abs(yy)
+				yy = 0
+			elif dispsize[1] < yy:
+				vadj[1] = gwh - int(yy-dispsize[1])
+			# add adjusted Gaussian to the current heatmap
+			try:
+				heatmap[...,yy:yy+vadj[1],xx:xx+hadj[1]] += gaus[vadj[0]:vadj[1],hadj[0]:hadj[1]] * weights[i]
+			except:
+				# fixation was probably outside of display
+				pass
+		else:
+			# add Gaussian to the current heatmap
+			heatmap[...,int(yy):int(yy+gwh),int(xx):int(xx+gwh)] += gaus * weights[i]
+
+	# resize heatmap
+	return heatmap[...,int(strt):int(dispsize[1]+strt),int(strt):int(dispsize[0]+strt)]
+
+
+def upsample_bilinear(heatmap, scale, shape):
+
+	"""Returns a heatmap enlarged scale times by bilinear interpolation and
+	cropped to shape (height, width), treating every value as the centre of
+	a scale x scale cell, as when it was accumulated with the scale option
+	of accumulate_heatmap; the result is float32
+	"""
+
+	# rows first, as the heatmap is smallest then
+	heatmap = _upsample_axis(heatmap.astype(numpy.float32), scale, 0)[:shape[0]]
+
+	return _upsample_axis(heatmap, scale, 1)[:,:shape[1]]
+
+
+def _upsample_axis(a, scale, axis):
+
+	# bilinear upsampling of a by an integer factor along axis; output
+	# value r of every cell lies at the same fraction between two input
+	# values, so every r is filled with one vectorised blend
+	m = a.shape[axis]
+	# repeat the edges, which clamps the interpolation at the borders
+	padded = numpy.concatenate([numpy.take(a, [0], axis=axis), a, \
+		numpy.take(a, [m-1], axis=axis)], axis=axis)
+	out = numpy.empty(a.shape[:axis] + (m, scale) + a.shape[axis+1:], dtype=a.dtype)
+	lo = [slice(None)] * a.ndim
+	hi = [slice(None)] * a.ndim
+	for r in range(scale):
+		src = (r + 0.5) / scale - 0.5
+		i0 = int(numpy.floor(src)) + 1
+		f = numpy.float32(src - numpy.floor(src))
+		lo[axis] = slice(i0, i0+m)
+		hi[axis] = slice(i0+1, i0+1+m)
+		o = out[(slice(None),) * axis + (slice(None), r)]
+		numpy.multiply(padded[tuple(lo)], 1 - f, out=o)
+		o += padded[tuple(hi)] * f
+
+	return out.reshape(a.shape[:axis] + (m * scale,) + a.shape[axis+1:])
+
+
+def _convolve_heatmap(x, y, weights, dispsize, gwh, gsdwh):
+
+	# same padded canvas and fixations as the loop in accumulate_heatmap;
+	# with (C, n) weights, all C heatmaps are binned together and smoothed
+	# in the same FFTs
+	strt = gwh/2
+	xx, yy, inside = _canvas_corners(x, y, dispsize, gwh)
+	w = numpy.asarray(weights, dtype=float)
+	channels = w.shape[:-1]
+	w = w.reshape(-1, w.shape[-1])
+	# a weight that is not finite (e.g. a missing pupil size) is binned as
+	# 0, which drops the fixation from its heatmap as the loop does,
+	# instead of spreading NaN over the whole map
+	w = numpy.where(numpy.isfinite(w), w, 0.0)[:,inside]
+	px = xx[inside].astype(int)
+	py = yy[inside].astype(int)
+	kx = _gaussian_profile(gwh, gsdwh)
+
+	# bin the weights, keeping only the padded rows that hold fixations
+	width = int(dispsize[0] + 2*strt)
+	rows, ri = numpy.unique(py, return_inverse=True)
+	cells = rows.shape[0] * width
+	keys = (numpy.arange(w.shape[0])[:,numpy.newaxis] * cells + (ri * width + px)).ravel()
+	binned = numpy.bincount(keys, weights=w.ravel(), minlength=w.shape[0] * cells)
+	binned = binned.reshape(w.shape[0], rows.shape[0], width)
+	# smooth along rows, then along columns
+	smoothed = numpy.zeros((w.shape[0], int(dispsize[1] + 2*strt), int(dispsize[0])), dtype=float)
+	smoothed[:,rows] = _convolve_axis(binned, kx, 2, int(strt), int(dispsize[0]))
+	heatmap = _convolve_axis(smoothed, kx, 1, int(strt), int(dispsize[1]))
+	# the FFT leaves rounding noise where the loop leaves exact zeros
+	peak = numpy.max(numpy.abs(heatmap), axis=(1, 2), initial=0)
+	heatmap[numpy.abs(heatmap) <= 1e-10 * peak[:,numpy.newaxis,numpy.newaxis]] = 0
+
+	return heatmap.reshape(channels + heatmap.shape[1:])
+
+
+def _gaussian_profile(gwh, gsdwh):
+
+	# 1D profile of the (separable) Gaussian of gaussian(), the same along
+	# rows and columns
+	return numpy.exp(-1.0 * (numpy.arange(gwh, dtype=float) - gwh/2)**2 / (2*gsdwh*gsdwh))
+
+
+def _convolve_axis(a, kernel, axis, start, length):
+
+	# linear convolution of a with kernel along axis, through an FFT,
+	# cropped to [start:start+length]
+	n = _fft_length(a.shape[axis] + kernel.shape[0] - 1)
+	shape = [1] * a.ndim
+	shape[axis] = -1
+	fk = numpy.fft.rfft(kernel, n).reshape(shape)
+	full = numpy.fft.irfft(numpy.fft.rfft(a, n, axis=axis) * fk, n, axis=axis)
+
+	return numpy.take(full, numpy.arange(start, start+length), axis=axis)
+
+
+def _fft_length(n):
+
+	# smallest length of at least n that only has 2, 3 and 5 as factors,
+	# for which FFTs are fast
+	best = 2 * n
+	p2 = 1
+	while p2 < best:
+		p3 = p2
+		while p3 < best:
+			p5 = p3
+			while p5 < n:
+				p5 *= 5
+			best = min(best, p5)
+			p3 *= 3
+		p2 *= 2
+
+	return best
+
+
+def mask_heatmap(heatmap):
+
+	"""Sets all values of a heatmap that are below the mean of its non-zero
+	values to NaN, so that they are not drawn; the heatmap is changed in
+	place and returned
+	"""
+
+	# remove zeros; a heatmap without fixations (e.g. of a phase of a read
+	# in which nothing was fixated) has no mean, and is left as it is
+	positive = heatmap[heatmap>0]
+	if positive.shape[0] == 0:
+		return heatmap
+	lowbound = numpy.mean(positive)
+	heatmap[heatmap<lowbound] = numpy.nan
+
+	return heatmap
+
+
+def render_heatmap_array(fixations, dispsize, pupil=False, mask=True, method='loop', scale=1):
+
+	"""Returns the heatmap that draw_heatmap would draw, as a numpy array,
+	without creating a matplotlib Figure
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	pupil		-	Boolean indicating whether fixations are weighted by
+					pupil size instead of duration (default = False)
+	mask			-	Boolean indicating whether values below the mean of
+					the heatmap are set to NaN, as they are when drawn
+					(default = True)
+	method		-	'loop' or 'convolve', see accumulate_heatmap
+					(default = 'loop')
+	scale		-	factor by which the heatmap is accumulated at a lower
+					resolution, see accumulate_heatmap (default = 1)
+
+	returns
+
+	heatmap		-	numpy array of shape (dispsize[1], dispsize[0])
+	"""
+
+	# FIXATIONS
+	with instrumentation.stage('parse'):
+		fix = fixation_array(fixations)
+		weights = fix['pupil'] if pupil else fix['dur']
+
+	# HEATMAP
+	with instrumentation.stage('accumulate', method=method, scale=scale):
+		heatmap = accumulate_heatmap(fix['x'], fix['y'], weights, dispsize, method=method, scale=scale)
+	if mask:
+		with instrumentation.stage('mask'):
+			heatmap = mask_heatmap(heatmap)
+
+	return heatmap
+
+
+def render_heatmap_channels(fixations, dispsize, channels=CHANNELS, mask=True, method='loop', scale=1):
+
+	"""Returns heatmaps of the same fixations with different weights, which
+	are accumulated together in a single pass over the fixations, with one
+	Gaussian; the 'dur' and 'pupil' heatmaps are those of
+	render_heatmap_array with pupil=False and pupil=True
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	channels		-	names of the heatmaps to render, from CHANNELS
+					(default = CHANNELS)
+	mask, method, scale	-	see render_heatmap_array
+
+	returns
+
+	heatmaps		-	dict mapping every channel to its heatmap, a numpy
+					array of shape (dispsize[1], dispsize[0])
+	"""
+
+	for channel in channels:
+		if channel not in CHANNELS:
+			raise Exception("ERROR in render_heatmap_channels: unknown channel '%s'" % channel)
+
+	# FIXATIONS
+	with instrumentation.stage('parse'):
+		fix = fixation_array(fixations)
+		weights = numpy.stack([numpy.ones(len(fix)) if channel == 'count' else fix[channel] \
+			for channel in channels])
+
+	# HEATMAPS
+	with instrumentation.stage('accumulate', method=method, scale=scale, channels=len(channels)):
+		stack = accumulate_heatmap(fix['x'], fix['y'], weights, dispsize, method=method, scale=scale)
+	heatmaps = {}
+	for channel, heatmap in zip(channels, stack):
+		if mask:
+			with instrumentation.stage('mask'):
+				heatmap = mask_heatmap(heatmap)
+		heatmaps[channel] = heatmap
+
+	return heatmaps
+
+
+def render_heatmap_phases(fixations, dispsize, phases=3, pupil=False, mask=True, method='loop', scale=1):
+
+	"""Returns a heatmap per phase of a read (see fixation_phases), e.g. of
+	its initial, middle and end third; the phases are the channels of a
+	single accumulate_heatmap call, in which every fixation has its weight
+	in its own phase and 0 in the others, so they are accumulated in one
+	pass over the fixations, with one Gaussian
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	phases		-	number of equally long phases (default = 3)
+	pupil, mask, method, scale	-	see render_heatmap_array
+
+	returns
+
+	heatmaps		-	numpy array of shape (phases, dispsize[1],
+					dispsize[0]); a phase without fixations is all zeros
+	"""
+
+	if int(phases) < 1:
+		raise Exception("ERROR in render_heatmap_phases: phases should be at least 1, not %s" % phases)
+
+	# FIXATIONS
+	with instrumentation.stage('parse'):
+		fix = fixation_array(fixations)
+		phase = fixation_phases(fix, phases)
+		# one row of weights per phase
+		weights = numpy.zeros((int(phases), len(fix)))
+		weights[phase, numpy.arange(len(fix))] = fix['pupil'] if pupil else fix['dur']
+
+	# HEATMAPS
+	with instrumentation.stage('accumulate', method=method, scale=scale, phases=int(phases)):
+		heatmaps = accumulate_heatmap(fix['x'], fix['y'], weights, dispsize, method=method, scale=scale)
+	if mask:
+		with instrumentation.stage('mask'):
+			for heatmap in heatmaps:
+				mask_heatmap(heatmap)
+
+	return heatmaps
+
+
+def render_heatmaps_batch(trials, dispsize, pupil=False, mask=True, method='loop', scale=1, out=None):
+
+	"""Returns the heatmaps of many trials that share one display size, as
+	render_heatmap_array would return them one by one, stacked in a single
+	array; the canvas on which fixations are added is allocated once for
+	the whole batch, instead of once per trial
+
+	arguments
+
+	trials		-	list of fixation lists, one per trial, each as
+					accepted by render_heatmap_array
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	pupil		-	Boolean indicating whether fixations are weighted by
+					pupil size instead of duration (default = False)
+	mask			-	Boolean indicating whether values below the mean of
+					each heatmap are set to NaN (default = True)
+	method		-	'loop' or 'convolve', see accumulate_heatmap
+					(default = 'loop')
+	scale		-	factor by which heatmaps are accumulated at a lower
+					resolution, see accumulate_heatmap (default = 1)
+	out			-	numpy array of shape (len(trials), dispsize[1],
+					dispsize[0]) to write the heatmaps to, e.g. reused
+					between batches, or None to allocate one (float64,
+					or float32 if scale is not 1) (default = None)
+
+	returns
+
+	out			-	numpy array of shape (len(trials), dispsize[1],
+					dispsize[0])
+	"""
+
+	if method not in ('loop', 'convolve'):
+		raise Exception("ERROR in render_heatmaps_batch: unknown method '%s'" % method)
+	shape = (len(trials), int(dispsize[1]), int(dispsize[0]))
+	if out is None:
+		out = numpy.empty(shape, dtype=float if scale == 1 else numpy.float32)
+	elif out.shape != shape:
+		raise Exception("ERROR in render_heatmaps_batch: out has shape %s instead of %s" % (out.shape, shape))
+
+	# the same Gaussian and grid as accumulate_heatmap
+	gwh = GAUSSIAN_WIDTH
+	gsdwh = gwh/6
+	gridsize = dispsize
+	if scale != 1:
+		gridsize, gwh, gsdwh = _scaled_grid(dispsize, gwh, gsdwh, scale)
+	canvas = None
+	if method == 'loop':
+		canvas = numpy.zeros(_padded_size(gridsize, gwh), dtype=float)
+
+	for i, fixations in enumerate(trials):
+		# FIXATIONS
+		fix = fixation_array(fixations)
+		weights = fix['pupil'] if pupil else fix['dur']
+		x = numpy.asarray(fix['x'], dtype=float) / scale
+		y = numpy.asarray(fix['y'], dtype=float) / scale
+		# HEATMAP
+		if canvas is not None:
+			heatmap = _loop_heatmap(x, y, weights, gridsize, gwh, gsdwh, canvas)
+		else:
+			heatmap = _convolve_heatmap(x, y, weights, gridsize, gwh, gsdwh)
+		if scale != 1:
+			heatmap = upsample_bilinear(heatmap, scale, shape[1:])
+		out[i] = heatmap
+		if canvas is not None:
+			# clear the rows of the canvas that Gaussians were added to,
+			# which are those of the fixations the loop added (NaN and
+			# fixations outside the display are skipped, as by the loop)
+			xx, yy, inside = _canvas_corners(x, y, gridsize, gwh)
+			if inside.any():
+				canvas[int(numpy.min(yy[inside])):int(numpy.max(yy[inside])) + gwh] = 0
+		if mask:
+			mask_heatmap(out[i])
+
+	return out
+
+
+def render_heatmap_groups(trials, dispsizes, **kwargs):
+
+	"""Renders the heatmaps of trials with different display sizes, e.g.
+	the rows of the REFLACX master, in one render_heatmaps_batch call per
+	display size
+
+	arguments
+
+	trials		-	list of fixation lists, one per trial
+	dispsizes		-	list of display sizes, one per trial
+
+	keyword arguments
+
+	kwargs		-	passed on to render_heatmaps_batch
+
+	returns
+
+	groups		-	dict mapping every display size (a tuple) to a tuple
+					of the indices of its trials in trials, and the
+					stacked heatmaps of those trials
+	"""
+
+	indices = {}
+	for i, dispsize in enumerate(dispsizes):
+		indices.setdefault((int(dispsize[0]), int(dispsize[1])), []).append(i)
+
+	return {dispsize: (idx, render_heatmaps_batch([trials[i] for i in idx], dispsize, **kwargs)) \
+		for dispsize, idx in indices.items()}
+
+
+def sample_chunks(x, y, weights=None, chunksize=SAMPLE_CHUNK):
+
+	"""Yields the raw gaze samples of a trial in chunks of chunksize
+	samples, as (x, y, weights) tuples of slices; with numpy.memmap arrays
+	(e.g. from FixationStore.gaze), only one chunk is read at a time
+
+	arguments
+
+	x			-	numpy array of gaze x coordinates
+	y			-	numpy array of gaze y coordinates
+
+	keyword arguments
+
+	weights		-	numpy array with a weight per sample, e.g. the pupil
+					size, or None to count samples (default = None)
+	chunksize		-	number of samples per chunk (default = SAMPLE_CHUNK)
+	"""
+
+	for start in range(0, len(x), chunksize):
+		stop = start + chunksize
+		yield x[start:stop], y[start:stop], None if weights is None else weights[start:stop]
+
+
+def sample_histogram(chunks, dispsize, scale=1):
+
+	"""Returns the 2D histogram of raw gaze samples, binned one chunk at a
+	time, so that memory does not grow with the number of samples; samples
+	outside the display or with a NaN coordinate or weight are left out
+
+	arguments
+
+	chunks		-	iterable of (x, y) or (x, y, weights) tuples of numpy
+					arrays, e.g. sample_chunks(x, y); weights may be None
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	scale			-	integer size of the square bins, in pixels
+					(default = 1)
+
+	returns
+
+	histogram		-	numpy array of shape (ceil(dispsize[1]/scale),
+					ceil(dispsize[0]/scale)), with the number (or summed
+					weight) of samples in every bin
+	"""
+
+	width = -(-int(dispsize[0]) // scale)
+	height = -(-int(dispsize[1]) // scale)
+	histogram = numpy.zeros(height * width, dtype=float)
+	for chunk in chunks:
+		x = numpy.asarray(chunk[0], dtype=float)
+		y = numpy.asarray(chunk[1], dtype=float)
+		weights = chunk[2] if len(chunk) > 2 else None
+		# comparisons with NaN are False, so those samples drop out too
+		inside = (0 <= x) & (x < dispsize[0]) & (0 <= y) & (y < dispsize[1])
+		if weights is not None:
+			weights = numpy.asarray(weights, dtype=float)
+			inside &= numpy.isfinite(weights)
+			weights = weights[inside]
+		bins = (y[inside] // scale).astype(numpy.intp) * width + (x[inside] // scale).astype(numpy.intp)
+		numpy.add.at(histogram, bins, 1.0 if weights is None else weights)
+
+	return histogram.reshape(height, width)
+
+
+def render_gaze_heatmap(chunks, dispsize, mask=True, scale=1, gwh=GAUSSIAN_WIDTH, gsdwh=None):
+
+	"""Returns a density heatmap of raw gaze samples: the samples are
+	binned chunk by chunk (see sample_histogram), and the histogram is
+	smoothed once with the Gaussian that accumulate_heatmap lays over a
+	fixation. At 1 kHz, every sample counts as a millisecond of dwell time
+
+	arguments
+
+	chunks		-	iterable of (x, y) or (x, y, weights) chunks of the
+					samples of a trial, e.g. sample_chunks(x, y) or
+					sample_chunks(x, y, pupil)
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	mask			-	Boolean indicating whether values below the mean of
+					the non-zero values are set to NaN (default = True)
+	scale			-	integer factor by which the histogram is coarser than
+					the display; it is smoothed at that size and enlarged
+					by bilinear interpolation (default = 1)
+	gwh			-	width in pixels of the Gaussian (default =
+					GAUSSIAN_WIDTH)
+	gsdwh			-	standard deviation of the Gaussian, or None for gwh/6
+					(default = None)
+
+	returns
+
+	heatmap		-	numpy array of shape (dispsize[1], dispsize[0])
+	"""
+
+	if gsdwh == None:
+		gsdwh = gwh/6
+	scale = max(1, int(scale))
+
+	with instrumentation.stage('bin', scale=scale):
+		histogram = sample_histogram(chunks, dispsize, scale=scale)
+
+	with instrumentation.stage('smooth', scale=scale):
+		# the same Gaussian on the grid of bins as accumulate_heatmap
+		if scale > 1:
+			gwh, gsdwh = _scaled_grid(dispsize, gwh, gsdwh, scale)[1:]
+		kx = _gaussian_profile(gwh, gsdwh)
+		heatmap = _convolve_axis(histogram, kx, 1, int(gwh/2), histogram.shape[1])
+		heatmap = _convolve_axis(heatmap, kx, 0, int(gwh/2), histogram.shape[0])
+		# the FFT leaves rounding noise where no sample is near
+		heatmap[numpy.abs(heatmap) <= 1e-10 * numpy.max(numpy.abs(heatmap), initial=0)] = 0
+		if scale > 1:
+			heatmap = upsample_bilinear(heatmap, scale, (int(dispsize[1]), int(dispsize[0])))
+
+	if mask:
+		with instrumentation.stage('mask'):
+			heatmap = mask_heatmap(heatmap)
+
+	return heatmap
+
+
+def heatmap_to_rgb(heatmap, cmap='jet', alpha=0.5, background='white'):
+
+	"""Returns an RGB image of a heatmap, coloured with a colormap and
+	alpha-blended over a background, the way draw_heatmap draws it; NaN
+	values are left transparent. Over a uint8 background, e.g. the pixels
+	of a display Figure drawn with the Agg backend, the result is the same
+	as the pixels Agg draws, to the byte
+
+	arguments
+
+	heatmap		-	numpy array as returned by render_heatmap_array
+
+	keyword arguments
+
+	cmap			-	name of a matplotlib colormap (default = 'jet')
+	alpha		-	float between 0 and 1, indicating the transparancy of
+					the heatmap, where 0 is completely transparant and 1
+					is completely untransparant (default = 0.5)
+	background	-	a matplotlib colour, or a numpy array with the same
+					height and width as the heatmap (greyscale or RGB,
+					uint8 or floats between 0 and 1) (default = 'white')
+
+	returns
+
+	rgb			-	uint8 numpy array of shape (height, width, 3)
+	"""
+
+	from matplotlib import colormaps, colors
+
+	cm = colormaps[cmap]
+	valid = ~numpy.isnan(heatmap)
+	# colormap entry of every drawn pixel, normalised between the lowest and
+	# highest drawn value, as imshow does
+	lo, hi = 0.0, 0.0
+	if valid.any():
+		lo, hi = numpy.min(heatmap[valid]), numpy.max(heatmap[valid])
+	# colours as matplotlib hands them to Agg: truncated to bytes
+	lut = (cm(numpy.arange(cm.N))[:,:3] * 255).astype(numpy.uint8)
+	blend = _blend_table(alpha)
+	if isinstance(background, numpy.ndarray):
+		bg = background
+		if bg.dtype != numpy.uint8:
+			bg = numpy.round(numpy.clip(bg, 0, 1) * 255).astype(numpy.uint8)
+		if bg.ndim == 2:
+			bg = numpy.repeat(bg[:,:,numpy.newaxis], 3, axis=2)
+		# only the drawn pixels are blended, over a copy of the background
+		rgb = numpy.array(bg[:,:,:3], dtype=numpy.uint8, order='C')
+		flat = rgb.reshape(-1, 3)
+		pos = numpy.flatnonzero(valid)
+		src = lut[_colormap_index(heatmap.ravel()[pos], lo, hi, cm.N)].astype(numpy.uint16)
+		src <<= 8
+		src |= flat[pos]
+		flat[pos] = blend.ravel()[src]
+	else:
+		# with a plain background every colormap entry blends to one colour,
+		# so the blend is a table lookup
+		bg = numpy.round(numpy.array(colors.to_rgb(background)) * 255).astype(numpy.uint8)
+		idx = numpy.zeros(heatmap.shape, dtype=numpy.intp)
+		idx[valid] = _colormap_index(heatmap[valid], lo, hi, cm.N)
+		rgb = blend[lut, bg][idx]
+		rgb[~valid] = bg
+
+	return rgb
+
+
+def _colormap_index(values, lo, hi, n):
+
+	# entry of a colormap of n colours of every value, normalised between
+	# lo and hi
+	if not hi > lo:
+		return numpy.zeros(values.shape, dtype=numpy.intp)
+
+	return numpy.clip((values - lo) * (n / (hi - lo)), 0, n - 1).astype(numpy.intp)
+
+
+@functools.lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _blend_table(alpha):
+
+	# (256, 256) uint8 table of the colour that Agg's plain RGBA blender
+	# gives a source byte (row) drawn with alpha over an opaque destination
+	# byte (column), in the integer arithmetic of Agg: the alpha of the
+	# image is truncated to a byte, 0 leaves the destination and 255
+	# replaces it
+	a = int(alpha * 255)
+	src = numpy.arange(256, dtype=numpy.int64)[:,numpy.newaxis]
+	dst = numpy.arange(256, dtype=numpy.int64)[numpy.newaxis,:]
+	if a <= 0:
+		table = numpy.broadcast_to(dst, (256, 256))
+	elif a >= 255:
+		table = numpy.broadcast_to(src, (256, 256))
+	else:
+		table = ((src * 256 - dst * 255) * a + dst * 255 * 256) // (65280 + a)
+	table = table.astype(numpy.uint8)
+	table.flags.writeable = False
+
+	return table
+
+
+def save_heatmap(heatmap, savefilename, cmap='jet', alpha=0.5, background='white', **kwargs):
+
+	"""Writes a heatmap straight to an image file (e.g. JPEG or PNG, chosen
+	by the file extension), without creating a matplotlib Figure
+
+	arguments
+
+	heatmap		-	numpy array as returned by render_heatmap_array
+	savefilename	-	full path to the file in which the heatmap should be
+					saved
+
+	keyword arguments
+
+	cmap, alpha, background	-	see heatmap_to_rgb
+	kwargs		-	passed on to PIL.Image.save, e.g. quality=95
+	"""
+
+	with instrumentation.stage('colormap'):
+		rgb = heatmap_to_rgb(heatmap, cmap=cmap, alpha=alpha, background=background)
+	with instrumentation.stage('encode'):
+		Image.fromarray(rgb).save(savefilename, **kwargs)
+	instrumentation.bytes_written(savefilename)
+
+
+# # # # #
+# PLOTS
+#
+# matplotlib Figures of fixations, heatmaps and raw gaze, with the anomaly
+# ellipses of a trial as an optional overlay (bbox); every function draws on
+# a display made by its display argument, so that the plotter modules can
+# keep their own background
+
+def use_batch_backend():
+
+	"""Makes matplotlib draw with BATCH_BACKEND, i.e. off-screen, without
+	loading a GUI toolkit; for scripts and worker processes that only save
+	figures, and to be called before the first plot is made
+	"""
+
+	import matplotlib
+	matplotlib.use(BATCH_BACKEND)
+
+
+@functools.lru_cache(maxsize=None)
+def _setup_font(family, size):
+
+	# looks the font up once per process: matplotlib warns about a missing
+	# family every time text is drawn, so then its default family is kept
+	import matplotlib
+	from matplotlib import font_manager
+	if family in {font.name for font in font_manager.fontManager.ttflist}:
+		matplotlib.rc('font', family=family, size=size)
+	else:
+		matplotlib.rc('font', size=size)
+
+
+def close_figure(fig):
+
+	"""Closes a Figure made by one of the plots, freeing its memory"""
+
+	from matplotlib import pyplot
+	pyplot.close(fig)
+
+
+def draw_display(dispsize, imagefile=None, cmap='gray', drawimage=True):
+
+	"""Returns a matplotlib.pyplot Figure and its axes, with a size of
+	dispsize, a black background colour, and optionally with an image drawn
+	onto it
+
+	arguments
+
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	imagefile		-	full path to an image file over which the heatmap
+					is to be laid, or None for no image; NOTE: the image
+					may be smaller than the display size, the function
+					assumes that the image was presented at the centre of
+					the display (default = None)
+	cmap			-	matplotlib colormap in which the display is drawn
+					(default = 'gray')
+	drawimage		-	Boolean indicating whether imagefile is drawn; if
+					False, the display is left empty (default = True)
+
+	returns
+	fig, ax		-	matplotlib.pyplot Figure and its axes: field of zeros
+					with a size of dispsize, and an image drawn onto it
+					if an imagefile was passed
+	"""
+
+	_setup_font(FONT['family'], FONT['size'])
+	from matplotlib import pyplot, image
+
+	# construct screen (black background)
+	screen = numpy.zeros((int(dispsize[1]),int(dispsize[0])), dtype='uint8')
+	# if an image location has been passed, draw the image
+	if drawimage and imagefile != None:
+		# check if the path to the image exists
+		if not os.path.isfile(imagefile):
+			raise Exception("ERROR in draw_display: imagefile not found at '%s'" % imagefile)
+		# load image
+		with instrumentation.stage('imread'):
+			img = image.imread(imagefile)
+		# width and height of the image
+		w, h = len(img[0]), len(img)
+		# x and y position of the image on the display
+		x = dispsize[0]/2 - w/2
+		y = dispsize[1]/2 - h/2
+
+		screen[int(y):int(y+h),int(x):int(x+w)] = img
+
+	# dots per inch
+	dpi = 100.0
+	# determine the figure size in inches
+	figsize = (dispsize[0]/dpi, dispsize[1]/dpi)
+	# create a figure
+	fig = pyplot.figure(figsize=figsize, dpi=dpi, frameon=False)
+	ax = pyplot.Axes(fig, [0,0,1,1])
+	ax.set_axis_off()
+	fig.add_axes(ax)
+	# plot display
+	ax.axis([0,dispsize[0],0,dispsize[1]])
+	ax.imshow(screen, cmap=cmap)
+
+	return fig, ax
+
+
+def draw_bbox(ax, bbox, alpha=0.5):
+
+	"""Draws the outlines of anomaly ellipses on an axis, as a single
+	EllipseCollection built from the columns of bbox, with a legend entry
+	per certainty level
+
+	arguments
+
+	ax			-	a matplotlib.pyplot Axes instance
+	bbox			-	pandas DataFrame with the centre ('h', 'k'), semi-
+					axes ('a', 'b') and 'certainty' of every ellipse
+
+	keyword arguments
+
+	alpha		-	float between 0 and 1, indicating the transparancy of
+					the outlines (default = 0.5)
+
+	returns
+
+	ells			-	the matplotlib EllipseCollection
+	"""
+
+	from matplotlib.collections import EllipseCollection
+	from matplotlib.patches import Patch
+
+	h = numpy.asarray(bbox['h'], dtype=float)
+	k = numpy.asarray(bbox['k'], dtype=float)
+	ells = EllipseCollection(numpy.asarray(bbox['a'], dtype=float)*2, numpy.asarray(bbox['b'], dtype=float)*2, \
+		numpy.zeros(len(h)), units='xy', offsets=numpy.column_stack((h, k)), offset_transform=ax.transData, \
+		edgecolors='red', facecolors='none', linewidths=10, alpha=alpha)
+	ax.add_collection(ells)
+
+	# one proxy handle per certainty level, instead of one per ellipse
+	if len(h) > 0:
+		certainties = bbox['certainty'].unique()
+		handles = [Patch(edgecolor='red', facecolor='none', linewidth=10, alpha=alpha) for c in certainties]
+		ax.legend(handles, ['Certainty {}'.format(c) for c in certainties], fontsize='xx-large')
+
+	return ells
+
+
+def _blit_heatmaps(fig, ax, im, heatmaps, overlays=()):
+
+	# draws the display once, without the heatmap im and the artists in
+	# overlays (which lie on top of it), and then, for every heatmap, puts
+	# that background back, draws the heatmap (with its own colour scale)
+	# and the overlays over it, and yields; the canvas then holds the frame
+	# that savefig would have drawn. Needs an Agg canvas
+	hidden = [im] + list(overlays)
+	for artist in hidden:
+		artist.set_visible(False)
+	with instrumentation.stage('background'):
+		fig.canvas.draw()
+		background = fig.canvas.copy_from_bbox(fig.bbox)
+	for artist in hidden:
+		artist.set_visible(True)
+
+	for heatmap in heatmaps:
+		with instrumentation.stage('blit'):
+			im.set_data(heatmap)
+			im.autoscale()
+			fig.canvas.restore_region(background)
+			for artist in hidden:
+				ax.draw_artist(artist)
+		yield
+
+
+def _finish_plot(fig, ax, savefilename):
+
+	# invert the y axis, as (0,0) is top left on a display
+	ax.invert_yaxis()
+	# save the figure if a file name was provided
+	if savefilename != None:
+		with instrumentation.stage('savefig'):
+			fig.savefig(savefilename)
+		instrumentation.bytes_written(savefilename)
+
+	return fig
+
+
+def draw_fixations(fixations, dispsize, imagefile=None, durationsize=True, durationcolour=True, alpha=0.5, savefilename=None, bbox=None, display=draw_display):
+
+	"""Draws circles on the fixation locations, optionally on top of an image,
+	with optional weigthing of the duration for circle size and colour, and
+	annotates the words of the fixations with the largest pupil sizes
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	imagefile		-	full path to an image file over which the heatmap
+					is to be laid, or None for no image (default = None)
+	durationsize	-	Boolean indicating whether the fixation duration is
+					to be taken into account as a weight for the circle
+					size; longer duration = bigger (default = True)
+	durationcolour	-	Boolean indicating whether the fixation duration is
+					to be taken into account as a weight for the circle
+					colour; longer duration = hotter (default = True)
+	alpha		-	float between 0 and 1, indicating the transparancy of
+					the heatmap, where 0 is completely transparant and 1
+					is completely untransparant (default = 0.5)
+	savefilename	-	full path to the file in which the heatmap should be
+					saved, or None to not save the file (default = None)
+	bbox			-	pandas DataFrame of anomaly ellipses to draw on top,
+					see draw_bbox, or None for none (default = None)
+	display		-	function that returns the Figure and axes to draw
+					on, called as display(dispsize, imagefile=imagefile)
+					(default = draw_display)
+
+	returns
+
+	fig			-	a matplotlib.pyplot Figure instance, containing the
+					fixations
+	"""
+
+	# FIXATIONS
+	fix = parse_fixations(fixations)
+
+	# IMAGE
+	with instrumentation.stage('figure'):
+		fig, ax = display(dispsize, imagefile=imagefile)
+
+	# CIRCLES
+	# duration weigths
+	if durationsize:
+		siz = 100000.0 * (fix['dur']/30.0)
+	else:
+		siz = 100000.0 * numpy.median(fix['dur']/30.0)
+	if durationcolour:
+		col = fix['dur']
+	else:
+		col = COLS['chameleon'][2]
+	# draw circles
+	ax.scatter(fix['x'],fix['y'], s=siz, c=col, cmap='jet', marker='o', alpha=alpha, edgecolors='none')
+
+	#Annotate
+	# Loop for annotation of all points
+
+	fix_words = parse_fixations_words(fixations)
+
+	x = fix_words['x']
+	y = fix_words['y']
+	text = fix_words['word']
+
+	for i in range(len(x)):
+		ax.annotate(text[i], (x[i], y[i]), size=10, \
+			bbox=dict(boxstyle="square", fc="cyan", ec="b", lw=2))
+
+	#DRAW ELLIPSES
+	if bbox is not None:
+		draw_bbox(ax, bbox, alpha=alpha)
+
+	# FINISH PLOT
+	return _finish_plot(fig, ax, savefilename)
+
+
+def draw_heatmap(fixations, dispsize, imagefile=None, durationweight=True, alpha=0.5, savefilename=None, pupil=False, method='loop', scale=1, phases=None, bbox=None, display=draw_display):
+
+	"""Draws a heatmap of the provided fixations, optionally drawn over an
+	image, and optionally allocating more weight to fixations with a higher
+	duration.
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	imagefile		-	full path to an image file over which the heatmap
+					is to be laid, or None for no image (default = None)
+	durationweight	-	Boolean indicating whether the fixation duration is
+					to be taken into account as a weight for the heatmap
+					intensity; longer duration = hotter (default = True)
+	alpha		-	float between 0 and 1, indicating the transparancy of
+					the heatmap, where 0 is completely transparant and 1
+					is completely untransparant (default = 0.5)
+	savefilename	-	full path to the file in which the heatmap should be
+					saved, or None to not save the file (default = None)
+	pupil		-	Boolean indicating whether fixations are weighted by
+					pupil size instead of duration (default = False)
+	method		-	'loop' or 'convolve', the way fixations are added to
+					the heatmap; see accumulate_heatmap (default = 'loop')
+	scale		-	integer factor by which the heatmap is accumulated at
+					a lower resolution, e.g. 4 or 8, and then upsampled;
+					see accumulate_heatmap (default = 1)
+	phases		-	number of equally long phases of the read to draw a
+					heatmap of each, e.g. 3 for the initial, middle and
+					end third (see render_heatmap_phases); savefilename
+					then holds the phases side by side, from one pass
+					over the fixations, and the display is only drawn
+					once; an Agg backend is assumed (see
+					use_batch_backend). None draws the whole read
+					(default = None)
+	bbox			-	pandas DataFrame of anomaly ellipses to draw on top,
+					see draw_bbox, or None for none (default = None)
+	display		-	function that returns the Figure and axes to draw
+					on, see draw_fixations (default = draw_display)
+
+	returns
+
+	fig			-	a matplotlib.pyplot Figure instance, containing the
+					heatmap (of the last phase, with phases)
+	"""
+
+	# IMAGE
+	with instrumentation.stage('figure'):
+		fig, ax = display(dispsize, imagefile=imagefile)
+
+	# HEATMAP
+	if phases is None:
+		heatmaps = [render_heatmap_array(fixations, dispsize, pupil=pupil, method=method, scale=scale)]
+	else:
+		heatmaps = render_heatmap_phases(fixations, dispsize, phases=phases, pupil=pupil, method=method, scale=scale)
+	# draw heatmap on top of image
+	with instrumentation.stage('imshow'):
+		im = ax.imshow(heatmaps[0], cmap='jet', alpha=alpha)
+
+	#DRAW ELLIPSES ON TOP OF HEATMAPS
+	overlays = []
+	if bbox is not None:
+		overlays.append(draw_bbox(ax, bbox, alpha=alpha))
+		if ax.get_legend() is not None:
+			overlays.append(ax.get_legend())
+
+	# FINISH PLOT
+	if phases is None:
+		return _finish_plot(fig, ax, savefilename)
+
+	# PHASES: every heatmap over the display, in panels side by side
+	from matplotlib import image
+	# invert the y axis, as (0,0) is top left on a display
+	ax.invert_yaxis()
+	panels = [numpy.array(fig.canvas.buffer_rgba()) for frame in _blit_heatmaps(fig, ax, im, heatmaps, overlays)]
+	# save the panels if a file name was provided
+	if savefilename != None:
+		with instrumentation.stage('savefig'):
+			image.imsave(savefilename, numpy.concatenate(panels, axis=1), dpi=fig.dpi)
+		instrumentation.bytes_written(savefilename)
+
+	return fig
+
+
+def draw_gaze_heatmap(x, y, dispsize, imagefile=None, pupil=None, alpha=0.5, savefilename=None, scale=1, chunksize=SAMPLE_CHUNK, bbox=None, display=draw_display):
+
+	"""Draws a density heatmap of the raw gaze samples of a trial (see
+	render_gaze_heatmap), optionally drawn over an image
+
+	arguments
+
+	x			-	numpy array of gaze x coordinates, e.g. a memmap from
+					FixationStore.gaze
+	y			-	numpy array of gaze y coordinates
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	imagefile		-	full path to an image file over which the heatmap
+					is to be laid, or None for no image (default = None)
+	pupil			-	numpy array of pupil sizes to weight every sample
+					by, or None to count samples (default = None)
+	alpha		-	float between 0 and 1, indicating the transparancy of
+					the heatmap, where 0 is completely transparant and 1
+					is completely untransparant (default = 0.5)
+	savefilename	-	full path to the file in which the heatmap should be
+					saved, or None to not save the file (default = None)
+	scale			-	see render_gaze_heatmap (default = 1)
+	chunksize		-	number of samples binned at a time (default =
+					SAMPLE_CHUNK)
+	bbox			-	pandas DataFrame of anomaly ellipses to draw on top,
+					see draw_bbox, or None for none (default = None)
+	display		-	function that returns the Figure and axes to draw
+					on, see draw_fixations (default = draw_display)
+
+	returns
+
+	fig			-	a matplotlib.pyplot Figure instance, containing the
+					heatmap
+	"""
+
+	# IMAGE
+	with instrumentation.stage('figure'):
+		fig, ax = display(dispsize, imagefile=imagefile)
+
+	# HEATMAP
+	heatmap = render_gaze_heatmap(sample_chunks(x, y, pupil, chunksize), dispsize, scale=scale)
+	# draw heatmap on top of image
+	with instrumentation.stage('imshow'):
+		ax.imshow(heatmap, cmap='jet', alpha=alpha)
+
+	#DRAW ELLIPSES ON TOP OF HEATMAPS
+	if bbox is not None:
+		draw_bbox(ax, bbox, alpha=alpha)
+
+	# FINISH PLOT
+	return _finish_plot(fig, ax, savefilename)
+
+
+def draw_heatmaps(fixations, dispsize, savefilenames, imagefile=None, alpha=0.5, method='loop', scale=1, display=draw_display):
+
+	"""Draws and saves heatmaps of the same fixations with different
+	weights, e.g. the duration and pupil heatmaps of a trial: the heatmaps
+	are accumulated in one pass (see render_heatmap_channels), and the
+	display is drawn only once; every heatmap is then blended over its
+	pixels with heatmap_to_rgb, which gives the pixels Agg would draw, so
+	that it is neither rasterised nor composited by matplotlib again.
+	Every file is the same as the one draw_heatmap saves for that weight;
+	a non-interactive Agg backend is assumed (see use_batch_backend)
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+	savefilenames	-	dict mapping channels (see CHANNELS) to the full
+					path of the file in which that heatmap is saved,
+					e.g. {'dur': 'heatmap.jpg', 'pupil': 'pupil.jpg'}
+
+	keyword arguments
+
+	imagefile, alpha, method, scale, display	-	see draw_heatmap
+
+	returns
+
+	fig			-	a matplotlib.pyplot Figure instance, containing the
+					last heatmap
+	"""
+
+	from matplotlib import image
+
+	# HEATMAPS
+	channels = tuple(savefilenames)
+	heatmaps = render_heatmap_channels(fixations, dispsize, channels=channels, method=method, scale=scale)
+
+	# IMAGE
+	with instrumentation.stage('figure'):
+		fig, ax = display(dispsize, imagefile=imagefile)
+	# invert the y axis, as (0,0) is top left on a display
+	ax.invert_yaxis()
+	with instrumentation.stage('background'):
+		fig.canvas.draw()
+		frame = numpy.array(fig.canvas.buffer_rgba())
+
+	if frame.shape[:2] == heatmaps[channels[0]].shape and (frame[:,:,3] == 255).all():
+		# every heatmap blended over the opaque display, and saved as
+		# savefig saves the buffer
+		background = frame[:,:,:3].copy()
+		for channel in channels:
+			with instrumentation.stage('colormap'):
+				frame[:,:,:3] = heatmap_to_rgb(heatmaps[channel], alpha=alpha, background=background)
+			with instrumentation.stage('savefig'):
+				image.imsave(savefilenames[channel], frame, dpi=fig.dpi)
+			instrumentation.bytes_written(savefilenames[channel])
+		# the Figure holds the last heatmap, as the one of draw_heatmap
+		with instrumentation.stage('imshow'):
+			ax.imshow(heatmaps[channels[-1]], cmap='jet', alpha=alpha)
+		return fig
+
+	# otherwise (e.g. a display with transparent parts), every heatmap is
+	# drawn over the display by Agg, which is only drawn once
+	with instrumentation.stage('imshow'):
+		im = ax.imshow(heatmaps[channels[0]], cmap='jet', alpha=alpha)
+	frames = _blit_heatmaps(fig, ax, im, [heatmaps[channel] for channel in channels])
+	for channel, frame in zip(channels, frames):
+		with instrumentation.stage('savefig'):
+			image.imsave(savefilenames[channel], fig.canvas.buffer_rgba(), dpi=fig.dpi)
+		instrumentation.bytes_written(savefilenames[channel])
+
+	return fig
+
+
+def export_heatmap(fixations, dispsize, writer, key, pupil=False, mask=False, method='loop', scale=1):
+
+	"""Adds the normalised heatmap of the provided fixations to a tensor
+	shard writer, instead of drawing it, for use as a training target
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+	writer		-	a heatmap_tensors.HeatmapShardWriter, e.g. for the
+					split of the trial
+	key			-	key of the heatmap in the index, e.g. the REFLACX id
+
+	keyword arguments
+
+	pupil		-	Boolean indicating whether fixations are weighted by
+					pupil size instead of duration (default = False)
+	mask			-	Boolean indicating whether values below the mean of
+					the heatmap are set to 0, as they are left out when
+					drawn (default = False)
+	method		-	'loop' or 'convolve', see accumulate_heatmap
+					(default = 'loop')
+	scale		-	factor by which the heatmap is accumulated at a lower
+					resolution, see accumulate_heatmap (default = 1)
+	"""
+
+	heatmap = render_heatmap_array(fixations, dispsize, pupil=pupil, mask=mask, method=method, scale=scale)
+	writer.add(key, heatmap)
+
+
+def draw_ellipses(bbox, dispsize, imagefile=None, alpha=0.5, savefilename=None, display=draw_display):
+
+	"""Draws the anomaly ellipses of a trial, optionally on top of an image
+
+	arguments
+
+	bbox			-	pandas DataFrame of anomaly ellipses, see draw_bbox
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	imagefile, alpha, savefilename, display	-	see draw_fixations
+
+	returns
+
+	fig			-	a matplotlib.pyplot Figure instance, containing the
+					ellipses
+	"""
+
+	# IMAGE
+	with instrumentation.stage('figure'):
+		fig, ax = display(dispsize, imagefile=imagefile)
+
+	# ELLIPSES
+	draw_bbox(ax, bbox, alpha=alpha)
+
+	return _finish_plot(fig, ax, savefilename)
+
+
+def draw_raw(x, y, dispsize, imagefile=None, savefilename=None, alpha=0.5, bbox=None, display=draw_display):
+
+	"""Draws the raw x and y data, coloured by the third of the trial they
+	are in (green, yellow, blue)
+
+	arguments
+
+	x			-	a list of x coordinates of all samples that are to
+					be plotted
+	y			-	a list of y coordinates of all samples that are to
+					be plotted
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	imagefile, savefilename, alpha, bbox, display	-	see draw_fixations
+
+	returns
+
+	fig			-	a matplotlib.pyplot Figure instance, containing the
+					fixations
+	"""
+
+	# image
+	with instrumentation.stage('figure'):
+		fig, ax = display(dispsize, imagefile=imagefile)
+
+	n = int(x.shape[0]/3)
+
+	# plot raw data points
+	ax.plot(x[:n], y[:n], 'o', color='green', markeredgecolor='green')
+	ax.plot(x[n:n*2], y[n:n*2], 'o', color='yellow', markeredgecolor='yellow')
+	ax.plot(x[n*2:n*3], y[n*2:n*3], 'o', color='blue', markeredgecolor='blue')
+
+	#Draw ellipses on top of gaze
+	if bbox is not None:
+		draw_bbox(ax, bbox, alpha=alpha)
+
+	return _finish_plot(fig, ax, savefilename)
+
+
+def draw_scanpath(fixations, saccades, dispsize, imagefile=None, alpha=0.5, savefilename=None, display=draw_display):
+
+	"""Draws a scanpath: a series of arrows between numbered fixations,
+	optionally drawn over an image
+
+	arguments
+
+	fixations		-	a list of fixation ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Efix']
+	saccades		-	a list of saccade ending events from a single trial,
+					as produced by edfreader.read_edf, e.g.
+					edfdata[trialnr]['events']['Esac']
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	imagefile, alpha, savefilename, display	-	see draw_fixations
+
+	returns
+
+	fig			-	a matplotlib.pyplot Figure instance, containing the
+					heatmap
+	"""
+
+	# image
+	with instrumentation.stage('figure'):
+		fig, ax = display(dispsize, imagefile=imagefile)
+
+	# FIXATIONS
+	# parse fixations
+	fix = parse_fixations(fixations)
+	# draw fixations
+	ax.scatter(fix['x'],fix['y'], s=fix['dur'], c=COLS['chameleon'][2], marker='o', alpha=alpha, edgecolors='none')
+	# draw annotations (fixation numbers)
+	for i in range(len(fixations)):
+		ax.annotate(str(i+1), (fix['x'][i],fix['y'][i]), color=COLS['aluminium'][5], alpha=1, horizontalalignment='center', verticalalignment='center', multialignment='center')
+
+	# SACCADES
+	if saccades:
+		# loop through all saccades
+		for st, et, dur, sx, sy, ex, ey in saccades:
+			# draw an arrow between every saccade start and ending
+			ax.arrow(sx, sy, ex-sx, ey-sy, alpha=alpha, fc=COLS['aluminium'][0], ec=COLS['aluminium'][5], fill=True, shape='full', width=10, head_width=20, head_starts_at_zero=False, overhang=0)
+
+	return _finish_plot(fig, ax, savefilename)
@@ -0,0 +1,123 @@
+# Heatmap aggregate
+#
+# Consensus heatmaps of all reads of one image (one dicom_id), built in a
+# single pass: the heatmap of every read is added to a running aggregate
+# and then dropped, so memory does not grow with the number of readers.
+
+import numpy
+import gazeplotter_core
+
+# ways in which the heatmaps of several reads are combined: 'mean' averages
+# them, 'max' takes the highest value of any read, and 'normalized' scales
+# every read to a maximum of 1 before averaging, so that readers with longer
+# or more fixations do not dominate
+MODES = ('mean', 'max', 'normalized')
+
+
+class HeatmapAggregator:
+
+	"""Running aggregate of the heatmaps of the reads of one image
+
+	arguments
+
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	mode			-	one of MODES (default = 'mean')
+	"""
+
+	def __init__(self, dispsize, mode='mean'):
+
+		if mode not in MODES:
+			raise Exception("ERROR in HeatmapAggregator: unknown mode '%s'" % mode)
+		self.dispsize = dispsize
+		self.mode = mode
+		self.total = numpy.zeros((int(dispsize[1]), int(dispsize[0])), dtype=float)
+		self.count = 0
+
+	def add(self, heatmap):
+
+		"""Adds the (unmasked) heatmap of one read"""
+
+		if self.mode == 'max':
+			numpy.maximum(self.total, heatmap, out=self.total)
+		elif self.mode == 'normalized':
+			peak = numpy.max(heatmap, initial=0)
+			if peak > 0:
+				self.total += heatmap / peak
+		else:
+			self.total += heatmap
+		self.count += 1
+
+	def add_fixations(self, fixations, pupil=False, method='loop', scale=1):
+
+		"""Renders the heatmap of the fixations of one read and adds it
+
+		arguments
+
+		fixations		-	a list of fixation ending events from a single
+						trial, as accepted by
+						gazeplotter_core.render_heatmap_array
+
+		keyword arguments
+
+		pupil, method, scale	-	see gazeplotter_core.render_heatmap_array
+		"""
+
+		self.add(gazeplotter_core.render_heatmap_array(fixations, self.dispsize, pupil=pupil, \
+			mask=False, method=method, scale=scale))
+
+	def result(self, mask=True):
+
+		"""Returns the aggregate heatmap, optionally masked like a drawn
+		heatmap (see gazeplotter_core.mask_heatmap)
+		"""
+
+		heatmap = self.total.copy()
+		if self.mode != 'max' and self.count > 0:
+			heatmap /= self.count
+		if mask:
+			heatmap = gazeplotter_core.mask_heatmap(heatmap)
+
+		return heatmap
+
+
+def aggregate_reads(reads, mode='mean', mask=True, pupil=False, method='loop', scale=1):
+
+	"""Yields one aggregate heatmap per image from a stream of reads
+
+	Reads of the same image must be consecutive (e.g. sorted by dicom_id);
+	only the aggregate of the current image is kept in memory.
+
+	arguments
+
+	reads		-	iterable of (key, dispsize, fixations) tuples, one per
+					read, where key identifies the image, e.g. its
+					dicom_id
+
+	keyword arguments
+
+	mode			-	one of MODES (default = 'mean')
+	mask			-	Boolean indicating whether the aggregates are masked
+					like drawn heatmaps (default = True)
+	pupil, method, scale	-	see gazeplotter_core.render_heatmap_array
+
+	yields
+
+	(key, heatmap, count)	-	the key of an image, its aggregate heatmap,
+					and the number of reads in it
+	"""
+
+	key = None
+	aggregator = None
+	for readkey, dispsize, fixations in reads:
+		if aggregator is None or readkey != key:
+			if aggregator is not None:
+				yield key, aggregator.result(mask=mask), aggregator.count
+			key = readkey
+			aggregator = HeatmapAggregator(dispsize, mode=mode)
+		aggregator.add_fixations(fixations, pupil=pupil, method=method, scale=scale)
+	if aggregator is not None:
+		yield key, aggregator.result(mask=mask), aggregator.count
@@ -0,0 +1,166 @@
+# Heatmap tensors
+#
+# Writes normalised heatmaps as raw tensors for training saliency models,
+# instead of colormapped images: the heatmaps of one split are appended to
+# .npy shards of at most SHARD_BYTES bytes, and an index csv records where
+# the heatmap of every REFLACX id is. Heatmaps of different display sizes
+# are stored flattened, one after another, so that shards can be read with
+# numpy.load(..., mmap_mode='r') without decoding anything.
+
+import os
+import numpy
+import pandas as pd
+
+# maximum size of a shard, in bytes (a heatmap is never split over shards)
+SHARD_BYTES = 2**30
+# size of the .npy header of a shard, which is rewritten when the shard is
+# closed, so it has a fixed size
+HEADER_BYTES = 128
+
+
+def normalize_heatmap(heatmap, dtype='float32'):
+
+	"""Returns a heatmap scaled to values between 0 and 1, as dtype; NaN
+	values (masked pixels) become 0
+
+	arguments
+
+	heatmap		-	numpy array as returned by
+					gazeplotter_core.render_heatmap_array
+	"""
+
+	heatmap = numpy.nan_to_num(heatmap, nan=0.0)
+	peak = numpy.max(heatmap, initial=0)
+	if peak > 0:
+		heatmap = heatmap / peak
+
+	return heatmap.astype(dtype)
+
+
+def _npy_header(dtype, n):
+
+	# header of a version 1.0 .npy file holding n values of dtype, padded
+	# with spaces to HEADER_BYTES
+	d = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (numpy.dtype(dtype).str, n)
+	header = d.ljust(HEADER_BYTES - 10 - 1) + '\n'
+
+	return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class HeatmapShardWriter:
+
+	"""Appends the heatmaps of one split to .npy shards in a folder, and
+	writes <split>_index.csv when closed
+
+	arguments
+
+	folder		-	folder in which the shards and the index are written
+	split			-	name of the split, e.g. 'train'
+
+	keyword arguments
+
+	dtype			-	dtype in which heatmaps are stored (default = 'float16')
+	shardbytes	-	maximum size of a shard in bytes (default = SHARD_BYTES)
+	"""
+
+	def __init__(self, folder, split, dtype='float16', shardbytes=SHARD_BYTES):
+
+		self.folder = folder
+		self.split = split
+		self.dtype = numpy.dtype(dtype)
+		self.shardbytes = shardbytes
+		self.index = []
+		self._shard = -1
+		self._file = None
+		self._count = 0
+		os.makedirs(folder, exist_ok=True)
+
+	def _shardname(self, shard):
+
+		return '%s_%04d.npy' % (self.split, shard)
+
+	def _finish_shard(self):
+
+		# write the final length into the header of the current shard
+		if self._file is not None:
+			self._file.seek(0)
+			self._file.write(_npy_header(self.dtype, self._count))
+			self._file.close()
+			self._file = None
+
+	def add(self, key, heatmap):
+
+		"""Appends a heatmap (normalised with normalize_heatmap) under key,
+		e.g. the REFLACX id of the trial
+		"""
+
+		data = numpy.ascontiguousarray(normalize_heatmap(heatmap, self.dtype))
+		if self._file is None or (self._count > 0 and \
+			(self._count + data.size) * self.dtype.itemsize > self.shardbytes):
+			self._finish_shard()
+			self._shard += 1
+			self._count = 0
+			self._file = open(os.path.join(self.folder, self._shardname(self._shard)), 'wb')
+			self._file.write(_npy_header(self.dtype, 0))
+		self.index.append({'id': key, 'shard': self._shardname(self._shard), 'offset': self._count, \
+			'height': data.shape[0], 'width': data.shape[1]})
+		self._file.write(data.tobytes())
+		self._count += data.size
+
+	def close(self):
+
+		"""Finishes the last shard and writes the index"""
+
+		self._finish_shard()
+		pd.DataFrame(self.index, columns=['id', 'shard', 'offset', 'height', 'width']) \
+			.to_csv(os.path.join(self.folder, '%s_index.csv' % self.split), index=False)
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *exc):
+
+		self.close()
+
+
+class HeatmapTensors:
+
+	"""Memory-mapped reader of the heatmaps of one split, written by
+	HeatmapShardWriter: tensors[id] is the (height, width) heatmap of a
+	REFLACX id
+
+	arguments
+
+	folder		-	folder with the shards and the index
+	split			-	name of the split, e.g. 'train'
+	"""
+
+	def __init__(self, folder, split):
+
+		self.folder = folder
+		self.index = pd.read_csv(os.path.join(folder, '%s_index.csv' % split)).set_index('id')
+		self._shards = {}
+
+	def _shard(self, name):
+
+		if name not in self._shards:
+			self._shards[name] = numpy.load(os.path.join(self.folder, name), mmap_mode='r')
+
+		return self._shards[name]
+
+	@property
+	def ids(self):
+
+		return self.index.index.tolist()
+
+	def __len__(self):
+
+		return len(self.index)
+
+	def __getitem__(self, key):
+
+		row = self.index.loc[key]
+		n = row['height'] * row['width']
+
+		return self._shard(row['shard'])[row['offset']:row['offset']+n].reshape(row['height'], row['width'])
@@ -0,0 +1,215 @@
+# Instrumentation
+#
+# Opt-in timing of the stages of a run (loading, lookups, kernels,
+# accumulation, Figure creation, encoding, ...), and of the bytes written per
+# file. It is switched on by setting the environment variable ENV_VAR to the
+# path of a Chrome trace file, e.g.
+#
+#	GAZEPLOTTER_TRACE=trace.json python analysis_images_to_folders.py ate
+#
+# and then writes that file (open it in chrome://tracing or Perfetto) and
+# prints a summary table when the run exits. Worker processes inherit the
+# variable; they hand their events to the parent with collect(), which adds
+# them with merge(). When it is off, stage() returns a shared do-nothing
+# context manager and nothing is recorded.
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import multiprocessing
+
+# environment variable with the path of the trace file
+ENV_VAR = 'GAZEPLOTTER_TRACE'
+
+_enabled = bool(os.environ.get(ENV_VAR))
+_events = []
+_lock = threading.Lock()
+_registered = False
+
+
+class _NullStage:
+
+	# returned by stage() when instrumentation is off
+
+	def __enter__(self):
+
+		return self
+
+	def __exit__(self, *exc):
+
+		return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+	def __init__(self, name, args):
+
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+
+		self.start = time.perf_counter_ns()
+		return self
+
+	def __exit__(self, *exc):
+
+		end = time.perf_counter_ns()
+		event = {'name': self.name, 'ph': 'X', 'ts': self.start / 1000.0, 'dur': (end - self.start) / 1000.0, \
+			'pid': os.getpid(), 'tid': threading.get_ident()}
+		if self.args:
+			event['args'] = self.args
+		with _lock:
+			_events.append(event)
+		return False
+
+
+def enabled():
+
+	"""Returns True if instrumentation is on"""
+
+	return _enabled
+
+
+def enable(tracefile):
+
+	"""Switches instrumentation on for this process and the processes it
+	starts after this call, writing the trace to tracefile at exit
+
+	arguments
+
+	tracefile		-	path of the Chrome trace file
+	"""
+
+	global _enabled
+	os.environ[ENV_VAR] = tracefile
+	_enabled = True
+	_register()
+
+
+def stage(name, **args):
+
+	"""Returns a context manager that records how long its block takes, as
+	a stage called name; keyword arguments (e.g. the trial) are stored with
+	it
+
+	with instrumentation.stage('savefig', path=savefilename):
+		fig.savefig(savefilename)
+	"""
+
+	if not _enabled:
+		return _NULL_STAGE
+
+	return _Stage(name, args)
+
+
+def bytes_written(path, name='write'):
+
+	"""Records the size of a file that was just written"""
+
+	if not _enabled:
+		return
+	size = os.path.getsize(path) if os.path.isfile(path) else 0
+	event = {'name': name, 'ph': 'C', 'ts': time.perf_counter_ns() / 1000.0, 'pid': os.getpid(), \
+		'tid': threading.get_ident(), 'args': {'bytes': size}, 'path': path}
+	with _lock:
+		_events.append(event)
+
+
+def collect():
+
+	"""Returns the events recorded so far in this process and forgets them,
+	e.g. to send them from a worker to the parent (an empty list when
+	instrumentation is off)
+	"""
+
+	global _events
+	with _lock:
+		events, _events = _events, []
+
+	return events
+
+
+def merge(events):
+
+	"""Adds events collected in another process"""
+
+	if events:
+		with _lock:
+			_events.extend(events)
+
+
+def summary(events=None):
+
+	"""Returns a table with the number of calls, the total, mean and
+	maximum duration, and the bytes written of every stage
+	"""
+
+	if events is None:
+		events = _events
+	stages = {}
+	written = {}
+	for event in events:
+		if event['ph'] == 'X':
+			stages.setdefault(event['name'], []).append(event['dur'] / 1000.0)
+		elif event['ph'] == 'C':
+			written[event['name']] = written.get(event['name'], 0) + event['args']['bytes']
+
+	lines = ['%-24s %8s %12s %10s %10s %14s' % ('stage', 'calls', 'total (ms)', 'mean (ms)', 'max (ms)', 'bytes')]
+	for name, durations in sorted(stages.items(), key=lambda item: -sum(item[1])):
+		lines.append('%-24s %8d %12.1f %10.2f %10.2f %14s' % (name, len(durations), sum(durations), \
+			sum(durations) / len(durations), max(durations), ''))
+	for name, size in sorted(written.items()):
+		lines.append('%-24s %8s %12s %10s %10s %14d' % (name, '', '', '', '', size))
+
+	return '\n'.join(lines)
+
+
+def write_trace(tracefile, events=None):
+
+	"""Writes events (by default, all recorded events) as a Chrome trace"""
+
+	if events is None:
+		events = _events
+	trace = [dict((k, v) for k, v in event.items() if k != 'path') for event in events]
+	with open(tracefile, 'w') as f:
+		json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+def _report():
+
+	# at exit of the main process: the trace file and the summary table
+	if not _enabled or multiprocessing.parent_process() is not None:
+		return
+	write_trace(os.environ[ENV_VAR])
+	print(summary(), file=sys.stderr)
+	print('trace written to ' + os.environ[ENV_VAR], file=sys.stderr)
+
+
+def _register():
+
+	global _registered
+	if not _registered:
+		atexit.register(_report)
+		_registered = True
+
+
+def _forget():
+
+	# a forked worker starts with a copy of the parent's events, which the
+	# parent already has
+	global _events
+	_events = []
+
+
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=_forget)
+
+if _enabled:
+	_register()
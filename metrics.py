@@ -4,100 +4,75 @@
 
 import os
 import numpy
-import math
-from matplotlib import pyplot, image
-from matplotlib.patches import Ellipse
 
 def metrics(x, y, pupil, bbox, id_trial):
-	
-	h = bbox['h']
-	k = bbox['k']
-	a = bbox['a']
-	b = bbox['b']
 
-	n = int(x.shape[0]/3)
+	el = [[bbox['h'], bbox['k'], bbox['a'], bbox['b']]]
 
-	el_area = a*b*numpy.pi
+	result = metrics_batch(x, y, pupil, el)[0]
 
-	count = 0
-	count_initial = 0
-	count_middle = 0
-	count_end = 0
+	# a percentage is log(0) when no gaze of that part falls inside the ellipse
+	if numpy.isneginf(result[1:5]).any():
+		print(f'TRIAL WITH NO GAZE INSIDE ELLIPSE {id_trial}')
 
-	sum_pupil_inside_ellipse = 0
-	sum_pupil_initial = 0
-	sum_pupil_middle = 0
-	sum_pupil_end = 0
+	return tuple(result)
 
-	idx = 0
-	for xx,yy,pup in zip(x,y,pupil):
-		idx = idx+1
-		#assume that points on top of the elipse line are inside the elipse
-		if (checkpoint(h, k, xx, yy, a, b) <= 1): 
-			sum_pupil_inside_ellipse+=pup
-			count+=1
+def metrics_batch(x, y, pupil, ellipses):
 
-		if (checkpoint(h, k, xx, yy, a, b) <= 1) and idx<=n:
-			sum_pupil_initial+=pup
-			count_initial+=1
+	"""Returns the metrics of metrics() for many ellipses at once, as a
+	(k, 9) array with one row per ellipse, in the order of the tuple that
+	metrics() returns
 
-		if (checkpoint(h, k, xx, yy, a, b) <= 1) and idx>n and idx<=2*n:
-			sum_pupil_middle+=pup
-			count_middle+=1
+	arguments
 
-		if (checkpoint(h, k, xx, yy, a, b) <= 1) and idx>2*n and idx<=3*n:
-			sum_pupil_end+=pup
-			count_end+=1
-	
-	# Qual a duração do diagnóstico? - Gaze está com resolução de 1ms, pelo que é multiplicar nº total de pontos por 1ms
-	diag_duration = round(x.shape[0]*0.001,2)
+	x, y, pupil	-	numpy arrays with the raw gaze samples of one trial
+	ellipses		-	(k, 4) array of ellipses, one (h, k, a, b) per row
+	"""
 
-	# Da gaze total, qual a percentagem que está dentro da elipse?
-	percentage_gaze_inside_ellipse = numpy.log((count/x.shape[0])/el_area)
+	x = numpy.asarray(x, dtype=float)
+	y = numpy.asarray(y, dtype=float)
+	pupil = numpy.asarray(pupil, dtype=float)
+	el = numpy.asarray(ellipses, dtype=float).reshape(-1, 4)
 
-	# Da gaze no primeiro terço do diagnóstico, qual a percentagem que está dentro da elipse?
-	percentage_initial_inside_ellipse = numpy.log((count_initial/n)/el_area)
+	n = int(x.shape[0]/3)
 
-	# Da gaze intermédia, qual a percentagem dentro da elipse?
-	percentage_middle_inside_ellipse = numpy.log((count_middle/n)/el_area)
+	# whole trial, initial, middle and end third
+	parts = [slice(None), slice(0, n), slice(n, 2*n), slice(2*n, 3*n)]
+	lengths = numpy.array([x.shape[0], n, n, n])
 
-	# Da gaze final, qual a percentagem dentro da elipse?
-	percentage_end_inside_ellipse = numpy.log((count_end/n)/el_area)
+	result = numpy.zeros((el.shape[0], 9))
 
-	# Qual a média da pupila dentro da elipse
-	avg_pupil_inside_el = round(safe_div(sum_pupil_inside_ellipse,count),2)
+	for i, (h, k, a, b) in enumerate(el):
 
-	# Qual a media da pupila no primeiro terço do diagnóstico, dentro da elipse?
-	avg_pupil_initial_inside_el = round(safe_div(sum_pupil_initial,count_initial),2)
+		#assume that points on top of the elipse line are inside the elipse
+		inside = checkpoint(h, k, x, y, a, b) <= 1
+		pupil_inside = numpy.where(inside, pupil, 0)
 
-	# Qual a media da pupila no meio diagnóstico, dentro da elipse?
-	avg_pupil_middle_inside_el = round(safe_div(sum_pupil_middle,count_middle),2)
+		count = numpy.array([numpy.count_nonzero(inside[p]) for p in parts])
+		sum_pupil = numpy.array([numpy.sum(pupil_inside[p]) for p in parts])
 
-	# Qual a média da pupila no fim do diagnostico, dentro da elipse?
-	avg_pupil_end_inside_el = round(safe_div(sum_pupil_end,count_end),2)
+		el_area = a*b*numpy.pi
 
-	if count == 0 |	count_initial == 0 |	count_middle == 0 |	count_end == 0:
-		print(f'TRIAL WITH NO GAZE INSIDE ELLIPSE {id_trial}')
-	
-	
-
-	return diag_duration,\
-		   percentage_gaze_inside_ellipse, \
-		   percentage_initial_inside_ellipse, \
-		   percentage_middle_inside_ellipse, \
-		   percentage_end_inside_ellipse, \
-		   avg_pupil_inside_el, \
-		   avg_pupil_initial_inside_el, \
-		   avg_pupil_middle_inside_el, \
-		   avg_pupil_end_inside_el
+		# Qual a duração do diagnóstico? - Gaze está com resolução de 1ms, pelo que é multiplicar nº total de pontos por 1ms
+		result[i, 0] = round(x.shape[0]*0.001,2)
+
+		# Da gaze total, e de cada terço do diagnóstico, qual a percentagem que está dentro da elipse?
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			result[i, 1:5] = numpy.log((count/lengths)/el_area)
+
+		# Qual a média da pupila dentro da elipse, no total e em cada terço do diagnóstico?
+		result[i, 5:9] = numpy.round([safe_div(s, c) for s, c in zip(sum_pupil, count)], 2)
+
+	return result
 
 # Function to check if the point is
 def checkpoint(h, k, x, y, a, b):
  
     # checking the equation of
     # ellipse with the given point
-    p = ((math.pow((x - h), 2) / math.pow(a, 2)) +
-         (math.pow((y - k), 2) / math.pow(b, 2)))
+    # (works on single points and on numpy arrays of points)
+    p = (((x - h)**2 / a**2) +
+         ((y - k)**2 / b**2))
  
     return p
 
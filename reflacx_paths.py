@@ -0,0 +1,71 @@
+# REFLACX paths
+#
+# Looks up the rows of reflacx_with_fixations.csv that belong to a trial and
+# turns the {XAMI_MIMIC_PATH} path templates in it into paths on this
+# machine.
+
+import os
+import re
+import pandas as pd
+
+# placeholder that starts every path in reflacx_with_fixations.csv
+PATH_TEMPLATE = '{XAMI_MIMIC_PATH}'
+
+
+class PathResolver:
+
+	"""Index over reflacx_with_fixations.csv on (id, subject_id, dicom_id),
+	built once, so that the row of a trial is found in constant time
+
+	arguments
+
+	root			-	folder that replaces {XAMI_MIMIC_PATH} in the paths
+					of the csv, e.g. 'D:\\XAMI-MIMIC'
+
+	keyword arguments
+
+	csvfile		-	path to reflacx_with_fixations.csv
+					(default = 'reflacx_with_fixations.csv')
+	"""
+
+	def __init__(self, root, csvfile='reflacx_with_fixations.csv'):
+
+		self.root = root
+		self.df = pd.read_csv(csvfile)
+		# position of the first row of every (id, subject_id, dicom_id)
+		self.index = {}
+		keys = zip(self.df['id'], self.df['subject_id'], self.df['dicom_id'])
+		for pos, key in enumerate(keys):
+			self.index.setdefault(self._key(*key), pos)
+
+	@staticmethod
+	def _key(id, subject_id, dicom_id):
+
+		# the pickles and the csv do not always agree on types
+		return str(id), int(subject_id), str(dicom_id)
+
+	def lookup(self, id, subject_id, dicom_id):
+
+		"""Returns the row of reflacx_with_fixations.csv (a pandas Series,
+		named after its index in the csv) of a trial, or None if the csv
+		has no row for it
+		"""
+
+		pos = self.index.get(self._key(id, subject_id, dicom_id))
+		if pos is None:
+			return None
+
+		return self.df.iloc[pos]
+
+	def resolve(self, template):
+
+		"""Returns the path on this machine of a path template from the csv,
+		e.g. '{XAMI_MIMIC_PATH}\\patient_1\\CXR-JPG\\s2\\3.jpg'
+		"""
+
+		# the csv was written on Windows, so split on both separators
+		parts = [p for p in re.split(r'[\\/]', template) if p]
+		if parts and parts[0] == PATH_TEMPLATE:
+			parts = parts[1:]
+
+		return os.path.join(self.root, *parts)
@@ -0,0 +1,545 @@
+# Saliency metrics
+#
+# Pixel-level comparison of heatmaps (e.g. from render_heatmap_array, as
+# draw_heatmap draws them) with the anomaly ellipses of a trial: the share of
+# the heatmap mass inside the ellipses, AUC, NSS and KL divergence. The
+# ellipse masks are rasterised once per (dicom_id, ellipse set, display size,
+# scale) and kept as packed bits in a least-recently-used cache, so that
+# comparing another heatmap with the same ellipses only costs the reductions
+# over its pixels.
+#
+# The batch engine computes the standard saliency metrics (NSS, AUC-Judd, CC,
+# KLD, SIM) of predicted heatmaps against reference heatmaps and fixations,
+# vectorised over stacks of heatmaps; the stacks are read in chunks of a
+# bounded size, so the heatmaps may be memory-mapped (e.g. HeatmapTensors)
+# and larger than RAM.
+
+import hashlib
+import collections
+import numpy
+import instrumentation
+
+from metrics import checkpoint
+
+# maximum number of ellipse masks kept per process (a packed 3000x2500 mask
+# takes about 1 MB)
+MASK_CACHE_SIZE = 64
+# number of heatmap levels that AUC thresholds at
+AUC_BINS = 1024
+# regularisation of the KL divergence, as in the saliency benchmarks
+EPS = 2.2204e-16
+# metrics returned by heatmap_metrics, in order
+METRICS = ('mass_inside', 'auc', 'nss', 'kld')
+# metrics of the batch engine, of which the first need fixations and the
+# others reference heatmaps
+BATCH_METRICS = ('nss', 'auc_judd', 'cc', 'kld', 'sim')
+FIXATION_METRICS = ('nss', 'auc_judd')
+REFERENCE_METRICS = ('cc', 'kld', 'sim')
+# bytes of the heatmap stacks of a chunk of the batch engine (its temporary
+# arrays take about as much again)
+CHUNK_BYTES = 2**28
+
+
+# # # # #
+# MASKS
+
+def ellipse_hash(ellipses):
+
+	"""Returns a hex digest of a set of ellipses, the same for any order of
+	its rows
+
+	arguments
+
+	ellipses		-	(m, 4) array of ellipses, one (h, k, a, b) per row
+	"""
+
+	el = numpy.asarray(ellipses, dtype='<f8').reshape(-1, 4)
+	el = el[numpy.lexsort(el.T[::-1])]
+
+	return hashlib.sha1(numpy.ascontiguousarray(el).tobytes()).hexdigest()
+
+
+def ellipse_mask(ellipses, dispsize, scale=1):
+
+	"""Returns a boolean raster of the display that is True in the pixels
+	whose centre lies in any of the ellipses (on the outline counts as
+	inside, as in metrics.metrics_batch); every ellipse is only evaluated
+	over its bounding box
+
+	arguments
+
+	ellipses		-	(m, 4) array of ellipses, one (h, k, a, b) per row;
+					rows with missing values are left out
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	scale			-	integer size of the square cells of the raster, in
+					pixels, e.g. for heatmaps accumulated with scale
+					(default = 1)
+
+	returns
+
+	mask			-	numpy bool array of shape (ceil(dispsize[1]/scale),
+					ceil(dispsize[0]/scale))
+	"""
+
+	el = numpy.asarray(ellipses, dtype=float).reshape(-1, 4)
+	el = el[numpy.isfinite(el).all(axis=1)]
+	scale = max(1, int(scale))
+	width = -(-int(dispsize[0]) // scale)
+	height = -(-int(dispsize[1]) // scale)
+	# display coordinates of the centre of every cell
+	xs = (numpy.arange(width) + 0.5) * scale - 0.5
+	ys = (numpy.arange(height) + 0.5) * scale - 0.5
+
+	mask = numpy.zeros((height, width), dtype=bool)
+	for h, k, a, b in el:
+		# cells of the bounding box
+		c0 = numpy.searchsorted(xs, h - abs(a), side='left')
+		c1 = numpy.searchsorted(xs, h + abs(a), side='right')
+		r0 = numpy.searchsorted(ys, k - abs(b), side='left')
+		r1 = numpy.searchsorted(ys, k + abs(b), side='right')
+		if c1 > c0 and r1 > r0:
+			mask[r0:r1,c0:c1] |= checkpoint(h, k, xs[numpy.newaxis,c0:c1], ys[r0:r1,numpy.newaxis], a, b) <= 1
+
+	return mask
+
+
+class MaskCache:
+
+	"""Least-recently-used cache of ellipse masks, keyed on (dicom_id,
+	ellipse_hash(ellipses), dispsize, scale) and stored as packed bits
+
+	keyword arguments
+
+	maxsize		-	maximum number of masks kept (default =
+					MASK_CACHE_SIZE)
+	"""
+
+	def __init__(self, maxsize=MASK_CACHE_SIZE):
+
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._masks = collections.OrderedDict()
+
+	def __len__(self):
+
+		return len(self._masks)
+
+	def clear(self):
+
+		"""Forgets all masks"""
+
+		self._masks.clear()
+
+	def get(self, dicom_id, ellipses, dispsize, scale=1):
+
+		"""Returns the mask of ellipse_mask(ellipses, dispsize, scale), from
+		the cache if it holds it, and otherwise rasterised and added to it
+
+		arguments
+
+		dicom_id		-	id of the image the ellipses were drawn on
+		ellipses		-	(m, 4) array of ellipses, one (h, k, a, b) per row
+		dispsize		-	tuple or list indicating the size of the display,
+						e.g. (1024,768)
+
+		keyword arguments
+
+		scale			-	see ellipse_mask (default = 1)
+
+		returns
+
+		mask			-	numpy bool array, see ellipse_mask
+		"""
+
+		key = (dicom_id, ellipse_hash(ellipses), (int(dispsize[0]), int(dispsize[1])), max(1, int(scale)))
+		if key in self._masks:
+			self.hits += 1
+			self._masks.move_to_end(key)
+			bits, shape = self._masks[key]
+		else:
+			self.misses += 1
+			with instrumentation.stage('rasterise', dicom_id=str(dicom_id)):
+				mask = ellipse_mask(ellipses, dispsize, scale=key[3])
+			bits, shape = numpy.packbits(mask, axis=None), mask.shape
+			self._masks[key] = (bits, shape)
+			while len(self._masks) > self.maxsize:
+				self._masks.popitem(last=False)
+
+		return numpy.unpackbits(bits, count=shape[0]*shape[1]).view(bool).reshape(shape)
+
+
+# masks of cached_mask
+_cache = MaskCache()
+
+
+def cached_mask(dicom_id, ellipses, dispsize, scale=1):
+
+	"""Returns the same mask as ellipse_mask, from a per-process MaskCache
+	of at most MASK_CACHE_SIZE masks; see MaskCache.get
+	"""
+
+	return _cache.get(dicom_id, ellipses, dispsize, scale=scale)
+
+
+# # # # #
+# METRICS
+
+def heatmap_metrics(heatmap, mask):
+
+	"""Returns the saliency metrics of a heatmap against an ellipse mask, as
+	a dict with the keys of METRICS; NaN pixels (those that mask_heatmap
+	leaves out of the drawing) count as 0, as the heatmap is not drawn there
+
+	mass_inside	-	share of the heatmap mass that lies inside the mask
+	auc			-	area under the ROC curve of the heatmap as a
+					classifier of mask pixels, with AUC_BINS thresholds
+	nss			-	mean of the standardised heatmap over the mask
+	kld			-	KL divergence of the heatmap, as a distribution,
+					from the uniform distribution over the mask
+
+	arguments
+
+	heatmap		-	numpy array of shape (H, W)
+	mask			-	numpy bool array of the same shape, e.g. from
+					cached_mask
+	"""
+
+	heatmap = numpy.asarray(heatmap, dtype=float)
+	mask = numpy.asarray(mask, dtype=bool)
+	if heatmap.shape != mask.shape:
+		raise Exception("ERROR in heatmap_metrics: heatmap of shape %s, mask of shape %s" % (heatmap.shape, mask.shape))
+
+	# a masked heatmap is mostly NaN or zero, so the reductions over the
+	# whole display only use its positive pixels (comparisons with NaN are
+	# False)
+	n = mask.size
+	values = heatmap[heatmap > 0]
+	inside = heatmap[mask]
+	inside = numpy.where(inside > 0, inside, 0.0)
+	ninside = inside.shape[0]
+	total = values.sum()
+	result = dict((name, numpy.nan) for name in METRICS)
+	if ninside == 0 or total <= 0:
+		return result
+
+	result['mass_inside'] = inside.sum() / total
+
+	# positives are the mask pixels; ties within a level count half
+	if ninside < n:
+		top = AUC_BINS / values.max()
+		positives = numpy.bincount(numpy.minimum((inside * top).astype(numpy.intp), AUC_BINS - 1), minlength=AUC_BINS)
+		negatives = numpy.bincount(numpy.minimum((values * top).astype(numpy.intp), AUC_BINS - 1), minlength=AUC_BINS)
+		negatives[0] += n - values.shape[0]
+		negatives -= positives
+		below = numpy.cumsum(negatives) - negatives
+		result['auc'] = numpy.sum(positives * (below + 0.5 * negatives)) / (ninside * float(n - ninside))
+
+	mean = total / n
+	std = numpy.sqrt(max(numpy.dot(values, values) / n - mean * mean, 0.0))
+	if std > 0:
+		result['nss'] = (inside.mean() - mean) / std
+
+	# uniform over the mask, against the normalised heatmap
+	q = 1.0 / ninside
+	result['kld'] = q * numpy.sum(numpy.log(EPS + q / (inside / total + EPS)))
+
+	return result
+
+
+def trial_metrics(heatmap, dicom_id, ellipses, dispsize, scale=1, cache=None):
+
+	"""Returns heatmap_metrics of a heatmap against the mask of the ellipses
+	of its trial, taken from cache (a MaskCache, or None for the one of
+	cached_mask)
+
+	arguments
+
+	heatmap		-	numpy array of shape (dispsize[1], dispsize[0]), or
+					of the shape of the mask at scale
+	dicom_id		-	id of the image the ellipses were drawn on
+	ellipses		-	(m, 4) array of ellipses, one (h, k, a, b) per row
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+
+	keyword arguments
+
+	scale			-	see ellipse_mask (default = 1)
+	cache			-	MaskCache to take the mask from (default = None)
+	"""
+
+	mask = (_cache if cache is None else cache).get(dicom_id, ellipses, dispsize, scale=scale)
+	with instrumentation.stage('saliency'):
+		return heatmap_metrics(heatmap, mask)
+
+
+# # # # #
+# BATCHES
+
+def iter_chunks(predicted, reference=None, fixations=None, chunkbytes=CHUNK_BYTES):
+
+	"""Yields the items of predicted, reference and fixations in chunks of
+	consecutive items with heatmaps of the same shape, at most chunkbytes of
+	heatmaps each (but at least one item), so that only one chunk is read
+	at a time
+
+	arguments
+
+	predicted		-	sequence of (H, W) heatmaps, e.g. an (N, H, W)
+					numpy.memmap or [tensors[id] for id in ids] of
+					HeatmapTensors
+
+	keyword arguments
+
+	reference		-	sequence of (H, W) heatmaps of the same shapes as
+					predicted, or None (default = None)
+	fixations		-	sequence of the fixations of every item, as dicts
+					from parse_fixations or (x, y) tuples of arrays, or
+					None (default = None)
+	chunkbytes		-	maximum bytes of the heatmaps of a chunk (default =
+					CHUNK_BYTES)
+
+	yields
+
+	start, pred, ref, fix	-	position of the first item of the chunk;
+					float64 (b, H, W) stacks of the predicted and the
+					reference heatmaps, with NaN set to 0 (ref is None
+					without reference); and the list of the fixations of
+					the chunk (None without fixations)
+	"""
+
+	n = len(predicted)
+	start = 0
+	while start < n:
+		shape = numpy.shape(predicted[start])
+		stacks = 1 if reference is None else 2
+		size = max(1, int(chunkbytes // (8 * stacks * max(1, int(numpy.prod(shape))))))
+		stop = start + 1
+		while stop < n and stop - start < size and numpy.shape(predicted[stop]) == shape:
+			stop += 1
+
+		with instrumentation.stage('read_chunk', items=stop-start):
+			pred = _stack(predicted, start, stop)
+			ref = None if reference is None else _stack(reference, start, stop)
+		if ref is not None and ref.shape != pred.shape:
+			raise Exception("ERROR in iter_chunks: predicted heatmaps of shape %s, reference heatmaps of shape %s at item %d" \
+				% (pred.shape[1:], ref.shape[1:], start))
+		fix = None if fixations is None else [fixations[i] for i in range(start, stop)]
+
+		yield start, pred, ref, fix
+		start = stop
+
+
+def _stack(heatmaps, start, stop):
+
+	# float64 copy of heatmaps[start:stop], with the NaN of masked heatmaps
+	# set to 0
+	if isinstance(heatmaps, numpy.ndarray):
+		stack = numpy.array(heatmaps[start:stop], dtype=float)
+	else:
+		stack = numpy.array([heatmaps[i] for i in range(start, stop)], dtype=float)
+	numpy.copyto(stack, 0.0, where=numpy.isnan(stack))
+
+	return stack
+
+
+def _fixation_pixels(fixations, shape):
+
+	# (item, pixel) of every distinct fixated pixel of every item, sorted by
+	# item, with a fixation at x on pixel int(x) as in the heatmaps
+	height, width = shape
+	keys = []
+	for i, fix in enumerate(fixations):
+		if fix is None:
+			continue
+		x, y = (fix['x'], fix['y']) if isinstance(fix, dict) else (fix[0], fix[1])
+		x = numpy.asarray(x, dtype=float)
+		y = numpy.asarray(y, dtype=float)
+		inside = (0 <= x) & (x < width) & (0 <= y) & (y < height)
+		keys.append((i * height + y[inside].astype(numpy.int64)) * width + x[inside].astype(numpy.int64))
+	keys = numpy.unique(numpy.concatenate(keys)) if keys else numpy.zeros(0, dtype=numpy.int64)
+
+	return keys // (height * width), keys % (height * width)
+
+
+def _auc_judd(flat, items, pixels):
+
+	# AUC-Judd of every row of flat: the thresholds are the values at the
+	# fixated pixels, the true positive rate the share of fixated pixels at
+	# or above a threshold, and the false positive rate that of the other
+	# pixels. Every row is normalised to [0, 1] and shifted to [2i, 2i+1],
+	# so that the rows sorted one by one are one sorted array, in which one
+	# searchsorted counts the pixels above the thresholds of all rows
+	b, npixels = flat.shape
+	if items.shape[0] == 0:
+		return numpy.full(b, numpy.nan)
+	lo = flat.min(axis=1)
+	span = flat.max(axis=1) - lo
+	span[span == 0] = 1
+	offset = 2.0 * numpy.arange(b)
+	norm = (flat - lo[:,numpy.newaxis]) / span[:,numpy.newaxis] + offset[:,numpy.newaxis]
+	thresholds = numpy.sort(norm[items, pixels])
+	counts = numpy.bincount(items, minlength=b)
+	first = numpy.cumsum(counts) - counts
+	owner = numpy.repeat(numpy.arange(b), counts)
+
+	# pixels of its row at or above every threshold
+	norm.sort(axis=1)
+	above = (owner + 1) * npixels - numpy.searchsorted(norm.ravel(), thresholds, side='left')
+
+	# points of the ROC curve, from the highest threshold of every row down
+	above = above[::-1]
+	owner = owner[::-1]
+	rank = numpy.arange(thresholds.shape[0]) - (thresholds.shape[0] - first - counts)[owner] + 1
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		tp = rank / counts[owner]
+		fp = (above - rank) / (npixels - counts[owner]).astype(float)
+	# the curve starts at (0, 0) in every row, and ends at (1, 1)
+	start = numpy.ones(thresholds.shape[0], dtype=bool)
+	start[1:] = owner[1:] != owner[:-1]
+	ptp = numpy.where(start, 0.0, numpy.roll(tp, 1))
+	pfp = numpy.where(start, 0.0, numpy.roll(fp, 1))
+	area = numpy.bincount(owner, weights=(fp - pfp) * (tp + ptp) / 2, minlength=b)
+	last = numpy.ones(thresholds.shape[0], dtype=bool)
+	last[:-1] = start[1:]
+	area += numpy.bincount(owner[last], weights=(1 - fp[last]) * (1 + tp[last]) / 2, minlength=b)
+	area[counts == 0] = numpy.nan
+
+	return area
+
+
+def batch_metrics(pred, ref=None, fixations=None, metrics=BATCH_METRICS):
+
+	"""Returns saliency metrics of a stack of predicted heatmaps, computed
+	for all heatmaps at once, as a dict of numpy arrays with a value per
+	heatmap (NaN where a metric is undefined, e.g. without fixations)
+
+	nss			-	mean of the standardised prediction at the fixated
+					pixels
+	auc_judd		-	area under the ROC curve of the prediction as a
+					classifier of fixated pixels, thresholded at the
+					values of the fixated pixels
+	cc			-	Pearson correlation with the reference
+	kld			-	KL divergence of the prediction from the reference,
+					both as distributions
+	sim			-	sum of the minimum of the prediction and the
+					reference, both scaled to [0, 1] and then to sum 1
+
+	arguments
+
+	pred			-	(b, H, W) numpy array of predicted heatmaps, without
+					NaN (see iter_chunks)
+
+	keyword arguments
+
+	ref			-	(b, H, W) numpy array of reference heatmaps, needed
+					for cc, kld and sim (default = None)
+	fixations		-	list of the fixations of every heatmap, as dicts from
+					parse_fixations or (x, y) tuples, needed for nss and
+					auc_judd (default = None)
+	metrics		-	names of the metrics to compute (default =
+					BATCH_METRICS)
+	"""
+
+	b = pred.shape[0]
+	flat = pred.reshape(b, -1)
+	result = {}
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+
+		if any(m in FIXATION_METRICS for m in metrics):
+			items, pixels = _fixation_pixels(fixations, pred.shape[1:])
+			counts = numpy.bincount(items, minlength=b)
+		if 'nss' in metrics:
+			mean = flat.mean(axis=1)
+			std = flat.std(axis=1)
+			z = (flat[items, pixels] - mean[items]) / std[items]
+			result['nss'] = numpy.bincount(items, weights=z, minlength=b) / counts
+		if 'auc_judd' in metrics:
+			result['auc_judd'] = _auc_judd(flat, items, pixels)
+
+		if any(m in REFERENCE_METRICS for m in metrics):
+			rflat = ref.reshape(b, -1)
+		if 'cc' in metrics:
+			p = flat - flat.mean(axis=1)[:,numpy.newaxis]
+			r = rflat - rflat.mean(axis=1)[:,numpy.newaxis]
+			result['cc'] = numpy.einsum('ij,ij->i', p, r) / numpy.sqrt(numpy.einsum('ij,ij->i', p, p) * numpy.einsum('ij,ij->i', r, r))
+		if 'kld' in metrics:
+			p = flat / flat.sum(axis=1)[:,numpy.newaxis]
+			r = rflat / rflat.sum(axis=1)[:,numpy.newaxis]
+			result['kld'] = numpy.sum(r * numpy.log(EPS + r / (p + EPS)), axis=1)
+		if 'sim' in metrics:
+			p = _unit_sum(_unit_range(flat))
+			r = _unit_sum(_unit_range(rflat))
+			result['sim'] = numpy.minimum(p, r).sum(axis=1)
+
+	return result
+
+
+def _unit_range(flat):
+
+	# every row scaled to [0, 1]
+	lo = flat.min(axis=1)[:,numpy.newaxis]
+
+	return (flat - lo) / (flat.max(axis=1)[:,numpy.newaxis] - lo)
+
+
+def _unit_sum(flat):
+
+	# every row scaled to sum 1
+	return flat / flat.sum(axis=1)[:,numpy.newaxis]
+
+
+def evaluate(predicted, reference=None, fixations=None, metrics=None, chunkbytes=CHUNK_BYTES):
+
+	"""Returns saliency metrics (see batch_metrics) of every predicted
+	heatmap, reading the heatmaps chunk by chunk (see iter_chunks)
+
+	arguments
+
+	predicted		-	sequence of (H, W) heatmaps, e.g. an (N, H, W)
+					numpy.memmap or [tensors[id] for id in ids] of
+					HeatmapTensors
+
+	keyword arguments
+
+	reference		-	sequence of (H, W) reference heatmaps, e.g. from
+					render_heatmap_array, or None (default = None)
+	fixations		-	sequence of the fixations of every item, e.g. from
+					parse_fixations (None for an item without), or None
+					(default = None)
+	metrics		-	names of the metrics to compute, or None for all that
+					the arguments allow (default = None)
+	chunkbytes		-	see iter_chunks (default = CHUNK_BYTES)
+
+	returns
+
+	result		-	dict of numpy arrays with a value per item
+	"""
+
+	if metrics is None:
+		metrics = [m for m in BATCH_METRICS if (m in FIXATION_METRICS and fixations is not None) \
+			or (m in REFERENCE_METRICS and reference is not None)]
+	for m in metrics:
+		if m not in BATCH_METRICS:
+			raise Exception("ERROR in evaluate: unknown metric '%s'" % m)
+		if m in FIXATION_METRICS and fixations is None:
+			raise Exception("ERROR in evaluate: metric '%s' needs fixations" % m)
+		if m in REFERENCE_METRICS and reference is None:
+			raise Exception("ERROR in evaluate: metric '%s' needs reference heatmaps" % m)
+	for other in (reference, fixations):
+		if other is not None and len(other) != len(predicted):
+			raise Exception("ERROR in evaluate: %d predicted heatmaps, but %d references or fixations" % \
+				(len(predicted), len(other)))
+
+	result = dict((m, numpy.full(len(predicted), numpy.nan)) for m in metrics)
+	for start, pred, ref, fix in iter_chunks(predicted, reference, fixations, chunkbytes=chunkbytes):
+		with instrumentation.stage('saliency_batch', items=pred.shape[0]):
+			values = batch_metrics(pred, ref, fix, metrics=metrics)
+		for m in metrics:
+			result[m][start:start+pred.shape[0]] = values[m]
+
+	return result
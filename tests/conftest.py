@@ -0,0 +1,6 @@
+# The modules under test live in the root of the repository, which is not a
+# package; put it on the path so that the tests run from any directory
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
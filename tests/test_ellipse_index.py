@@ -0,0 +1,43 @@
+# Tests of ellipse_index against testing every point against every ellipse
+# with metrics.checkpoint
+
+import numpy
+
+from ellipse_index import EllipseIndex, MAX_CELLS
+from metrics import checkpoint
+
+
+def brute_force(ellipses, x, y):
+	# (point, ellipse) of every hit, sorted by point and then ellipse
+	h, k, a, b = numpy.asarray(ellipses, dtype=float).T
+	inside = checkpoint(h[numpy.newaxis], k[numpy.newaxis], x[:,numpy.newaxis], y[:,numpy.newaxis], \
+		a[numpy.newaxis], b[numpy.newaxis]) <= 1
+
+	return numpy.nonzero(inside)
+
+
+def test_large_ellipse_among_small_ones():
+	# one ellipse over the whole image among many tiny ones, which set the
+	# cell size: the large one must stay out of the grid
+	rng = numpy.random.default_rng(0)
+	m = 500
+	ellipses = numpy.column_stack([rng.uniform(0, 3000, m), rng.uniform(0, 2500, m), \
+		rng.uniform(0.5, 2, m), rng.uniform(0.5, 2, m)])
+	ellipses = numpy.vstack([ellipses, [[1500, 1250, 1500, 1250], [800, 600, 400, 300]]])
+	index = EllipseIndex(ellipses)
+	assert index._members.shape[0] <= MAX_CELLS * ellipses.shape[0]
+
+	x = numpy.concatenate([rng.uniform(-10, 3010, 5000), ellipses[:50,0], [numpy.nan]])
+	y = numpy.concatenate([rng.uniform(-10, 2510, 5000), ellipses[:50,1], [10.0]])
+	point, ellipse = index.query(x, y)
+	expected = brute_force(ellipses, x, y)
+	numpy.testing.assert_array_equal(point, expected[0])
+	numpy.testing.assert_array_equal(ellipse, expected[1])
+
+
+def test_large_ellipses_stay_in_their_group():
+	ellipses = [[100, 100, 1000, 1000], [100, 100, 10, 10], [100, 100, 1000, 1000]]
+	index = EllipseIndex(ellipses, groups=['a', 'a', 'b'], maxcells=4)
+	assert index.labels_of([100, 500], [100, 100], group='a') == [[0, 1], [0]]
+	assert index.labels_of([100, 500], [100, 100], group='b') == [[2], [2]]
+	numpy.testing.assert_array_equal(index.dwell([100, 500], [100, 100], [2.0, 3.0], group='a'), [5.0, 2.0, 0.0])
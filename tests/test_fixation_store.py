@@ -0,0 +1,128 @@
+# Round trip of fixations_<condition>.pkl files through the store format of
+# fixation_store
+
+import pickle
+
+import numpy
+import pytest
+
+import fixation_store
+from fixation_store import FixationStore, convert, load_condition
+
+
+def synthetic_trial(rng, nsamples, nfixations, words=False, id='P1'):
+	# a trial dict as in the pickle files: gaze columns, metadata and the
+	# Efix events, optionally with a word per fixation
+	stime = numpy.sort(rng.uniform(0, 10000, nfixations))
+	dur = rng.uniform(50, 800, nfixations)
+	efix = [(s, s + d, d, rng.normal(1.0, 0.1), rng.uniform(0, 3000), rng.uniform(0, 2500)) \
+		for s, d in zip(stime.tolist(), dur.tolist())]
+	if words:
+		efix = [f + ('word%d' % i,) for i, f in enumerate(efix)]
+
+	return {'id': id, 'study_id': 's%d' % nsamples, 'image_name': 'dicom_%d' % nsamples, 'trialnr': nfixations,
+		'x': rng.uniform(0, 3000, nsamples), 'y': rng.uniform(0, 2500, nsamples),
+		'pupil_area_normalized': rng.normal(1.0, 0.1, nsamples), 'events': {'Efix': efix, 'Sblk': [(1.0,)]}}
+
+
+@pytest.fixture
+def trials():
+	rng = numpy.random.default_rng(0)
+
+	return [synthetic_trial(rng, 500, 12), synthetic_trial(rng, 0, 0, id='P2'), \
+		synthetic_trial(rng, 300, 7, words=True, id='P3'), synthetic_trial(rng, 40, 0, id='P4')]
+
+
+def write_pickle(folder, condition, data):
+	path = folder / ('fixations_%s.pkl' % condition)
+	with open(path, 'wb') as f:
+		pickle.dump(data, f)
+
+	return str(path)
+
+
+def assert_same_trial(stored, trial):
+	assert stored['id'] == trial['id']
+	assert stored['study_id'] == trial['study_id']
+	assert stored['image_name'] == trial['image_name']
+	assert stored['trialnr'] == trial['trialnr']
+	assert set(stored) == set(trial)
+	for key in ('x', 'y', 'pupil_area_normalized'):
+		assert stored[key].dtype == numpy.float32
+		assert stored[key].shape == trial[key].shape
+		numpy.testing.assert_allclose(stored[key], trial[key], rtol=1e-6)
+
+	# Efix tuples, with the word as a 7th field if the pickle has one
+	efix = stored['events']['Efix']
+	assert list(stored['events']) == ['Efix']
+	assert len(efix) == len(trial['events']['Efix'])
+	for got, expected in zip(efix, trial['events']['Efix']):
+		assert len(got) == len(expected)
+		numpy.testing.assert_allclose(got[:6], expected[:6], rtol=1e-6)
+		assert got[6:] == expected[6:]
+
+
+def test_round_trip(tmp_path, trials):
+	storefile = convert(write_pickle(tmp_path, 'ate', trials))
+	assert storefile.endswith(fixation_store.EXTENSION)
+
+	store = FixationStore(storefile)
+	assert len(store) == len(trials)
+	assert store.gazekeys == ['x', 'y', 'pupil_area_normalized']
+	for trialnr, trial in enumerate(trials):
+		assert_same_trial(store[trialnr], trial)
+		assert store.fixations(trialnr).shape == (len(trial['events']['Efix']), 6)
+	assert_same_trial(store[-1], trials[-1])
+
+	# gaze columns are slices of one memory-mapped array per column
+	assert isinstance(store.array('x'), numpy.memmap)
+	numpy.testing.assert_allclose(store.gaze(2, 'y'), trials[2]['y'], rtol=1e-6)
+	assert store.gaze(1, 'x').shape == (0,)
+
+
+def test_arrays_are_aligned(tmp_path, trials):
+	store = FixationStore(convert(write_pickle(tmp_path, 'ate', trials)))
+	for info in store.header['arrays'].values():
+		assert info['offset'] % fixation_store.ALIGN == 0
+
+
+def test_empty_arrays(tmp_path):
+	# no trial has a sample or a fixation, so every array has length zero
+	rng = numpy.random.default_rng(1)
+	data = [synthetic_trial(rng, 0, 0), synthetic_trial(rng, 0, 0, id='P2')]
+	store = FixationStore(convert(write_pickle(tmp_path, 'cns', data)))
+
+	assert len(store) == 2
+	for trialnr in range(2):
+		assert_same_trial(store[trialnr], data[trialnr])
+		assert store.fixations(trialnr).shape == (0, 6)
+
+
+def test_no_trials(tmp_path):
+	store = FixationStore(convert(write_pickle(tmp_path, 'cns', [])))
+
+	assert len(store) == 0
+	assert store.gazekeys == []
+
+
+def test_not_a_store(tmp_path):
+	path = write_pickle(tmp_path, 'ate', [])
+	with pytest.raises(Exception, match='not a fixation store'):
+		FixationStore(path)
+
+
+def test_load_condition_falls_back_to_pickle(tmp_path, trials):
+	write_pickle(tmp_path, 'ate', trials)
+
+	# only the pickle: the list of trials, as pickled
+	data = load_condition('ate', folder=str(tmp_path))
+	assert isinstance(data, list)
+	assert len(data) == len(trials)
+	assert data[2]['events']['Efix'] == trials[2]['events']['Efix']
+
+	# once converted, the store
+	convert(str(tmp_path / 'fixations_ate.pkl'))
+	store = load_condition('ate', folder=str(tmp_path))
+	assert isinstance(store, FixationStore)
+	for trialnr, trial in enumerate(trials):
+		assert_same_trial(store[trialnr], trial)
@@ -0,0 +1,25 @@
+# Tests of the fixation parsers of gazeplotter_core
+
+import numpy
+
+import gazeplotter_core
+
+
+def test_parse_fixations_words():
+	fixations = [(0.0, 100.0, 100.0, pupil, 10.0 * i, 20.0 * i, 'w%d' % i) \
+		for i, pupil in enumerate([0.9, 1.4, 1.0, 1.3, 0.8])]
+	fix = gazeplotter_core.parse_fixations_words(fixations)
+
+	# only the fixation above the 75th percentile of the pupil size (1.3)
+	numpy.testing.assert_array_equal(fix['x'], [0, 10, 0, 0, 0])
+	numpy.testing.assert_array_equal(fix['y'], [0, 20, 0, 0, 0])
+	numpy.testing.assert_array_equal(fix['pupil'], [0.9, 1.4, 1.0, 1.3, 0.8])
+	assert fix['word'].tolist() == [0, 'w1', 0, 0, 0]
+
+
+def test_parse_fixations_words_empty():
+	fix = gazeplotter_core.parse_fixations_words([])
+
+	assert sorted(fix) == ['pupil', 'word', 'x', 'y']
+	for key in fix:
+		assert fix[key].shape == (0,)
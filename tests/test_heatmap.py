@@ -0,0 +1,234 @@
+# Regression tests of the heatmap accumulation modes of gazeplotter_core,
+# against the original loop that adds a Gaussian for every fixation
+
+import warnings
+
+import numpy
+import pytest
+
+import gazeplotter_core
+
+DISPSIZE = (320, 240)
+
+
+def random_fixations(rng, n, dispsize=DISPSIZE):
+	# Efix tuples (stime, etime, dur, pupil, x, y) spread over the display
+	dur = rng.uniform(50, 800, n)
+	stime = numpy.cumsum(dur + 30) - dur
+	x = rng.uniform(0, dispsize[0], n)
+	y = rng.uniform(0, dispsize[1], n)
+	pupil = rng.normal(1.0, 0.15, n)
+
+	return list(zip(stime, stime + dur, dur, pupil, x, y))
+
+
+def edge_fixations(dispsize=DISPSIZE):
+	# fixations on, just inside and just outside every border of the
+	# display, and far outside it
+	w, h = dispsize
+	xs = [0.0, 0.5, w/2, w - 0.5, w - 1e-9, float(w), -0.5, -150.0, w + 0.5, w + 150.0]
+	ys = [0.0, 0.5, h/2, h - 0.5, h - 1e-9, float(h), -0.5, -150.0, h + 0.5, h + 150.0]
+	x, y = numpy.meshgrid(xs, ys)
+	n = x.size
+
+	return list(zip(numpy.arange(n) * 100.0, numpy.arange(n) * 100.0 + 80, numpy.full(n, 80.0), \
+		numpy.ones(n), x.ravel(), y.ravel()))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_convolve_matches_loop_random(seed):
+	rng = numpy.random.default_rng(seed)
+	fix = gazeplotter_core.fixation_array(random_fixations(rng, 60))
+	loop = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], fix['dur'], DISPSIZE, method='loop')
+	convolve = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], fix['dur'], DISPSIZE, method='convolve')
+
+	assert convolve.shape == loop.shape == (DISPSIZE[1], DISPSIZE[0])
+	numpy.testing.assert_allclose(convolve, loop, rtol=0, atol=1e-9 * loop.max())
+
+
+def test_convolve_matches_loop_edges():
+	fix = gazeplotter_core.fixation_array(edge_fixations())
+	loop = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], fix['dur'], DISPSIZE, method='loop')
+	convolve = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], fix['dur'], DISPSIZE, method='convolve')
+
+	assert loop.max() > 0
+	numpy.testing.assert_allclose(convolve, loop, rtol=0, atol=1e-9 * loop.max())
+
+
+def test_convolve_ignores_fixations_outside_display():
+	# only fixations outside the display: both leave the heatmap empty
+	x = numpy.array([-0.5, -150.0, DISPSIZE[0] + 0.5, 40.0, numpy.nan])
+	y = numpy.array([20.0, 20.0, 20.0, DISPSIZE[1] + 150.0, 20.0])
+	weights = numpy.ones(x.shape[0])
+	for method in ('loop', 'convolve'):
+		heatmap = gazeplotter_core.accumulate_heatmap(x, y, weights, DISPSIZE, method=method)
+		assert not heatmap.any()
+
+
+@pytest.mark.parametrize('pupil', [False, True])
+def test_convolve_matches_loop_masked(pupil):
+	rng = numpy.random.default_rng(3)
+	fixations = random_fixations(rng, 40) + edge_fixations()
+	loop = gazeplotter_core.render_heatmap_array(fixations, DISPSIZE, pupil=pupil, method='loop')
+	convolve = gazeplotter_core.render_heatmap_array(fixations, DISPSIZE, pupil=pupil, method='convolve')
+
+	# same support after masking, and the same values on it
+	numpy.testing.assert_array_equal(numpy.isnan(convolve), numpy.isnan(loop))
+	support = ~numpy.isnan(loop)
+	assert support.any() and not support.all()
+	numpy.testing.assert_allclose(convolve[support], loop[support], rtol=1e-9)
+
+
+def test_convolve_matches_loop_channels():
+	rng = numpy.random.default_rng(4)
+	fix = gazeplotter_core.fixation_array(random_fixations(rng, 30))
+	weights = numpy.stack([fix['dur'], fix['pupil']])
+	loop = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], weights, DISPSIZE, method='loop')
+	convolve = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], weights, DISPSIZE, method='convolve')
+
+	assert loop.shape == (2, DISPSIZE[1], DISPSIZE[0])
+	numpy.testing.assert_allclose(convolve, loop, rtol=0, atol=1e-9 * loop.max())
+
+
+# maximum error of a heatmap accumulated at a lower resolution, relative to
+# the peak of the full-resolution heatmap; what is left is every fixation
+# snapping to the centre of its cell
+SCALE_TOLERANCE = {2: 0.03, 4: 0.05, 8: 0.10}
+
+
+@pytest.mark.parametrize('method', ['loop', 'convolve'])
+@pytest.mark.parametrize('scale', sorted(SCALE_TOLERANCE))
+def test_scale_matches_full_resolution(scale, method):
+	rng = numpy.random.default_rng(5)
+	dispsize = (800, 600)
+	fix = gazeplotter_core.fixation_array(random_fixations(rng, 200, dispsize))
+	full = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], fix['dur'], dispsize, method=method)
+	low = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], fix['dur'], dispsize, method=method, scale=scale)
+
+	assert low.shape == full.shape
+	assert low.dtype == numpy.float32
+	assert numpy.abs(low - full).max() <= SCALE_TOLERANCE[scale] * full.max()
+
+
+@pytest.mark.parametrize('scale', sorted(SCALE_TOLERANCE))
+def test_scale_keeps_fixations_in_place(scale):
+	# the centre of mass of the Gaussian of a single fixation moves by at
+	# most half a cell
+	rng = numpy.random.default_rng(6)
+	dispsize = (800, 600)
+	rows, cols = numpy.indices((dispsize[1], dispsize[0]))
+	for x, y in zip(rng.uniform(100, 700, 20), rng.uniform(100, 500, 20)):
+		full = gazeplotter_core.accumulate_heatmap([x], [y], [1.0], dispsize, method='convolve')
+		low = gazeplotter_core.accumulate_heatmap([x], [y], [1.0], dispsize, method='convolve', scale=scale)
+		for axis in (cols, rows):
+			shift = (low * axis).sum() / low.sum() - (full * axis).sum() / full.sum()
+			assert abs(shift) <= scale / 2.0
+
+
+@pytest.mark.parametrize('scale', [1, 8])
+@pytest.mark.parametrize('method', ['loop', 'convolve'])
+def test_batch_matches_single_trials(method, scale):
+	# trials rendered one after the other on the shared canvas, including
+	# fixations with NaN coordinates or outside the display, and a trial
+	# without any fixation the loop adds
+	rng = numpy.random.default_rng(7)
+	trials = [random_fixations(rng, 25) for i in range(3)]
+	trials[1] = trials[1] + [(0.0, 100.0, 100.0, 1.0, numpy.nan, 50.0), (0.0, 100.0, 100.0, 1.0, 50.0, numpy.nan)]
+	trials.append(edge_fixations())
+	trials.append([(0.0, 100.0, 100.0, 1.0, numpy.nan, numpy.nan), (0.0, 100.0, 100.0, 1.0, -20.0, 20.0)])
+	trials.append(random_fixations(rng, 25))
+	batch = gazeplotter_core.render_heatmaps_batch(trials, DISPSIZE, mask=False, method=method, scale=scale)
+
+	for i, fixations in enumerate(trials):
+		single = gazeplotter_core.render_heatmap_array(fixations, DISPSIZE, mask=False, method=method, scale=scale)
+		numpy.testing.assert_allclose(batch[i], single, rtol=0, atol=1e-6 * max(single.max(), 1))
+
+
+@pytest.mark.parametrize('scale', [2, 4, 8])
+def test_gaze_scale_matches_full_resolution(scale):
+	# a 1 kHz gaze trace that dwells around a few points, binned into
+	# coarser cells and smoothed at that size
+	rng = numpy.random.default_rng(8)
+	dispsize = (800, 600)
+	centres = numpy.column_stack([rng.uniform(100, 700, 12), rng.uniform(100, 500, 12)])
+	current = rng.integers(12, size=20000)
+	x = centres[current,0] + rng.normal(0, 15, current.shape[0])
+	y = centres[current,1] + rng.normal(0, 15, current.shape[0])
+	full = gazeplotter_core.render_gaze_heatmap(gazeplotter_core.sample_chunks(x, y), dispsize, mask=False)
+	low = gazeplotter_core.render_gaze_heatmap(gazeplotter_core.sample_chunks(x, y), dispsize, mask=False, scale=scale)
+
+	# samples fall all over their cells, so that binning them moves
+	# nothing on average and the density map stays within a pixel
+	assert low.shape == full.shape
+	assert numpy.abs(low - full).max() <= 0.03 * full.max()
+	rows, cols = numpy.indices(full.shape)
+	for axis in (cols, rows):
+		shift = (low * axis).sum() / low.sum() - (full * axis).sum() / full.sum()
+		assert abs(shift) <= 1.0
+
+
+@pytest.mark.parametrize('method', ['loop', 'convolve'])
+def test_nan_weight_drops_fixation(method):
+	# a fixation without a pupil size is left out of the pupil heatmap by
+	# both methods, rather than setting its Gaussian (loop) or the whole
+	# map (convolve) to NaN
+	dispsize = (800, 600)
+	fixations = [(0.0, 200.0, 200.0, 1.2, 200.0, 150.0), (300.0, 500.0, 200.0, numpy.nan, 400.0, 300.0), \
+		(600.0, 800.0, 200.0, 0.8, 600.0, 450.0)]
+	heatmap = gazeplotter_core.render_heatmap_array(fixations, dispsize, pupil=True, mask=False, method=method)
+	expected = gazeplotter_core.render_heatmap_array([fixations[0], fixations[2]], dispsize, pupil=True, \
+		mask=False, method=method)
+
+	assert numpy.isfinite(heatmap).all()
+	numpy.testing.assert_allclose(heatmap, expected, rtol=0, atol=1e-9 * expected.max())
+
+	# and masking leaves the Gaussians of the other two fixations
+	masked = gazeplotter_core.render_heatmap_array(fixations, dispsize, pupil=True, method=method)
+	assert not numpy.isnan(masked[150, 200]) and not numpy.isnan(masked[450, 600])
+
+
+def test_nan_weight_drops_fixation_from_its_channel_only():
+	fix = gazeplotter_core.fixation_array([(0.0, 200.0, 200.0, numpy.nan, 100.0, 100.0), \
+		(300.0, 500.0, 200.0, 1.0, 220.0, 140.0)])
+	weights = numpy.stack([fix['dur'], fix['pupil']])
+	for method in ('loop', 'convolve'):
+		stack = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], weights, DISPSIZE, method=method)
+		dur = gazeplotter_core.accumulate_heatmap(fix['x'], fix['y'], fix['dur'], DISPSIZE, method=method)
+		pupil = gazeplotter_core.accumulate_heatmap(fix['x'][1:], fix['y'][1:], fix['pupil'][1:], DISPSIZE, method=method)
+		numpy.testing.assert_allclose(stack[0], dur, rtol=0, atol=1e-9 * dur.max())
+		numpy.testing.assert_allclose(stack[1], pupil, rtol=0, atol=1e-9 * pupil.max())
+
+
+@pytest.mark.parametrize('scale', [1, 4])
+@pytest.mark.parametrize('method', ['loop', 'convolve'])
+@pytest.mark.parametrize('pupil', [False, True])
+def test_phases_sum_to_whole_read(method, scale, pupil):
+	rng = numpy.random.default_rng(9)
+	fixations = random_fixations(rng, 40)
+	phases = gazeplotter_core.render_heatmap_phases(fixations, DISPSIZE, phases=3, pupil=pupil, mask=False, \
+		method=method, scale=scale)
+	whole = gazeplotter_core.render_heatmap_array(fixations, DISPSIZE, pupil=pupil, mask=False, method=method, scale=scale)
+
+	assert phases.shape == (3, DISPSIZE[1], DISPSIZE[0])
+	numpy.testing.assert_allclose(phases.sum(axis=0), whole, rtol=0, atol=1e-6 * whole.max())
+
+	# and every phase is the heatmap of the fixations that start in it
+	phase = gazeplotter_core.fixation_phases(gazeplotter_core.fixation_array(fixations), 3)
+	for k in range(3):
+		alone = gazeplotter_core.render_heatmap_array([f for f, p in zip(fixations, phase) if p == k], DISPSIZE, \
+			pupil=pupil, mask=False, method=method, scale=scale)
+		numpy.testing.assert_allclose(phases[k], alone, rtol=0, atol=1e-6 * whole.max())
+
+
+@pytest.mark.parametrize('method', ['loop', 'convolve'])
+def test_phase_without_fixations(method):
+	# a long pause in the middle of the read leaves the middle phase empty,
+	# which is all zeros, also when masked (without warnings)
+	fixations = [(0.0, 200.0, 200.0, 1.0, 100.0, 100.0), (300.0, 500.0, 200.0, 1.0, 150.0, 120.0), \
+		(9000.0, 9200.0, 200.0, 1.0, 200.0, 140.0)]
+	with warnings.catch_warnings():
+		warnings.simplefilter('error')
+		heatmaps = gazeplotter_core.render_heatmap_phases(fixations, DISPSIZE, phases=3, method=method)
+
+	assert not heatmaps[1].any()
+	assert numpy.isnan(heatmaps[0]).any() and numpy.isnan(heatmaps[2]).any()
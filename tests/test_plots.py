@@ -0,0 +1,97 @@
+# The plots of gazeplotter_core drawn with the Agg backend: the heatmaps
+# that draw_heatmaps blends itself must be the ones Agg draws
+
+import filecmp
+
+import numpy
+import pytest
+
+import gazeplotter_core
+
+gazeplotter_core.use_batch_backend()
+
+DISPSIZE = (240, 180)
+
+
+@pytest.fixture
+def imagefile(tmp_path):
+	from PIL import Image
+	rng = numpy.random.default_rng(0)
+	path = str(tmp_path / 'image.png')
+	Image.fromarray(rng.integers(0, 256, (DISPSIZE[1] - 20, DISPSIZE[0] - 10)).astype(numpy.uint8)).save(path)
+
+	return path
+
+
+@pytest.fixture
+def fixations():
+	rng = numpy.random.default_rng(1)
+
+	return [(300.0 * i, 300.0 * i + 250, 250.0, rng.normal(1, 0.1), rng.uniform(0, DISPSIZE[0]), \
+		rng.uniform(0, DISPSIZE[1])) for i in range(20)]
+
+
+def canvas(fig):
+	fig.canvas.draw()
+	pixels = numpy.array(fig.canvas.buffer_rgba())
+	gazeplotter_core.close_figure(fig)
+
+	return pixels
+
+
+@pytest.mark.parametrize('alpha', [0.0, 0.3, 0.5, 1.0])
+def test_heatmap_to_rgb_matches_agg(imagefile, fixations, alpha):
+	drawn = canvas(gazeplotter_core.draw_heatmap(fixations, DISPSIZE, imagefile=imagefile, alpha=alpha))
+	fig, ax = gazeplotter_core.draw_display(DISPSIZE, imagefile=imagefile)
+	ax.invert_yaxis()
+	background = canvas(fig)[:,:,:3]
+	heatmap = gazeplotter_core.render_heatmap_array(fixations, DISPSIZE)
+
+	rgb = gazeplotter_core.heatmap_to_rgb(heatmap, alpha=alpha, background=background)
+	numpy.testing.assert_array_equal(rgb, drawn[:,:,:3])
+
+
+@pytest.mark.parametrize('extension', ['.jpg', '.png'])
+def test_draw_heatmaps_matches_draw_heatmap(tmp_path, imagefile, fixations, extension):
+	paths = {'dur': str(tmp_path / ('dur' + extension)), 'pupil': str(tmp_path / ('pupil' + extension))}
+	last = canvas(gazeplotter_core.draw_heatmaps(fixations, DISPSIZE, paths, imagefile=imagefile))
+
+	for channel, pupil in (('dur', False), ('pupil', True)):
+		single = str(tmp_path / ('single' + extension))
+		fig = gazeplotter_core.draw_heatmap(fixations, DISPSIZE, imagefile=imagefile, pupil=pupil, savefilename=single)
+		assert filecmp.cmp(paths[channel], single, shallow=False)
+	# the returned Figure holds the last heatmap
+	numpy.testing.assert_array_equal(last, canvas(fig))
+
+
+def test_draw_heatmaps_transparent_display(tmp_path, fixations):
+	# a display that Agg does not draw opaque is drawn by Agg heatmap by
+	# heatmap, with the same files
+	def display(dispsize, imagefile=None):
+		fig, ax = gazeplotter_core.draw_display(dispsize, imagefile=imagefile)
+		ax.images[0].set_alpha(0.5)
+		return fig, ax
+
+	paths = {'dur': str(tmp_path / 'dur.png'), 'count': str(tmp_path / 'count.png')}
+	gazeplotter_core.close_figure(gazeplotter_core.draw_heatmaps(fixations, DISPSIZE, paths, display=display))
+	single = str(tmp_path / 'single.png')
+	gazeplotter_core.close_figure(gazeplotter_core.draw_heatmap(fixations, DISPSIZE, savefilename=single, display=display))
+	assert filecmp.cmp(paths['dur'], single, shallow=False)
+
+
+def test_phase_panels_match_single_phases(tmp_path, imagefile, fixations):
+	# every panel of draw_heatmap with phases is the frame draw_heatmap
+	# draws of the fixations of that phase alone
+	from matplotlib import image
+
+	savefilename = str(tmp_path / 'phases.png')
+	gazeplotter_core.close_figure(gazeplotter_core.draw_heatmap(fixations, DISPSIZE, imagefile=imagefile, phases=3, \
+		savefilename=savefilename))
+	panels = (image.imread(savefilename) * 255).round().astype(numpy.uint8)
+	assert panels.shape[:2] == (DISPSIZE[1], 3 * DISPSIZE[0])
+
+	phase = gazeplotter_core.fixation_phases(gazeplotter_core.fixation_array(fixations), 3)
+	for k in range(3):
+		alone = canvas(gazeplotter_core.draw_heatmap([f for f, p in zip(fixations, phase) if p == k], DISPSIZE, \
+			imagefile=imagefile))
+		numpy.testing.assert_array_equal(panels[:,k*DISPSIZE[0]:(k+1)*DISPSIZE[0]], alone)
@@ -0,0 +1,305 @@
+# Tests of saliency_metrics against straightforward implementations: masks
+# against metrics.checkpoint over the whole raster, and the metrics against
+# per-item reference implementations
+
+import numpy
+import pytest
+
+import gazeplotter_core
+import saliency_metrics
+from metrics import checkpoint
+
+DISPSIZE = (320, 240)
+
+
+def random_ellipses(rng, m):
+	# ellipses all over the display, some of them partly outside of it
+	return numpy.column_stack([rng.uniform(-20, DISPSIZE[0] + 20, m), rng.uniform(-20, DISPSIZE[1] + 20, m), \
+		rng.uniform(1, 60, m), rng.uniform(1, 60, m)])
+
+
+def full_raster(ellipses, dispsize, scale):
+	# every ellipse tested in every cell centre of the display
+	width = -(-dispsize[0] // scale)
+	height = -(-dispsize[1] // scale)
+	xs = (numpy.arange(width) + 0.5) * scale - 0.5
+	ys = (numpy.arange(height) + 0.5) * scale - 0.5
+	mask = numpy.zeros((height, width), dtype=bool)
+	for h, k, a, b in ellipses:
+		if numpy.isfinite([h, k, a, b]).all():
+			mask |= checkpoint(h, k, xs[numpy.newaxis], ys[:,numpy.newaxis], a, b) <= 1
+
+	return mask
+
+
+def rank_auc(scores, positive):
+	# probability that a positive scores above a negative, ties counting half
+	pos = numpy.sort(scores[positive])
+	neg = numpy.sort(scores[~positive])
+	below = numpy.searchsorted(neg, pos, side='left')
+	ties = numpy.searchsorted(neg, pos, side='right') - below
+
+	return numpy.sum(below + 0.5 * ties) / (pos.shape[0] * float(neg.shape[0]))
+
+
+# # # # #
+# MASKS
+
+@pytest.mark.parametrize('scale', [1, 3, 8])
+def test_ellipse_mask_matches_full_raster(scale):
+	rng = numpy.random.default_rng(scale)
+	ellipses = random_ellipses(rng, 12)
+	# a negative axis, an ellipse thinner than a cell, one outside the
+	# display, and a row with a missing value
+	ellipses = numpy.vstack([ellipses, [[100, 80, -30, 20], [50.3, 60.7, 0.2, 40], [-500, -500, 10, 10], \
+		[100, 100, numpy.nan, 10]]])
+
+	mask = saliency_metrics.ellipse_mask(ellipses, DISPSIZE, scale=scale)
+	numpy.testing.assert_array_equal(mask, full_raster(ellipses, DISPSIZE, scale))
+
+
+def test_ellipse_mask_outline_counts_inside():
+	# an ellipse with its outline through pixel centres
+	mask = saliency_metrics.ellipse_mask([[100, 50, 10, 5]], DISPSIZE)
+	assert mask[50,90] and mask[50,110] and mask[45,100] and mask[55,100]
+	assert not mask[50,89] and not mask[44,100]
+	assert not saliency_metrics.ellipse_mask(numpy.zeros((0, 4)), DISPSIZE).any()
+
+
+def test_ellipse_hash_ignores_row_order():
+	rng = numpy.random.default_rng(1)
+	ellipses = random_ellipses(rng, 8)
+	# rows that only differ in their later columns
+	ellipses[1,:2] = ellipses[0,:2]
+	key = saliency_metrics.ellipse_hash(ellipses)
+
+	for _ in range(5):
+		assert saliency_metrics.ellipse_hash(ellipses[rng.permutation(8)]) == key
+	assert saliency_metrics.ellipse_hash(ellipses.tolist()) == key
+	assert saliency_metrics.ellipse_hash(ellipses[1:]) != key
+	changed = ellipses.copy()
+	changed[3,2] += 1e-9
+	assert saliency_metrics.ellipse_hash(changed) != key
+
+
+def test_mask_cache_lru():
+	rng = numpy.random.default_rng(2)
+	sets = [random_ellipses(rng, 3) for _ in range(4)]
+	cache = saliency_metrics.MaskCache(maxsize=2)
+
+	mask = cache.get('a', sets[0], DISPSIZE)
+	numpy.testing.assert_array_equal(mask, saliency_metrics.ellipse_mask(sets[0], DISPSIZE))
+	cache.get('b', sets[1], DISPSIZE)
+	assert (cache.hits, cache.misses, len(cache)) == (0, 2, 2)
+
+	# the same ellipses in another order, and another object with the same
+	# values, hit
+	numpy.testing.assert_array_equal(cache.get('a', sets[0][::-1], DISPSIZE), mask)
+	assert (cache.hits, cache.misses) == (1, 2)
+
+	# a is the most recently used, so adding c evicts b
+	cache.get('c', sets[2], DISPSIZE)
+	assert (cache.hits, cache.misses, len(cache)) == (1, 3, 2)
+	cache.get('a', sets[0], DISPSIZE)
+	assert (cache.hits, cache.misses) == (2, 3)
+	cache.get('b', sets[1], DISPSIZE)
+	assert (cache.hits, cache.misses, len(cache)) == (2, 4, 2)
+	# which evicted c, the least recently used
+	cache.get('a', sets[0], DISPSIZE)
+	cache.get('c', sets[2], DISPSIZE)
+	assert (cache.hits, cache.misses) == (3, 5)
+
+	# the id, the display size and the scale are part of the key
+	cache.get('d', sets[0], DISPSIZE)
+	cache.get('d', sets[0], (DISPSIZE[0], DISPSIZE[1] + 1))
+	cache.get('d', sets[0], DISPSIZE, scale=2)
+	assert (cache.hits, cache.misses, len(cache)) == (3, 8, 2)
+
+	cache.clear()
+	assert len(cache) == 0
+
+
+# # # # #
+# HEATMAP METRICS
+
+def test_heatmap_auc_matches_rank_auc_on_levels():
+	# a heatmap with values in the middle of the AUC_BINS levels (but the
+	# lowest, which holds the zeros of the NaN pixels) is binned without
+	# loss, so the AUC is the exact rank AUC
+	rng = numpy.random.default_rng(3)
+	levels = (rng.integers(1, saliency_metrics.AUC_BINS - 1, DISPSIZE[::-1]) + 0.5) / saliency_metrics.AUC_BINS
+	heatmap = numpy.where(rng.random(DISPSIZE[::-1]) < 0.4, numpy.nan, levels)
+	heatmap[0,0] = 1.0
+	mask = saliency_metrics.ellipse_mask(random_ellipses(rng, 5), DISPSIZE)
+
+	auc = saliency_metrics.heatmap_metrics(heatmap, mask)['auc']
+	assert auc == pytest.approx(rank_auc(numpy.nan_to_num(heatmap), mask), abs=1e-12)
+
+
+def test_heatmap_auc_matches_rank_auc_on_masked_heatmap():
+	# a masked heatmap (NaN below the mean) of fixations around an ellipse
+	rng = numpy.random.default_rng(4)
+	n = 30
+	x = rng.normal(120, 40, n)
+	y = rng.normal(100, 30, n)
+	fixations = [(0, 0, d, 0, xi, yi) for d, xi, yi in zip(rng.uniform(100, 400, n), x, y)]
+	heatmap = gazeplotter_core.render_heatmap_array(fixations, DISPSIZE, mask=True)
+	assert numpy.isnan(heatmap).any()
+	mask = saliency_metrics.ellipse_mask([[120, 100, 50, 35], [250, 60, 20, 20]], DISPSIZE)
+
+	result = saliency_metrics.heatmap_metrics(heatmap, mask)
+	values = numpy.nan_to_num(heatmap)
+	# binning only merges values less than a level apart
+	assert result['auc'] == pytest.approx(rank_auc(values, mask), abs=1e-3)
+	assert result['mass_inside'] == pytest.approx(values[mask].sum() / values.sum())
+	assert result['nss'] == pytest.approx((values[mask].mean() - values.mean()) / values.std())
+
+
+# # # # #
+# BATCH METRICS
+
+def reference_metrics(pred, ref, fix):
+	# the metrics of one item, as in the saliency benchmarks, over the
+	# distinct fixated pixels inside the display
+	pred = numpy.nan_to_num(numpy.asarray(pred, dtype=float))
+	ref = numpy.nan_to_num(numpy.asarray(ref, dtype=float))
+	height, width = pred.shape
+	result = {}
+
+	pixels = set()
+	if fix is not None:
+		for x, y in zip(*((fix['x'], fix['y']) if isinstance(fix, dict) else fix)):
+			if 0 <= x < width and 0 <= y < height:
+				pixels.add((int(y), int(x)))
+	rows, cols = numpy.array(sorted(pixels), dtype=int).reshape(-1, 2).T
+
+	# NSS
+	z = (pred - pred.mean()) / pred.std()
+	result['nss'] = z[rows,cols].mean() if len(pixels) else numpy.nan
+
+	# AUC-Judd: a point of the ROC curve at the value of every fixated pixel
+	if len(pixels):
+		s = (pred - pred.min()) / ((pred.max() - pred.min()) or 1)
+		thresholds = numpy.sort(s[rows,cols])[::-1]
+		tp = [0.0]
+		fp = [0.0]
+		for i, t in enumerate(thresholds):
+			above = numpy.sum(s >= t)
+			tp.append((i + 1) / float(len(pixels)))
+			fp.append((above - i - 1) / float(s.size - len(pixels)))
+		tp.append(1.0)
+		fp.append(1.0)
+		result['auc_judd'] = sum((fp[i+1] - fp[i]) * (tp[i+1] + tp[i]) / 2 for i in range(len(tp) - 1))
+	else:
+		result['auc_judd'] = numpy.nan
+
+	# CC
+	result['cc'] = numpy.corrcoef(pred.ravel(), ref.ravel())[0,1]
+
+	# KLD of the prediction from the reference
+	p = pred / pred.sum()
+	r = ref / ref.sum()
+	result['kld'] = numpy.sum(r * numpy.log(saliency_metrics.EPS + r / (p + saliency_metrics.EPS)))
+
+	# SIM
+	p = (pred - pred.min()) / (pred.max() - pred.min())
+	r = (ref - ref.min()) / (ref.max() - ref.min())
+	result['sim'] = numpy.minimum(p / p.sum(), r / r.sum()).sum()
+
+	return result
+
+
+def random_items(rng, n, shape=(24, 32)):
+	# smooth positive heatmaps with some NaN, plateaus so that AUC-Judd has
+	# ties, and fixations partly outside the display, some of them on the
+	# same pixel
+	height, width = shape
+	yy, xx = numpy.mgrid[0:height,0:width]
+	predicted = []
+	reference = []
+	fixations = []
+	for i in range(n):
+		heatmaps = []
+		for _ in range(2):
+			cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+			heatmap = numpy.exp(-((xx - cx)**2 + (yy - cy)**2) / (2 * rng.uniform(2, 8)**2)) + rng.uniform(0, 0.1, shape)
+			heatmap = numpy.round(heatmap, 1)
+			heatmap[rng.random(shape) < 0.05] = numpy.nan
+			heatmaps.append(heatmap)
+		predicted.append(heatmaps[0])
+		reference.append(heatmaps[1])
+		m = rng.integers(1, 12)
+		x = rng.uniform(-3, width + 3, m)
+		y = rng.uniform(-3, height + 3, m)
+		x[-1] = x[0]
+		y[-1] = y[0]
+		fixations.append({'x': x, 'y': y} if i % 2 else (x, y))
+	# an item without fixations, and one with all fixations outside
+	fixations[1] = None
+	fixations[2] = {'x': numpy.array([-1.0, width + 0.0]), 'y': numpy.array([5.0, 5.0])}
+
+	return predicted, reference, fixations
+
+
+def test_batch_metrics_match_reference_per_item():
+	rng = numpy.random.default_rng(5)
+	predicted, reference, fixations = random_items(rng, 12)
+
+	result = saliency_metrics.evaluate(numpy.array(predicted), numpy.array(reference), fixations)
+	assert sorted(result) == sorted(saliency_metrics.BATCH_METRICS)
+	for i in range(len(predicted)):
+		expected = reference_metrics(predicted[i], reference[i], fixations[i])
+		for m in saliency_metrics.BATCH_METRICS:
+			if numpy.isnan(expected[m]):
+				assert numpy.isnan(result[m][i]), (m, i)
+			else:
+				assert result[m][i] == pytest.approx(expected[m], rel=1e-9, abs=1e-12), (m, i)
+	assert numpy.isnan(result['nss'][1]) and numpy.isnan(result['auc_judd'][2])
+
+
+def test_auc_judd_with_ties():
+	# a fixation on a value that other pixels share counts all of them as
+	# above its threshold
+	pred = numpy.zeros((1, 4, 4))
+	pred[0,0,:] = 1
+	pred[0,1,0] = 0.5
+	fixations = [(numpy.array([0.5, 1.5, 0.5]), numpy.array([0.5, 0.5, 1.5]))]
+
+	auc = saliency_metrics.batch_metrics(pred, fixations=fixations, metrics=('auc_judd',))['auc_judd'][0]
+	assert auc == pytest.approx(reference_metrics(pred[0], pred[0], fixations[0])['auc_judd'])
+	# ROC points (0, 0), (3/13, 1/3), (2/13, 2/3), (2/13, 1), (1, 1): the
+	# first of the two tied thresholds takes the other pixels at 1 as false
+	# positives, and the second gives them back
+	assert auc == pytest.approx(11 / 13.0)
+
+
+@pytest.mark.parametrize('chunkbytes', [1, 40000, 10**9])
+def test_evaluate_independent_of_chunks(tmp_path, chunkbytes):
+	rng = numpy.random.default_rng(6)
+	predicted, reference, fixations = random_items(rng, 10)
+	# a memory-mapped stack, as from HeatmapTensors
+	stack = numpy.lib.format.open_memmap(str(tmp_path / 'pred.npy'), mode='w+', dtype=numpy.float32, \
+		shape=(10,) + predicted[0].shape)
+	stack[:] = predicted
+	stack.flush()
+	predicted = numpy.load(str(tmp_path / 'pred.npy'), mmap_mode='r')
+
+	whole = saliency_metrics.evaluate(predicted, reference, fixations, chunkbytes=10**12)
+	chunked = saliency_metrics.evaluate(predicted, reference, fixations, chunkbytes=chunkbytes)
+	for m in saliency_metrics.BATCH_METRICS:
+		numpy.testing.assert_allclose(chunked[m], whole[m], rtol=1e-12, atol=0)
+
+
+def test_evaluate_heatmaps_of_different_shapes():
+	# a list of heatmaps of two shapes is read in chunks of one shape each
+	rng = numpy.random.default_rng(7)
+	small = random_items(rng, 3)
+	large = random_items(rng, 3, shape=(30, 20))
+	predicted, reference, fixations = [a + b for a, b in zip(small, large)]
+
+	result = saliency_metrics.evaluate(predicted, reference, fixations, chunkbytes=10**9)
+	for i in range(len(predicted)):
+		expected = reference_metrics(predicted[i], reference[i], fixations[i])
+		for m in ('nss', 'cc', 'kld', 'sim'):
+			if not numpy.isnan(expected[m]):
+				assert result[m][i] == pytest.approx(expected[m], rel=1e-9), (m, i)
@@ -0,0 +1,67 @@
+# Export of heatmap tensors by analysis_images_to_folders.run_condition
+
+import time
+import pickle
+
+import numpy
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+import analysis_images_to_folders
+from heatmap_tensors import HeatmapTensors
+
+DISPSIZE = (64, 48)
+
+
+class Resolver:
+
+	# the rows of the master of the synthetic trials, by patient id
+	def lookup(self, study_id, id, dicom_id):
+		return {'id': id, 'split': 'train' if id != 'P3' else 'test', 'image_path': dicom_id + '.jpg',
+			'fixations_path': dicom_id + '_fixations.jpg', 'image_size_x': DISPSIZE[0], 'image_size_y': DISPSIZE[1]}
+
+	def resolve(self, template):
+		return template
+
+
+def write_condition(folder, condition, trials):
+	# a fixations_<condition>.pkl with the given number of Efix events per id
+	rng = numpy.random.default_rng(0)
+	data = []
+	for id, nfixations in trials:
+		efix = [(100.0 * i, 100.0 * i + 80, 80.0, 1.0, rng.uniform(1, DISPSIZE[0] - 1), rng.uniform(1, DISPSIZE[1] - 1)) \
+			for i in range(nfixations)]
+		data.append({'id': id, 'study_id': 's' + id, 'image_name': 'd' + id, 'events': {'Efix': efix}})
+	(folder / 'fixations').mkdir()
+	with open(folder / 'fixations' / ('fixations_%s.pkl' % condition), 'wb') as f:
+		pickle.dump(data, f)
+
+
+def test_shards_are_indexed_when_a_worker_fails(tmp_path, monkeypatch):
+	# the first fixation is left out, so BAD is the trial without fixations
+	write_condition(tmp_path, 'ate', [('P1', 6), ('P2', 6), ('P3', 6), ('BAD', 1)])
+	monkeypatch.chdir(tmp_path)
+
+	# the worker of that trial fails after the others have finished
+	tensor_trial = analysis_images_to_folders.tensor_trial
+	def failing_trial(task):
+		if len(task[0]) == 0:
+			time.sleep(0.2)
+			raise ValueError('worker failed')
+		return tensor_trial(task)
+	monkeypatch.setattr(analysis_images_to_folders, 'tensor_trial', failing_trial)
+
+	tensors = tmp_path / 'tensors'
+	with ThreadPoolExecutor(max_workers=2) as executor:
+		with pytest.raises(ValueError, match='worker failed'):
+			analysis_images_to_folders.run_condition('ate', Resolver(), executor, None, tensors=str(tensors))
+
+	# the heatmaps written before the failure can be read back
+	train = HeatmapTensors(str(tensors / 'ate'), 'train')
+	test = HeatmapTensors(str(tensors / 'ate'), 'test')
+	assert sorted(train.ids) == ['P1', 'P2']
+	assert test.ids == ['P3']
+	for id in ('P1', 'P2'):
+		assert train[id].shape == (DISPSIZE[1], DISPSIZE[0])
+		assert numpy.nanmax(train[id]) == 1